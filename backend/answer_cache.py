@@ -0,0 +1,202 @@
+import itertools
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from query_cache import normalize_query
+
+# Answers kept before the least recently used one is evicted
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+# Seconds before a cached answer is regenerated (0 = never expires)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "0"))
+# Cosine similarity above which a differently-worded question that retrieved
+# exactly the same chunks reuses the answer (0 = exact query match only)
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0"))
+# Most recently used answers of a bucket compared against a differently-worded question
+ANSWER_CACHE_SIMILARITY_SCAN = int(os.getenv("ANSWER_CACHE_SIMILARITY_SCAN", "64"))
+
+# (file filter, retrieved point ids) - the chunks the LLM would be shown
+Bucket = Tuple[Optional[str], frozenset]
+
+
+class AnswerCache:
+    """
+    Final answers + sources keyed on (file filter, rewritten query, retrieved chunk ids).
+
+    WHY include the retrieved point ids: The answer is a function of the
+    chunks in the prompt. If a re-ingest changes what retrieval returns, the
+    key changes too, so a hit can never serve an answer built from different
+    context. invalidate_file() additionally drops entries as soon as a file's
+    points are replaced or deleted.
+
+    WHY the two indexes: get() runs on every query under the lock. Keys are
+    also kept per bucket, so a similarity lookup only compares the answers
+    built from the same chunks (at most ANSWER_CACHE_SIMILARITY_SCAN of
+    them), and in creation order, so expiring stops at the first live entry.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl_seconds: float = ANSWER_CACHE_TTL,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        similarity_scan: int = ANSWER_CACHE_SIMILARITY_SCAN,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.similarity_scan = similarity_scan
+        # (bucket, normalized query) -> entry, least recently used first
+        self._entries: "OrderedDict[Tuple[Bucket, str], Dict]" = OrderedDict()
+        # The same keys, oldest created first
+        self._by_age: "OrderedDict[Tuple[Bucket, str], None]" = OrderedDict()
+        # bucket -> its keys, least recently used first
+        self._by_bucket: "Dict[Bucket, OrderedDict[Tuple[Bucket, str], None]]" = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(
+        self,
+        file_uuid: Optional[str],
+        search_query: str,
+        point_ids: Iterable[str],
+        query_vector: Optional[List[float]] = None,
+    ) -> Optional[Dict]:
+        bucket = (file_uuid, frozenset(point_ids))
+        key = (bucket, normalize_query(search_query))
+        with self._lock:
+            self._drop_expired()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._touch(key)
+                self.hits += 1
+                return entry
+
+            if self.similarity_threshold and query_vector is not None:
+                entry_key = self._nearest(bucket, query_vector)
+                if entry_key is not None:
+                    self._touch(entry_key)
+                    self.near_hits += 1
+                    return self._entries[entry_key]
+
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        file_uuid: Optional[str],
+        search_query: str,
+        point_ids: Iterable[str],
+        answer: str,
+        sources: List[Dict],
+        source_files: Iterable[str] = (),
+        query_vector: Optional[List[float]] = None,
+    ):
+        bucket = (file_uuid, frozenset(point_ids))
+        key = (bucket, normalize_query(search_query))
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            # Stored unit length: a similarity lookup is one dot product per entry
+            vector = vector / np.linalg.norm(vector)
+        entry = {
+            "answer": answer,
+            "sources": sources,
+            "files": {f for f in source_files if f} | ({file_uuid} if file_uuid else set()),
+            "vector": vector,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._by_age[key] = None
+            self._by_bucket.setdefault(bucket, OrderedDict())[key] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_file(self, file_uuid: str) -> int:
+        """Drop every answer that was filtered to, or built from chunks of, this file."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if file_uuid in entry["files"]]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def _touch(self, key: Tuple[Bucket, str]):
+        self._entries.move_to_end(key)
+        self._by_bucket[key[0]].move_to_end(key)
+
+    def _remove(self, key: Tuple[Bucket, str]):
+        del self._entries[key]
+        del self._by_age[key]
+        keys = self._by_bucket[key[0]]
+        del keys[key]
+        if not keys:
+            del self._by_bucket[key[0]]
+
+    def _nearest(self, bucket: Bucket, query_vector: List[float]):
+        keys = self._by_bucket.get(bucket)
+        if not keys:
+            return None
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+        best_key, best_score = None, self.similarity_threshold
+        # Most recently used first, so the cap drops the answers least likely to be asked again
+        for key in itertools.islice(reversed(keys), self.similarity_scan):
+            vector = self._entries[key]["vector"]
+            if vector is None:
+                continue
+            score = float(np.dot(query, vector))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def _drop_expired(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        while self._by_age:
+            key = next(iter(self._by_age))
+            if self._entries[key]["created_at"] >= cutoff:
+                break
+            self._remove(key)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds or None,
+            "similarity_threshold": self.similarity_threshold or None,
+            "similarity_scan": self.similarity_scan,
+            "buckets": len(self._by_bucket),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared by the query endpoints and ingestion (which invalidates it)
+answer_cache = AnswerCache()
+
+
+def split_for_replay(answer: str) -> List[str]:
+    """
+    Split a cached answer into word-sized tokens for SSE replay.
+
+    WHY: The frontend renders `token` events incrementally; replaying a hit
+    the same way means it cannot tell a cached answer from a fresh one.
+    """
+    return re.findall(r"\s*\S+|\s+$", answer)
@@ -0,0 +1,92 @@
+"""
+Run a list of questions through /query_batch and write the answers as JSON lines.
+
+Run from backend/ (with the API running):
+    python -m batch_query questions.txt --document-set contracts > answers.jsonl
+    python -m batch_query questions.jsonl --file <uuid> --file <uuid> --output answers.jsonl
+
+Input is one question per line, or JSON lines with a "query" field; the
+other fields of such a line (an id, an expected answer) are copied to its
+output line. Questions are sent --batch-size at a time; every output line
+carries the question's position in the input ("index"), lines are written
+as answers arrive. Progress goes to stderr; the exit status is 1 if any
+question failed.
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+
+def read_questions(path: str) -> List[Dict]:
+    questions = []
+    with open(path, encoding="utf-8") if path != "-" else sys.stdin as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                questions.append(json.loads(line))
+            else:
+                questions.append({"query": line})
+    return questions
+
+
+def run_batches(args, questions: List[Dict], out) -> int:
+    scope = {"file_uuids": args.files or None, "document_set": args.document_set}
+    errors = 0
+    started = time.perf_counter()
+    with httpx.Client(base_url=args.url, timeout=httpx.Timeout(args.timeout)) as client:
+        for offset in range(0, len(questions), args.batch_size):
+            batch = questions[offset:offset + args.batch_size]
+            body = {
+                "queries": [question["query"] for question in batch],
+                "k": args.k,
+                "concurrency": args.concurrency,
+                **scope,
+            }
+            with client.stream("POST", "/query_batch", json=body) as response:
+                if response.status_code != 200:
+                    response.read()
+                    print(f"❌ Batch at {offset} rejected: {response.status_code} {response.text}", file=sys.stderr)
+                    return 1
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    if result.get("done"):
+                        continue
+                    extra = {key: value for key, value in batch[result["index"]].items() if key != "query"}
+                    result["index"] += offset
+                    errors += "error" in result
+                    out.write(json.dumps({**extra, **result}) + "\n")
+                    out.flush()
+            answered = min(offset + args.batch_size, len(questions))
+            print(f"answered {answered}/{len(questions)} ({errors} errors, "
+                  f"{answered / (time.perf_counter() - started):.2f} questions/s)", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a list of questions with /query_batch")
+    parser.add_argument("questions", help="text or JSON lines file ('-' = stdin)")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--file", dest="files", action="append", help="file_uuid to search (repeatable)")
+    parser.add_argument("--document-set", help="named document set to search")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, help="simultaneous LLM generations (server default)")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds without data before giving up")
+    parser.add_argument("--output", help="write here instead of stdout")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            status = run_batches(args, questions, out)
+    else:
+        status = run_batches(args, questions, sys.stdout)
+    sys.exit(status)
@@ -0,0 +1,51 @@
+"""
+Chat-history database throughput under concurrent conversations.
+
+Every simulated chat repeats what /query_file_stream does per turn: load the
+last 10 messages, store the human message, store the assistant answer.
+
+Run from backend/:
+    python -m benchmarks.bench_db --chats 50 --turns 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import database
+
+
+async def run_chat(turns: int, latencies: list):
+    conversation_id = await database.create_conversation()
+    for turn in range(turns):
+        await database.get_conversation_messages(conversation_id, limit=10)
+        for role, content in (("human", f"question {turn}"), ("assistant", "answer " * 50)):
+            start = time.perf_counter()
+            await database.add_message(conversation_id, role, content, sources=[{"score": 1.0}])
+            latencies.append(time.perf_counter() - start)
+
+
+async def main(chats: int, turns: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        await database.init_db(os.path.join(tmp, "bench.db"))
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(run_chat(turns, latencies) for _ in range(chats)))
+        elapsed = time.perf_counter() - start
+        await database.close_db()
+
+    latencies.sort()
+    print(f"chats={chats} turns={turns} messages={len(latencies)}")
+    print(f"messages/sec: {len(latencies) / elapsed:.1f}")
+    print(f"add_message p50: {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"add_message p95: {latencies[int(len(latencies) * 0.95)] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.turns))
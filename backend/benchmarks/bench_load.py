@@ -0,0 +1,429 @@
+"""
+End-to-end load test of the API: ingestion plus concurrent streaming queries.
+
+Boots main:app with uvicorn in a subprocess, in a temporary working
+directory (own chat_history.db, uploaded_pdfs/ and caches), with Qdrant in
+local mode (QDRANT_PATH) and Ollama replaced by benchmarks.fake_ollama at a
+fixed token rate. The embedding models are the real ones. Then:
+
+  1. ingest  uploads --docs synthetic PDFs (benchmarks.synthetic_pdfs),
+             --upload-concurrency at a time, and waits for their jobs
+  2. query   --concurrency simultaneous chats of --turns questions each
+             send --queries requests to /query_file_stream in total
+
+and reports p50/p95/p99 latency, time to first token, requests/sec, the
+server's RSS and the mean of every stage from /metrics.
+
+--save-baseline NAME stores the report in benchmarks/baselines/NAME.json;
+--baseline NAME compares against it and exits with status 1 if a metric is
+worse by more than --tolerance. Baselines are machine-specific: record them
+on the machine that runs the comparison.
+
+Run from backend/:
+    python -m benchmarks.bench_load --docs 8 --pages 10 --queries 200 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.fake_ollama import WORDS, FakeOllama, serve
+from benchmarks.synthetic_pdfs import generate
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+
+# Metrics compared against a baseline, and which direction is a regression
+LOWER_IS_BETTER = (
+    "ingest.latency_ms.p50", "ingest.latency_ms.p95",
+    "query.latency_ms.p50", "query.latency_ms.p95", "query.latency_ms.p99",
+    "query.ttft_ms.p50", "query.ttft_ms.p95", "query.ttft_ms.p99",
+    "rss_mb.peak",
+)
+HIGHER_IS_BETTER = ("ingest.docs_per_min", "query.rps")
+
+
+def percentiles(seconds: List[float]) -> Dict[str, Optional[float]]:
+    """Nearest-rank p50/p95/p99 in milliseconds."""
+    if not seconds:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(seconds)
+
+    def rank(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99)}
+
+
+class RssSampler(threading.Thread):
+    """Samples a process's resident memory (Linux /proc) until stopped."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[float] = []
+        self._done = threading.Event()
+
+    def read(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+        return None
+
+    def run(self):
+        while not self._done.is_set():
+            rss = self.read()
+            if rss is not None:
+                self.samples.append(rss)
+            self._done.wait(self.interval)
+
+    def mark(self) -> Optional[float]:
+        rss = self.read()
+        return round(rss, 1) if rss is not None else None
+
+    def stop(self) -> Dict[str, Optional[float]]:
+        self._done.set()
+        self.join()
+        if not self.samples:
+            return {"peak": None, "end": None}
+        return {"peak": round(max(self.samples), 1), "end": round(self.samples[-1], 1)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: Path, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    server_env = {
+        **os.environ,
+        **env,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(BACKEND_DIR), os.environ.get("PYTHONPATH")])),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=server_env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float) -> float:
+    """Wait until the app serves requests and its models are loaded."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            response = await client.get("/health")
+            if response.status_code == 200 and response.json()["models"]["ready"]:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"Server not ready after {timeout:.0f}s")
+
+
+async def ingest(client: httpx.AsyncClient, paths: List[Path], pages: int, concurrency: int) -> Dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    file_uuids: List[str] = []
+    failed = 0
+
+    async def upload(path: Path):
+        nonlocal failed
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(
+                "/upload_pdf", files={"file": (path.name, path.read_bytes(), "application/pdf")}
+            )
+            body = response.json()
+            status_url = body.get("status_url")
+            while status_url:
+                job = (await client.get(status_url)).json()
+                if job["status"] in ("completed", "failed"):
+                    break
+                await asyncio.sleep(0.1)
+            else:
+                job = {"status": "completed" if response.status_code < 300 else "failed"}
+            if job["status"] == "completed":
+                latencies.append(time.perf_counter() - started)
+                file_uuids.append(body["uuid"])
+            else:
+                failed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(upload(path) for path in paths))
+    elapsed = time.perf_counter() - started
+    return {
+        "docs": len(paths),
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "docs_per_min": round(len(latencies) / elapsed * 60, 2),
+        "pages_per_sec": round(len(latencies) * pages / elapsed, 2),
+        "latency_ms": percentiles(latencies),
+        "file_uuids": file_uuids,
+    }
+
+
+def question(rng: random.Random, follow_up: bool) -> str:
+    if follow_up:
+        return f"And what about the {rng.choice(WORDS)}?"
+    a, b, c = rng.sample(WORDS, 3)
+    return f"What does the document say about the {a} {b} and its {c}?"
+
+
+async def ask(client: httpx.AsyncClient, body: Dict):
+    """One streaming query: (conversation id or None on error, TTFT, latency)."""
+    started = time.perf_counter()
+    ttft = None
+    event = None
+    conversation_id = None
+    async with client.stream("POST", "/query_file_stream", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return None, None, None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "token" and ttft is None:
+                    ttft = time.perf_counter() - started
+                elif event == "error":
+                    return None, None, None
+            elif line.startswith("data: ") and event == "done":
+                conversation_id = json.loads(line[len("data: "):])["conversation_id"]
+    return conversation_id, ttft, time.perf_counter() - started
+
+
+async def run_queries(
+    client: httpx.AsyncClient,
+    file_uuids: List[str],
+    queries: int,
+    concurrency: int,
+    turns: int,
+    seed: int
+) -> Dict:
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    remaining = queries
+
+    async def chat_worker(worker: int):
+        nonlocal errors, remaining
+        rng = random.Random(seed * 1000 + worker)
+        while remaining > 0:
+            conversation_id = None
+            file_uuid = rng.choice(file_uuids + [None])
+            for turn in range(turns):
+                if remaining <= 0:
+                    return
+                remaining -= 1
+                body = {
+                    "query": question(rng, follow_up=turn > 0),
+                    "file_uuid": file_uuid,
+                    "conversation_id": conversation_id,
+                }
+                try:
+                    conversation_id, ttft, latency = await ask(client, body)
+                except httpx.HTTPError:
+                    conversation_id = None
+                if conversation_id is None:
+                    errors += 1
+                    break  # start a new chat
+                latencies.append(latency)
+                if ttft is not None:  # answer cache hits stream one token too
+                    ttfts.append(ttft)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat_worker(worker) for worker in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": percentiles(latencies),
+        "ttft_ms": percentiles(ttfts),
+    }
+
+
+def stage_means(metrics_text: str) -> Dict[str, float]:
+    """Mean milliseconds per stage from /metrics (_sum / _count)."""
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        match = re.match(r'(rag_\w+_stage_seconds)_(sum|count)\{(.*)\} (\S+)', line)
+        if not match:
+            continue
+        name, kind, labels, value = match.groups()
+        stage = re.search(r'stage="([^"]+)"', labels).group(1)
+        endpoint = re.search(r'endpoint="([^"]+)"', labels)
+        key = f"{endpoint.group(1) if endpoint else 'ingest'}.{stage}"
+        (sums if kind == "sum" else counts)[key] = float(value)
+    return {key: round(sums[key] / counts[key] * 1000, 2) for key in sums if counts.get(key)}
+
+
+async def run(args) -> Dict:
+    fake = FakeOllama(args.slots, args.prefill_rate, args.token_rate, args.answer_tokens)
+    ollama = serve(fake)
+    port = free_port()
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+        workdir = Path(tmp)
+        paths = generate(workdir / "synthetic", args.docs, args.pages, args.seed)
+        env = {
+            "QDRANT_PATH": args.qdrant_path if args.qdrant_path == ":memory:" else str(workdir / "qdrant"),
+            "OLLAMA_BASE_URL": f"http://127.0.0.1:{ollama.server_address[1]}",
+            # Cold caches, so runs are comparable
+            "EMBEDDING_CACHE_PATH": "",
+            "QUERY_CACHE_DISK_PATH": "",
+            **dict(item.split("=", 1) for item in args.env),
+        }
+        server = start_server(workdir, port, env)
+        rss = RssSampler(server.pid)
+        try:
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{port}",
+                timeout=httpx.Timeout(300.0),
+                limits=httpx.Limits(max_connections=args.concurrency + args.upload_concurrency + 4),
+            ) as client:
+                startup_seconds = await wait_ready(client, server, args.startup_timeout)
+                rss.start()
+                rss_ready = rss.mark()
+                print(f"server ready in {startup_seconds:.1f}s, RSS {rss_ready} MB")
+
+                ingest_report = await ingest(client, paths, args.pages, args.upload_concurrency)
+                print(f"ingested {ingest_report['docs'] - ingest_report['failed']}/{ingest_report['docs']} docs")
+                file_uuids = ingest_report.pop("file_uuids")
+                if not file_uuids:
+                    raise RuntimeError("No document was ingested")
+
+                query_report = await run_queries(
+                    client, file_uuids, args.queries, args.concurrency, args.turns, args.seed
+                )
+                stages = stage_means((await client.get("/metrics")).text)
+        finally:
+            rss_report = rss.stop() if rss.is_alive() else {"peak": None, "end": None}
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            ollama.shutdown()
+
+    return {
+        "config": {
+            "docs": args.docs, "pages": args.pages, "queries": args.queries,
+            "concurrency": args.concurrency, "turns": args.turns,
+            "upload_concurrency": args.upload_concurrency, "token_rate": args.token_rate,
+            "prefill_rate": args.prefill_rate, "answer_tokens": args.answer_tokens,
+            "slots": args.slots, "qdrant_path": args.qdrant_path, "env": sorted(args.env),
+        },
+        "startup_seconds": round(startup_seconds, 2),
+        "ingest": ingest_report,
+        "query": query_report,
+        "rss_mb": {"ready": rss_ready, **rss_report},
+        "stages_ms": stages,
+        "llm": {"requests": fake.requests, "prompt_tokens": fake.prompt_tokens, "prefilled_tokens": fake.prefilled_tokens},
+    }
+
+
+def lookup(report: Dict, dotted: str):
+    value = report
+    for part in dotted.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Metrics worse than the baseline by more than `tolerance` (relative)."""
+    if report["config"] != baseline["config"]:
+        print("⚠️ Baseline was recorded with a different configuration")
+    regressions = []
+    for names, worse in ((LOWER_IS_BETTER, lambda new, old: new > old * (1 + tolerance)),
+                         (HIGHER_IS_BETTER, lambda new, old: new < old * (1 - tolerance))):
+        for name in names:
+            new, old = lookup(report, name), lookup(baseline, name)
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            flag = "REGRESSION" if worse(new, old) else "ok"
+            print(f"  {name:<24}{old:>12.1f} -> {new:>10.1f} ({change:+.1%}) {flag}")
+            if worse(new, old):
+                regressions.append(name)
+    return regressions
+
+
+def print_report(report: Dict):
+    ingest_report, query_report, rss = report["ingest"], report["query"], report["rss_mb"]
+    print(f"ingest  docs={ingest_report['docs']} failed={ingest_report['failed']} "
+          f"{ingest_report['docs_per_min']} docs/min {ingest_report['pages_per_sec']} pages/s "
+          f"latency ms {ingest_report['latency_ms']}")
+    print(f"query   requests={query_report['requests']} errors={query_report['errors']} "
+          f"{query_report['rps']} req/s")
+    print(f"        latency ms {query_report['latency_ms']}")
+    print(f"        ttft ms    {query_report['ttft_ms']}")
+    print(f"rss MB  ready={rss['ready']} peak={rss['peak']} end={rss['end']}")
+    for stage, ms in sorted(report["stages_ms"].items()):
+        print(f"  {stage:<40}{ms:>10.2f} ms")
+
+
+def main(args) -> int:
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        path = BASELINE_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Baseline saved to {path}")
+    if args.baseline:
+        baseline = json.loads((BASELINE_DIR / f"{args.baseline}.json").read_text())
+        print(f"Compared with baseline '{args.baseline}' (tolerance {args.tolerance:.0%}):")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+            return 1
+        print("✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous chats")
+    parser.add_argument("--turns", type=int, default=4, help="questions per chat")
+    parser.add_argument("--token-rate", type=float, default=50, help="fake Ollama tokens/sec per stream")
+    parser.add_argument("--prefill-rate", type=float, default=5000, help="fake Ollama prompt tokens/sec")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--slots", type=int, default=4, help="fake Ollama parallel slots")
+    parser.add_argument("--qdrant-path", default=":memory:", help='":memory:" or "disk" (temporary directory)')
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server environment, e.g. SPECULATIVE_RETRIEVAL=off")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--output", help="also write the report as JSON here")
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--baseline", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
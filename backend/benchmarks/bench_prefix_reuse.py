@@ -0,0 +1,125 @@
+"""
+Prefill tokens saved by KV-cache reuse across the turns of a conversation.
+
+Starts a fake Ollama server (benchmarks.fake_ollama) that, like Ollama's
+runner, keeps the tokens of the last prompt + answer per slot and only
+prefills what a new request does not share with one of them. Multi-turn
+chats are then sent through build_answer_prompt and OllamaSessions in
+three layouts:
+
+  volatile-first  instructions, retrieved context, question, then history
+                  (the layout before the prompt was split)
+  prefix          instructions + history first, context + question last
+  context         prefix layout, continuing from the previous turn's
+                  Ollama `context` (OLLAMA_CONTEXT_REUSE=1)
+
+History follows the app's defaults: a rolling summary replaces older turns
+(see conversation_summary). Tokens are whitespace-separated words. With
+fewer --slots (OLLAMA_NUM_PARALLEL) than active chats the chats evict each
+other's cache, as they do in Ollama.
+
+Run from backend/:
+    python -m benchmarks.bench_prefix_reuse --chats 4 --turns 8
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+from benchmarks.fake_ollama import WORDS, FakeOllama, serve
+from conversation_summary import SUMMARY_FOLD_MESSAGES, SUMMARY_KEEP_MESSAGES
+from llm_session import OllamaSessions
+from prompt_builder import ANSWER_PREFIX, ANSWER_PREFIX_WITH_HISTORY, build_answer_prompt
+
+
+def volatile_first(prompt: str, stats: dict) -> str:
+    """Rebuild the old order: instructions, context + question, history."""
+    prefix, turn = prompt[:stats["stable_prefix_chars"]], prompt[stats["stable_prefix_chars"]:]
+    head = ANSWER_PREFIX_WITH_HISTORY.template.split("{history}")[0]
+    if not prefix.startswith(head):
+        return prompt  # no history
+    history = prefix[len(head):]
+    return ANSWER_PREFIX.format() + turn + "\n\nPrevious conversation:\n" + history
+
+
+def chunk(rng: random.Random) -> dict:
+    return {"content": " ".join(rng.choices(WORDS, k=120))}
+
+
+def run_mode(mode: str, base_url: str, fake: FakeOllama, chats: int, turns: int, seed: int):
+    rng = random.Random(seed)
+    sessions = OllamaSessions(base_url=base_url, context_reuse=mode == "context")
+    conversations = [{"id": str(uuid.uuid4()), "summary": None, "messages": []} for _ in range(chats)]
+    fake.reset()
+    ttfts = []
+
+    # Round-robin over the chats, like concurrent users sharing the server
+    for turn in range(turns):
+        for conversation in conversations:
+            history = list(conversation["messages"])
+            if conversation["summary"]:
+                history.insert(0, {"role": "summary", "content": conversation["summary"]})
+            question = f"question {turn}: " + " ".join(rng.choices(WORDS, k=10)) + "?"
+            prompt, stats = build_answer_prompt(question, [chunk(rng) for _ in range(4)], history)
+            if mode == "volatile-first":
+                prompt = volatile_first(prompt, stats)
+
+            started = time.perf_counter()
+            first = None
+            parts = []
+            for token in sessions.stream(
+                prompt, stats["stable_prefix_chars"], conversation["id"], history
+            ):
+                if first is None:
+                    first = time.perf_counter() - started
+                parts.append(token)
+            ttfts.append(first)
+
+            conversation["messages"] += [
+                {"role": "human", "content": question},
+                {"role": "assistant", "content": "".join(parts)},
+            ]
+            # Same folding rule as ConversationSummarizer, with a stand-in summary
+            if len(conversation["messages"]) >= SUMMARY_KEEP_MESSAGES + SUMMARY_FOLD_MESSAGES:
+                conversation["summary"] = f"summary after turn {turn}: " + " ".join(rng.choices(WORDS, k=100))
+                conversation["messages"] = conversation["messages"][-SUMMARY_KEEP_MESSAGES:]
+
+    return {
+        "mode": mode,
+        "requests": len(ttfts),
+        "prompt_tokens": fake.prompt_tokens,
+        "prefilled": fake.prefilled_tokens,
+        "saved": 1 - fake.prefilled_tokens / fake.prompt_tokens,
+        "ttft_ms": statistics.fmean(ttfts) * 1000,
+        "context_reused": sessions.counts["context_reused"],
+    }
+
+
+def main(chats: int, turns: int, slots: int, prefill_rate: float, token_rate: float, answer_tokens: int):
+    fake = FakeOllama(slots, prefill_rate, token_rate, answer_tokens)
+    server = serve(fake)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"chats={chats} turns={turns} slots={slots} prefill={prefill_rate:.0f} tok/s")
+    print(f"{'mode':<16}{'requests':>9}{'prompt tok':>12}{'prefilled':>11}{'saved':>8}{'ttft ms':>10}{'ctx reuse':>11}")
+    try:
+        for mode in ("volatile-first", "prefix", "context"):
+            r = run_mode(mode, base_url, fake, chats, turns, seed=42)
+            print(
+                f"{r['mode']:<16}{r['requests']:>9}{r['prompt_tokens']:>12}{r['prefilled']:>11}"
+                f"{r['saved']:>8.1%}{r['ttft_ms']:>10.1f}{r['context_reused']:>11}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--slots", type=int, default=4, help="like OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--prefill-rate", type=float, default=5000, help="prompt tokens/sec")
+    parser.add_argument("--token-rate", type=float, default=2000, help="generated tokens/sec")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    args = parser.parse_args()
+    main(args.chats, args.turns, args.slots, args.prefill_rate, args.token_rate, args.answer_tokens)
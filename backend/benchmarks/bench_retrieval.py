@@ -0,0 +1,208 @@
+"""
+Recall vs latency of the hybrid query under HNSW and quantization settings.
+
+Needs a Qdrant server (--url, default QDRANT_URL): local mode has no HNSW
+graph, quantization or payload index. For every combination of --m,
+--ef-construct and --quantization a scratch collection is built with
+--points synthetic chunks (clustered unit vectors for the dense side, Zipf
+distributed terms for the sparse side, spread over --files files). Once
+Qdrant has indexed it, the hybrid query of retrieval.hybrid_search (dense +
+sparse prefetch, RRF) runs at every --ef, unfiltered and filtered by one
+file, and is compared with the same query using exact dense search.
+Then the file_uuid payload index is dropped and the filtered queries repeat,
+to show what the index saves.
+
+  recall   share of the exact top --k the query also returns
+  p50/p95  query latency in ms (sequential, one query in flight)
+
+Run from backend/:
+    python -m benchmarks.bench_retrieval --points 100000 --quantization none scalar binary --ef 32 64 128
+"""
+import argparse
+import itertools
+import os
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from collection import DENSE_SIZE, dense_search_params, hnsw_config, quantization_config
+
+UPSERT_BATCH = 512
+SPARSE_VOCAB = 30000
+
+
+class Corpus:
+    """Deterministic synthetic points and queries that have true neighbours."""
+
+    def __init__(self, points: int, files: int, seed: int):
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.points = points
+        self.centers = self._unit(rng.standard_normal((max(points // 200, 8), DENSE_SIZE)))
+        self.file_uuids = [str(uuid.UUID(int=int(rng.integers(2**63)))) for _ in range(files)]
+        # Zipf-like term weights, like a real vocabulary
+        self.term_p = 1 / np.arange(1, SPARSE_VOCAB + 1) ** 1.1
+        self.term_p /= self.term_p.sum()
+
+    @staticmethod
+    def _unit(vectors: np.ndarray) -> np.ndarray:
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def dense(self, rng: np.random.Generator, n: int, spread: float = 2.0) -> np.ndarray:
+        centers = self.centers[rng.integers(len(self.centers), size=n)]
+        noise = rng.standard_normal((n, DENSE_SIZE)) / np.sqrt(DENSE_SIZE)
+        return self._unit(centers + spread * noise)
+
+    def sparse(self, rng: np.random.Generator, terms: int = 40) -> models.SparseVector:
+        indices = np.unique(rng.choice(SPARSE_VOCAB, size=terms, p=self.term_p))
+        return models.SparseVector(indices=indices.tolist(), values=rng.random(len(indices)).tolist())
+
+    def batches(self):
+        """The same points on every call, so every configuration indexes the same corpus."""
+        for start in range(0, self.points, UPSERT_BATCH):
+            rng = np.random.default_rng((self.seed, start))
+            n = min(UPSERT_BATCH, self.points - start)
+            dense = self.dense(rng, n)
+            yield [
+                models.PointStruct(
+                    id=start + i,
+                    vector={"dense": dense[i].tolist(), "sparse": self.sparse(rng)},
+                    payload={
+                        "text": f"chunk {start + i}",
+                        "file_uuid": self.file_uuids[(start + i) % len(self.file_uuids)],
+                    },
+                )
+                for i in range(n)
+            ]
+
+    def queries(self, n: int):
+        rng = np.random.default_rng((self.seed, self.points))
+        dense = self.dense(rng, n)
+        return [(dense[i].tolist(), self.sparse(rng, 12)) for i in range(n)]
+
+
+def build(client: QdrantClient, name: str, corpus: Corpus, m: int, ef_construct: int, quantization: str, on_disk: bool):
+    client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config={"dense": models.VectorParams(
+            size=DENSE_SIZE, distance=models.Distance.COSINE, on_disk=on_disk,
+            quantization_config=quantization_config(quantization),
+        )},
+        sparse_vectors_config={"sparse": models.SparseVectorParams(
+            index=models.SparseIndexParams(on_disk=on_disk)
+        )},
+        hnsw_config=hnsw_config(m, ef_construct, on_disk=False),
+    )
+    client.create_payload_index(name, "file_uuid", models.PayloadSchemaType.KEYWORD, wait=True)
+    started = time.perf_counter()
+    for batch in corpus.batches():
+        client.upsert(name, points=batch, wait=False)
+    # Wait for the optimizer to build HNSW + quantized vectors: green, and
+    # the indexed count settled (green can show before optimization starts)
+    indexed = -1
+    while True:
+        time.sleep(1)
+        info = client.get_collection(name)
+        if info.status == models.CollectionStatus.GREEN and info.indexed_vectors_count == indexed:
+            return time.perf_counter() - started
+        indexed = info.indexed_vectors_count
+
+
+def hybrid(
+    client: QdrantClient,
+    name: str,
+    query,
+    k: int,
+    params: Optional[models.SearchParams],
+    query_filter: Optional[models.Filter]
+) -> List:
+    dense, sparse = query
+    return client.query_points(
+        collection_name=name,
+        prefetch=[
+            models.Prefetch(query=dense, using="dense", limit=10, filter=query_filter, params=params),
+            models.Prefetch(query=sparse, using="sparse", limit=10, filter=query_filter),
+        ],
+        query=models.FusionQuery(fusion=models.Fusion.RRF),
+        limit=k,
+        with_payload=False,
+    ).points
+
+
+def measure(client, name, queries, filters, k, params, truth) -> Dict:
+    latencies, recalls = [], []
+    for query, query_filter, expected in zip(queries, filters, truth):
+        started = time.perf_counter()
+        points = hybrid(client, name, query, k, params, query_filter)
+        latencies.append(time.perf_counter() - started)
+        if expected:
+            recalls.append(len({p.id for p in points} & expected) / len(expected))
+    latencies.sort()
+    return {
+        "recall": float(np.mean(recalls)) if recalls else 1.0,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def main(args):
+    client = QdrantClient(location=args.url, timeout=300)
+    corpus = Corpus(args.points, args.files, args.seed)
+    queries = corpus.queries(args.queries)
+    file_filters = [
+        models.Filter(must=[models.FieldCondition(
+            key="file_uuid", match=models.MatchValue(value=corpus.file_uuids[i % args.files])
+        )])
+        for i in range(args.queries)
+    ]
+    no_filters = [None] * args.queries
+    exact = models.SearchParams(exact=True)
+
+    print(f"points={args.points} files={args.files} queries={args.queries} k={args.k} on_disk={args.on_disk}")
+    print(f"{'m':>4}{'ef_c':>6}{'quant':>8}{'ef':>6}{'build s':>9}  "
+          f"{'recall':>7}{'p50':>8}{'p95':>8}  {'filtered':>8}{'p50':>8}{'p95':>8}")
+    name = f"bench_retrieval_{os.getpid()}"
+    try:
+        for m, ef_construct, quantization in itertools.product(args.m, args.ef_construct, args.quantization):
+            build_seconds = build(client, name, corpus, m, ef_construct, quantization, args.on_disk)
+            truth = [{p.id for p in hybrid(client, name, q, args.k, exact, None)} for q in queries]
+            truth_filtered = [
+                {p.id for p in hybrid(client, name, q, args.k, exact, f)} for q, f in zip(queries, file_filters)
+            ]
+            for ef in args.ef:
+                params = dense_search_params(ef, quantization, args.rescore, args.oversampling)
+                full = measure(client, name, queries, no_filters, args.k, params, truth)
+                filtered = measure(client, name, queries, file_filters, args.k, params, truth_filtered)
+                print(f"{m:>4}{ef_construct:>6}{quantization:>8}{ef:>6}{build_seconds:>9.1f}  "
+                      f"{full['recall']:>7.3f}{full['p50']:>8.2f}{full['p95']:>8.2f}  "
+                      f"{filtered['recall']:>8.3f}{filtered['p50']:>8.2f}{filtered['p95']:>8.2f}")
+
+            client.delete_payload_index(name, "file_uuid", wait=True)
+            params = dense_search_params(args.ef[-1], quantization, args.rescore, args.oversampling)
+            filtered = measure(client, name, queries, file_filters, args.k, params, truth_filtered)
+            print(f"{'':>33}{'without file_uuid index':>23}  "
+                  f"{filtered['recall']:>8.3f}{filtered['p50']:>8.2f}{filtered['p95']:>8.2f}")
+    finally:
+        client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3, help="like QueryRequest.k")
+    parser.add_argument("--m", type=int, nargs="+", default=[16])
+    parser.add_argument("--ef-construct", type=int, nargs="+", default=[100])
+    parser.add_argument("--quantization", nargs="+", default=["none", "scalar"], choices=["none", "scalar", "binary"])
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--no-rescore", dest="rescore", action="store_false")
+    parser.add_argument("--oversampling", type=float, default=2.0)
+    parser.add_argument("--on-disk", action="store_true", help="original vectors and sparse index on disk")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
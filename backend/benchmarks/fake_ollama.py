@@ -0,0 +1,161 @@
+"""
+Deterministic stand-in for Ollama's /api/generate, for benchmarks.
+
+It behaves like Ollama's runner where it matters for latency: prompts are
+prefilled at --prefill-rate tokens/sec except for the longest prefix a slot
+still holds from an earlier request, and answers stream at --token-rate.
+Answers are pseudo-random words seeded by the prompt, so runs repeat.
+Tokens are whitespace-separated words.
+
+Run standalone (then point OLLAMA_BASE_URL at it):
+    python -m benchmarks.fake_ollama --port 11435 --token-rate 30
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "contract invoice payment clause liability term notice party agreement "
+    "schedule delivery warranty renewal termination fee service data audit "
+    "report period annex section obligation customer supplier price"
+).split()
+
+
+class FakeOllama:
+    """Token-level model of /api/generate with a per-slot KV cache."""
+
+    def __init__(
+        self,
+        slots: int = 4,
+        prefill_rate: float = 5000,
+        token_rate: float = 50,
+        answer_tokens: int = 60
+    ):
+        self.slots = [[] for _ in range(slots)]
+        self.slot_used = [0.0] * slots
+        self.prefill_rate = prefill_rate
+        self.token_rate = token_rate
+        self.answer_tokens = answer_tokens
+        self.vocab = {}
+        self.words = []
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.prefilled_tokens = 0
+
+    def reset(self):
+        with self.lock:
+            self.slots = [[] for _ in self.slots]
+            self.slot_used = [0.0] * len(self.slots)
+            self.requests = self.prompt_tokens = self.prefilled_tokens = 0
+
+    def tokenize(self, text):
+        with self.lock:
+            ids = []
+            for word in text.split():
+                if word not in self.vocab:
+                    self.vocab[word] = len(self.words)
+                    self.words.append(word)
+                ids.append(self.vocab[word])
+            return ids
+
+    def generate(self, payload, send):
+        tokens = list(payload.get("context") or []) + self.tokenize(payload["prompt"])
+        with self.lock:
+            def shared(slot):
+                common = 0
+                for a, b in zip(self.slots[slot], tokens):
+                    if a != b:
+                        break
+                    common += 1
+                return common
+            # Like Ollama's runner: take the slot sharing the longest prefix.
+            # If using it would throw away the rest of what it holds (another
+            # conversation), copy the shared prefix into the least recently
+            # used slot instead.
+            slot = max(range(len(self.slots)), key=lambda i: (shared(i), -self.slot_used[i]))
+            cached = shared(slot)
+            if cached < len(self.slots[slot]):
+                slot = min(range(len(self.slots)), key=lambda i: self.slot_used[i])
+            self.slot_used[slot] = time.monotonic()
+            prefill = len(tokens) - cached
+            self.requests += 1
+            self.prompt_tokens += len(tokens)
+            self.prefilled_tokens += prefill
+
+        time.sleep(prefill / self.prefill_rate)
+        rng = random.Random(hashlib.sha256(payload["prompt"].encode("utf-8")).digest())
+        answer = self.tokenize(" ".join(rng.choices(WORDS, k=self.answer_tokens)))
+        streaming = payload.get("stream", True)
+        text = []
+        for i, token in enumerate(answer):
+            time.sleep(1 / self.token_rate)
+            piece = (" " if i else "") + self.words[token]
+            text.append(piece)
+            if streaming:
+                send({"model": payload.get("model"), "response": piece, "done": False})
+        with self.lock:
+            self.slots[slot] = tokens + answer
+        send({
+            "model": payload.get("model"),
+            "response": "" if streaming else "".join(text),
+            "done": True,
+            "context": tokens + answer,
+            "prompt_eval_count": prefill,
+            "prompt_eval_duration": int(prefill / self.prefill_rate * 1e9),
+            "eval_count": len(answer),
+        })
+
+
+def serve(fake: FakeOllama, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve `fake` from a background thread; port 0 picks a free port."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/api/generate":
+                self.send_error(404)
+                return
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+
+            def send(data):
+                self.wfile.write((json.dumps(data) + "\n").encode())
+                self.wfile.flush()
+
+            try:
+                fake.generate(payload, send)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client closed the stream, like a cancelled generation
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--slots", type=int, default=4, help="like OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--prefill-rate", type=float, default=5000, help="prompt tokens/sec")
+    parser.add_argument("--token-rate", type=float, default=50, help="generated tokens/sec")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    args = parser.parse_args()
+    server = serve(
+        FakeOllama(args.slots, args.prefill_rate, args.token_rate, args.answer_tokens),
+        args.host, args.port
+    )
+    print(f"Fake Ollama on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,106 @@
+"""
+Deterministic text-only PDFs for ingestion benchmarks.
+
+Each document is a few topics (from benchmarks.fake_ollama.WORDS) written as
+sentences, so the semantic chunker finds real breakpoints and queries built
+from the same words retrieve something. The PDF is written by hand (one
+Helvetica font, one content stream per page) to avoid a PDF library
+dependency; pypdf extracts its text like any other PDF's.
+
+Run standalone:
+    python -m benchmarks.synthetic_pdfs out_dir --docs 20 --pages 10
+"""
+import argparse
+import random
+import textwrap
+from pathlib import Path
+from typing import List
+
+from benchmarks.fake_ollama import WORDS
+
+LINE_CHARS = 90
+LINES_PER_PAGE = 50
+
+
+def synthetic_pages(seed: int, pages: int, sentences_per_page: int = 24) -> List[str]:
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(pages):
+        sentences = []
+        topic = rng.sample(WORDS, 4)
+        for i in range(sentences_per_page):
+            if i % 8 == 0:
+                topic = rng.sample(WORDS, 4)  # new topic = likely breakpoint
+            words = [rng.choice(topic) if rng.random() < 0.6 else rng.choice(WORDS)
+                     for _ in range(rng.randint(8, 18))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        texts.append(" ".join(sentences))
+    return texts
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: Path, pages: List[str]):
+    """Write `pages` (plain text) as a minimal PDF 1.4 file."""
+    objects = []  # bodies; object n is objects[n - 1]
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # filled in once the page tree exists
+    page_tree = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for text in pages:
+        lines = textwrap.wrap(text, LINE_CHARS)[:LINES_PER_PAGE]
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td\n" + "".join(
+            f"({_escape(line)}) Tj T*\n" for line in lines
+        ) + "ET"
+        data = stream.encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (page_tree, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % page_tree
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog, xref
+    )
+    Path(path).write_bytes(bytes(out))
+
+
+def generate(out_dir: Path, docs: int, pages: int, seed: int = 0) -> List[Path]:
+    """Write `docs` PDFs of `pages` pages each; the same seed gives the same files."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(docs):
+        path = out_dir / f"synthetic_{seed}_{i:04d}.pdf"
+        write_pdf(path, synthetic_pages(seed * 100003 + i, pages))
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for path in generate(args.out_dir, args.docs, args.pages, args.seed):
+        print(path)
@@ -0,0 +1,415 @@
+"""
+Ingest many PDFs in one job: a server-side directory or a batch of uploads.
+
+Run from backend/:
+    python -m bulk_ingest <pdf or directory> [...]   # ingest every PDF given
+    python -m bulk_ingest docs/ --recursive          # include subdirectories
+
+WHY a separate job type: Onboarding a customer means thousands of PDFs,
+and one upload at a time leaves most of the machine idle. A bulk job
+parses PDFs on a process pool (pypdf is pure Python and holds the GIL),
+chunks pages of several documents with one embedding call so the model
+stays saturated, and streams the chunks through the same embed/upsert
+pipeline as single uploads. Each file is catalogued as soon as its last
+chunk is upserted, so it becomes searchable before the whole job ends.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from qdrant_client import models
+
+from database import init_db, close_db, upsert_file, find_file_record, delete_file_record
+from ingestion import (
+    IngestJob, ingest_jobs, run_pipeline, hash_page, _put, _END, _PipelineStopped
+)
+from retrieval import client, COLLECTION_NAME, ensure_collection, close_clients, file_filter
+from semantic_chunker import chunk_documents, load_pdf_pages
+
+# Same directory main.py stores uploads in
+PDF_STORAGE_DIR = Path("uploaded_pdfs")
+
+# Processes parsing PDFs in parallel
+BULK_PARSE_PROCESSES = int(os.getenv("BULK_PARSE_PROCESSES", str(os.cpu_count() or 2)))
+# Pages (from any number of documents) chunked with one embedding call
+BULK_PAGE_BATCH_SIZE = int(os.getenv("BULK_PAGE_BATCH_SIZE", "64"))
+# Directories /bulk_ingest may read from ("" = server-side directories disabled)
+BULK_INGEST_ROOT = os.getenv("BULK_INGEST_ROOT", "")
+
+# Seconds between progress lines printed by the CLI
+CLI_PROGRESS_INTERVAL = 5
+
+# (source path, original filename, move the source into storage instead of copying it)
+BulkItem = Tuple[str, str, bool]
+
+
+def find_pdfs(directory: str, recursive: bool = False) -> List[BulkItem]:
+    root = Path(directory)
+    pattern = "**/*.pdf" if recursive else "*.pdf"
+    return [(str(path), path.name, False) for path in sorted(root.glob(pattern)) if path.is_file()]
+
+
+class BulkFile:
+    """One PDF of a bulk job."""
+
+    def __init__(self, source_path: str, filename: str, move: bool):
+        self.source_path = source_path
+        self.filename = filename
+        self.move = move
+        self.file_uuid: Optional[str] = None
+        self.status = "queued"  # queued → parsing → ingesting → completed | duplicate | failed
+        self.error: Optional[str] = None
+        self.content_hash: Optional[str] = None
+        self.file_size: Optional[int] = None
+        self.pages: Dict[int, Tuple[str, int]] = {}  # page -> (hash, chunk count)
+        self.chunks = 0
+        self.chunks_upserted = 0
+        self.chunked = False
+        self.parse_seconds = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "filename": self.filename,
+            "file_uuid": self.file_uuid,
+            "status": self.status,
+            "pages": len(self.pages),
+            "chunks": self.chunks,
+            "error": self.error,
+        }
+
+
+class BulkIngestJob(IngestJob):
+    """
+    An ingestion job over many files, tracked through the same job manager
+    and GET /ingest_jobs/{job_id} as single uploads.
+    """
+
+    def __init__(self, items: List[BulkItem]):
+        super().__init__(
+            file_uuid=None,
+            filename=f"{len(items)} files",
+            file_path=None,
+            file_size=0,
+        )
+        self.files = [BulkFile(*item) for item in items]
+        self.progress.update({
+            "docs_total": len(self.files),
+            "docs_completed": 0,
+            "docs_duplicate": 0,
+            "docs_failed": 0,
+        })
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._files_by_uuid: Dict[str, BulkFile] = {}
+        self._files_lock = threading.Lock()
+        self._clock_started: Optional[float] = None
+
+    def claim(self, bulk_file: BulkFile, parsed: Dict, seen_hashes: Dict[str, str]) -> bool:
+        """Give a parsed file its file_uuid and stored copy, unless it is a duplicate."""
+        bulk_file.content_hash = parsed["content_hash"]
+        bulk_file.file_size = parsed["file_size"]
+        existing = self.run_async(find_file_record(content_hash=bulk_file.content_hash))
+        if existing or bulk_file.content_hash in seen_hashes:
+            bulk_file.status = "duplicate"
+            bulk_file.file_uuid = existing["file_uuid"] if existing else seen_hashes[bulk_file.content_hash]
+            self.progress["docs_duplicate"] += 1
+            if bulk_file.move:
+                Path(bulk_file.source_path).unlink(missing_ok=True)
+            return False
+        bulk_file.file_uuid = str(uuid.uuid4())
+        seen_hashes[bulk_file.content_hash] = bulk_file.file_uuid
+        stored = PDF_STORAGE_DIR / f"{bulk_file.file_uuid}.pdf"
+        if bulk_file.move:
+            os.replace(bulk_file.source_path, stored)
+        else:
+            shutil.copyfile(bulk_file.source_path, stored)
+        bulk_file.status = "ingesting"
+        self.file_size += bulk_file.file_size
+        with self._files_lock:
+            self._files_by_uuid[bulk_file.file_uuid] = bulk_file
+        return True
+
+    def covers(self, file_uuid: Optional[str] = None, content_hash: Optional[str] = None) -> bool:
+        """
+        Whether one of this job's unfinished files has this uuid or these bytes.
+
+        A file's hash is known once it is parsed and its uuid once it is
+        claimed; until it is catalogued, deleting it or uploading it again
+        would race with the job.
+        """
+        return any(
+            bulk_file.status in ("parsing", "ingesting") and (
+                (file_uuid and bulk_file.file_uuid == file_uuid)
+                or (content_hash and bulk_file.content_hash == content_hash)
+            )
+            for bulk_file in self.files
+        )
+
+    def file_failed(self, bulk_file: BulkFile, error: BaseException):
+        bulk_file.status = "failed"
+        bulk_file.error = str(error)
+        self.progress["docs_failed"] += 1
+        if bulk_file.move:
+            Path(bulk_file.source_path).unlink(missing_ok=True)
+
+    def mark_chunked(self, bulk_file: BulkFile):
+        """All chunks of this file are known (and about to be queued)."""
+        with self._files_lock:
+            bulk_file.chunked = True
+            done = bulk_file.chunks_upserted >= bulk_file.chunks
+        if done:
+            self._complete(bulk_file)
+
+    def points_upserted(self, points):
+        finished = []
+        with self._files_lock:
+            for point in points:
+                bulk_file = self._files_by_uuid[point.payload["file_uuid"]]
+                bulk_file.chunks_upserted += 1
+                if bulk_file.chunked and bulk_file.chunks_upserted == bulk_file.chunks:
+                    finished.append(bulk_file)
+        for bulk_file in finished:
+            self._complete(bulk_file)
+
+    def _complete(self, bulk_file: BulkFile):
+        self.run_async(upsert_file(
+            file_uuid=bulk_file.file_uuid,
+            filename=bulk_file.filename,
+            chunk_count=bulk_file.chunks,
+            page_count=len(bulk_file.pages),
+            byte_size=bulk_file.file_size,
+            ingest_timings={"parsing": round(bulk_file.parse_seconds, 3)},
+            content_hash=bulk_file.content_hash,
+            pages=bulk_file.pages,
+        ))
+        bulk_file.status = "completed"
+        self.progress["docs_completed"] += 1
+
+    def run_async(self, coro):
+        """
+        Run a database coroutine from a pipeline thread.
+
+        Gives up with _PipelineStopped once the pipeline is stopped, instead
+        of waiting on a loop that may be shutting down. The coroutine is not
+        cancelled (it may be mid-write); roll_back deletes what it catalogued.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except FutureTimeoutError:
+                if self.pipeline_stop is not None and self.pipeline_stop.is_set():
+                    raise _PipelineStopped()
+
+    def throughput(self) -> Dict:
+        elapsed = time.perf_counter() - self._clock_started if self._clock_started else 0.0
+        return {
+            "elapsed_seconds": round(elapsed, 1),
+            "docs_per_min": round(self.progress["docs_completed"] / elapsed * 60, 2) if elapsed else 0.0,
+            "chunks_per_sec": round(self.progress["chunks_upserted"] / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            **super().to_dict(),
+            "throughput": self.throughput(),
+            "files": [bulk_file.to_dict() for bulk_file in self.files],
+        }
+
+
+# (file, page number, text, metadata, is the file's last page)
+PageItem = Tuple[BulkFile, int, str, Dict, bool]
+
+
+def _chunk_pages(job: BulkIngestJob, page_slice: List[PageItem], out, stop):
+    """Chunk one slice of pages, from any number of files, with one embedding call."""
+    chunk_start = time.perf_counter()
+    docs = []
+    for bulk_file, number, text, metadata, _ in page_slice:
+        # Tag pages with their file so chunks can be mapped back to it
+        docs.append(Document(page_content=text, metadata={
+            **metadata,
+            "page": metadata.get("page", number),
+            "source": str(PDF_STORAGE_DIR / f"{bulk_file.file_uuid}.pdf"),
+            "file_uuid": bulk_file.file_uuid,
+        }))
+    chunks = chunk_documents(docs)
+    job.add_timing("chunking", time.perf_counter() - chunk_start)
+
+    per_page: Dict[Tuple[str, int], int] = {}
+    for chunk in chunks:
+        metadata = chunk["metadata"]
+        bulk_file = job._files_by_uuid[metadata.pop("file_uuid")]
+        metadata["chunk_idx"] = bulk_file.chunks
+        bulk_file.chunks += 1
+        chunk["file_uuid"] = bulk_file.file_uuid
+        chunk["file_name"] = bulk_file.filename
+        key = (bulk_file.file_uuid, metadata.get("page"))
+        per_page[key] = per_page.get(key, 0) + 1
+    for bulk_file, number, text, metadata, _ in page_slice:
+        page = metadata.get("page", number)
+        bulk_file.pages[page] = (hash_page(text), per_page.get((bulk_file.file_uuid, page), 0))
+
+    job.progress["pages"] += len(page_slice)
+    job.progress["chunks_total"] += len(chunks)
+    # Files whose last page is in this slice are complete once these
+    # chunks are upserted; mark them before queueing so the upsert stage
+    # cannot finish their chunks first
+    for bulk_file, _, _, _, last in page_slice:
+        if last:
+            job.mark_chunked(bulk_file)
+    for chunk in chunks:
+        _put(out, chunk, stop)
+
+
+def _parse_and_chunk(job: BulkIngestJob, out, stop: threading.Event):
+    """
+    Stage 1 of a bulk job: parse PDFs on a process pool and chunk their pages
+    across documents.
+
+    WHY spawn: The server process holds model threads and an event loop;
+    forking it is unsafe, so parse workers start from a clean interpreter.
+
+    Pages held at once: the parses in flight (a whole document each, as
+    load_pdf_pages returns it) plus fewer than BULK_PAGE_BATCH_SIZE buffered
+    pages. Each parsed file is cut into slices as soon as it arrives.
+    """
+    PDF_STORAGE_DIR.mkdir(exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    seen_hashes: Dict[str, str] = {}  # content hash -> file_uuid, within this job
+    buffered: List[PageItem] = []
+    queued_files = iter(job.files)
+    # Keep a couple of parses per process in flight so parsed pages never pile up
+    max_in_flight = BULK_PARSE_PROCESSES * 2
+
+    with ProcessPoolExecutor(max_workers=BULK_PARSE_PROCESSES, mp_context=context) as pool:
+        in_flight = {}
+
+        def fill():
+            while len(in_flight) < max_in_flight:
+                bulk_file = next(queued_files, None)
+                if bulk_file is None:
+                    return
+                bulk_file.status = "parsing"
+                in_flight[pool.submit(load_pdf_pages, bulk_file.source_path)] = bulk_file
+
+        fill()
+        while in_flight:
+            if stop.is_set():
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise _PipelineStopped()
+            done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                bulk_file = in_flight.pop(future)
+                try:
+                    parsed = future.result()
+                    if not job.claim(bulk_file, parsed, seen_hashes):
+                        continue
+                except Exception as e:
+                    job.file_failed(bulk_file, e)
+                    continue
+                bulk_file.parse_seconds = parsed["parse_seconds"]
+                job.add_timing("parsing", parsed["parse_seconds"])
+                file_pages = parsed.pop("pages")
+                if not file_pages:
+                    job.mark_chunked(bulk_file)
+                    continue
+                last = len(file_pages) - 1
+                for number, (text, metadata) in enumerate(file_pages):
+                    buffered.append((bulk_file, number, text, metadata, number == last))
+                    if len(buffered) >= BULK_PAGE_BATCH_SIZE:
+                        _chunk_pages(job, buffered, out, stop)
+                        buffered = []
+            fill()
+
+    if buffered:
+        _chunk_pages(job, buffered, out, stop)
+    _put(out, _END, stop)
+
+
+async def run_bulk_ingest_job(job: BulkIngestJob) -> Dict:
+    """Parse → chunk → embed → upsert every file of a bulk job. Runs on an ingestion worker."""
+    job.loop = asyncio.get_running_loop()
+    job._clock_started = time.perf_counter()
+    job.set_stage("ingesting")
+
+    async def roll_back():
+        # Files that were not catalogued yet must not stay half searchable,
+        # and none of them is left queued or parsing
+        for bulk_file in job.files:
+            if bulk_file.status in ("completed", "duplicate", "failed"):
+                continue
+            if bulk_file.status == "ingesting":
+                await ingest_jobs.run_blocking(
+                    client.delete,
+                    collection_name=COLLECTION_NAME,
+                    points_selector=models.FilterSelector(filter=file_filter(bulk_file.file_uuid)),
+                    wait=True,
+                )
+                (PDF_STORAGE_DIR / f"{bulk_file.file_uuid}.pdf").unlink(missing_ok=True)
+                # Its catalog write may still have gone through after the pipeline stopped
+                await delete_file_record(bulk_file.file_uuid)
+            job.file_failed(bulk_file, RuntimeError("Bulk ingestion aborted"))
+
+    await run_pipeline(job, _parse_and_chunk, on_error=roll_back)
+
+    throughput = job.throughput()
+    print(f"✅ Bulk ingested {job.progress['docs_completed']}/{job.progress['docs_total']} files "
+          f"({throughput['docs_per_min']} docs/min, {throughput['chunks_per_sec']} chunks/sec)")
+    return {
+        "docs_completed": job.progress["docs_completed"],
+        "docs_duplicate": job.progress["docs_duplicate"],
+        "docs_failed": job.progress["docs_failed"],
+        "chunks_created": job.progress["chunks_upserted"],
+        **throughput,
+    }
+
+
+async def main(paths: List[str], recursive: bool):
+    items: List[BulkItem] = []
+    for path in paths:
+        if os.path.isdir(path):
+            items.extend(find_pdfs(path, recursive))
+        elif path.endswith(".pdf"):
+            items.append((path, os.path.basename(path), False))
+    if not items:
+        print("No PDFs found")
+        return
+
+    await init_db()
+    await ensure_collection()
+    await ingest_jobs.start()
+    try:
+        job = ingest_jobs.submit(BulkIngestJob(items), run_bulk_ingest_job)
+        while job.status in ("queued", "running"):
+            await asyncio.sleep(CLI_PROGRESS_INTERVAL)
+            throughput = job.throughput()
+            print(f"{job.progress['docs_completed']}/{job.progress['docs_total']} files, "
+                  f"{job.progress['chunks_upserted']} chunks, "
+                  f"{throughput['docs_per_min']} docs/min, {throughput['chunks_per_sec']} chunks/sec")
+        if job.status == "failed":
+            print(f"❌ Bulk ingestion failed: {job.error}")
+        for bulk_file in job.files:
+            if bulk_file.status == "failed":
+                print(f"  failed: {bulk_file.filename}: {bulk_file.error}")
+    finally:
+        await ingest_jobs.stop()
+        await close_db()
+        await close_clients()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest many PDFs in parallel")
+    parser.add_argument("paths", nargs="+", help="PDF files and/or directories")
+    parser.add_argument("--recursive", action="store_true", help="also search subdirectories")
+    args = parser.parse_args()
+    asyncio.run(main(args.paths, args.recursive))
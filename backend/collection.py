@@ -0,0 +1,231 @@
+"""
+Provisioning of the hybrid Qdrant collection: vectors, HNSW, quantization, payload index.
+
+Run from backend/ to bring an existing collection in line with the config:
+    python -m collection --dry-run   # only report differences
+    python -m collection             # apply them
+
+WHY one place: The same settings decide how the collection is created, how
+an existing one is migrated (update_collection; Qdrant rebuilds indexes and
+quantized vectors in the background, the collection stays searchable) and
+which search params queries send. Changing HNSW or quantization settings is
+a config change plus a restart (or this script), never a re-ingest.
+"""
+import argparse
+import asyncio
+import os
+from typing import Dict, Optional
+
+from qdrant_client import models
+
+COLLECTION_NAME = "test_collection"
+DENSE_SIZE = 768  # all-mpnet-base-v2
+
+# HNSW graph: edges per node and build-time candidate list. Higher = better
+# recall, more RAM and slower indexing. Query-time ef: 0 = Qdrant's default
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "0"))
+# Dense vector quantization: "none", "scalar" (int8, 4x smaller) or "binary"
+# (1 bit, 32x smaller; only for models that tolerate it)
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none")
+# Re-rank quantized candidates with the original vectors, fetching
+# limit * oversampling candidates first
+QDRANT_RESCORE = os.getenv("QDRANT_RESCORE", "1") == "1"
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+# Keep original vectors, the sparse index and (optionally) the HNSW graph on
+# disk; with quantization the quantized vectors stay in RAM
+QDRANT_ON_DISK = os.getenv("QDRANT_ON_DISK", "0") == "1"
+QDRANT_HNSW_ON_DISK = os.getenv("QDRANT_HNSW_ON_DISK", "0") == "1"
+
+# Payload fields keyword-indexed for filtering
+INDEXED_FIELDS = {"file_uuid": models.PayloadSchemaType.KEYWORD}
+
+# Payload a search hit needs: the prompt (text, token_count), sources
+# (metadata.page/source) and per-file grouping (file_uuid, file_name)
+RESULT_PAYLOAD = models.PayloadSelectorInclude(include=[
+    "text", "token_count", "file_uuid", "file_name",
+    "metadata.page", "metadata.source",
+])
+
+
+def quantization_config(kind: str = QDRANT_QUANTIZATION) -> Optional[models.QuantizationConfig]:
+    if kind == "scalar":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=True,
+        ))
+    if kind == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    if kind != "none":
+        raise ValueError(f"QDRANT_QUANTIZATION must be none, scalar or binary, not {kind!r}")
+    return None
+
+
+def hnsw_config(
+    m: int = QDRANT_HNSW_M,
+    ef_construct: int = QDRANT_HNSW_EF_CONSTRUCT,
+    on_disk: bool = QDRANT_HNSW_ON_DISK
+) -> models.HnswConfigDiff:
+    return models.HnswConfigDiff(m=m, ef_construct=ef_construct, on_disk=on_disk)
+
+
+def dense_search_params(
+    ef: int = QDRANT_HNSW_EF,
+    quantization: str = QDRANT_QUANTIZATION,
+    rescore: bool = QDRANT_RESCORE,
+    oversampling: float = QDRANT_OVERSAMPLING
+) -> Optional[models.SearchParams]:
+    """Search params for the dense prefetch (the sparse index has no HNSW)."""
+    quantization_params = None
+    if quantization != "none":
+        quantization_params = models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+    if not ef and quantization_params is None:
+        return None
+    return models.SearchParams(hnsw_ef=ef or None, quantization=quantization_params)
+
+
+def _quantization_kind(config) -> str:
+    if isinstance(config, models.ScalarQuantization):
+        return "scalar"
+    if isinstance(config, models.BinaryQuantization):
+        return "binary"
+    return "none"
+
+
+async def create_collection(async_client):
+    await async_client.create_collection(
+        collection_name=COLLECTION_NAME,
+        # 1. Dense Vector Configuration (all-mpnet-base-v2)
+        vectors_config={
+            "dense": models.VectorParams(
+                size=DENSE_SIZE,
+                distance=models.Distance.COSINE,
+                on_disk=QDRANT_ON_DISK,
+                quantization_config=quantization_config(),
+            )
+        },
+        # 2. Sparse Vector Configuration (Keywords/BM25)
+        sparse_vectors_config={
+            "sparse": models.SparseVectorParams(
+                index=models.SparseIndexParams(on_disk=QDRANT_ON_DISK)
+            )
+        },
+        hnsw_config=hnsw_config(),
+    )
+
+
+async def plan_migration(async_client) -> Dict[str, str]:
+    """Differences between the existing collection and the config: {setting: "old -> new"}."""
+    info = await async_client.get_collection(collection_name=COLLECTION_NAME)
+    dense = info.config.params.vectors["dense"]
+    sparse = (info.config.params.sparse_vectors or {}).get("sparse")
+    hnsw = info.config.hnsw_config
+    # A per-vector quantization overrides the collection's
+    dense_quantization = dense.quantization_config or info.config.quantization_config
+
+    current = {
+        "hnsw.m": hnsw.m,
+        "hnsw.ef_construct": hnsw.ef_construct,
+        "hnsw.on_disk": bool(hnsw.on_disk),
+        "dense.on_disk": bool(dense.on_disk),
+        "dense.quantization": _quantization_kind(dense_quantization),
+        "sparse.on_disk": bool(sparse and sparse.index and sparse.index.on_disk),
+    }
+    wanted = {
+        "hnsw.m": QDRANT_HNSW_M,
+        "hnsw.ef_construct": QDRANT_HNSW_EF_CONSTRUCT,
+        "hnsw.on_disk": QDRANT_HNSW_ON_DISK,
+        "dense.on_disk": QDRANT_ON_DISK,
+        "dense.quantization": QDRANT_QUANTIZATION,
+        "sparse.on_disk": QDRANT_ON_DISK,
+    }
+    changes = {key: f"{current[key]} -> {wanted[key]}" for key in wanted if current[key] != wanted[key]}
+    for field in INDEXED_FIELDS:
+        if field not in (info.payload_schema or {}):
+            changes[f"index.{field}"] = "missing -> keyword"
+    return changes
+
+
+async def migrate_collection(async_client, changes: Dict[str, str]):
+    """Apply plan_migration()'s changes in place."""
+    if any(key.startswith(("hnsw.", "dense.", "sparse.")) for key in changes):
+        quantization = quantization_config() or models.Disabled.DISABLED
+        await async_client.update_collection(
+            collection_name=COLLECTION_NAME,
+            vectors_config={
+                "dense": models.VectorParamsDiff(
+                    on_disk=QDRANT_ON_DISK,
+                    quantization_config=quantization,
+                )
+            },
+            sparse_vectors_config={
+                "sparse": models.SparseVectorParams(
+                    index=models.SparseIndexParams(on_disk=QDRANT_ON_DISK)
+                )
+            },
+            hnsw_config=hnsw_config(),
+        )
+    for field, schema in INDEXED_FIELDS.items():
+        if f"index.{field}" in changes:
+            await async_client.create_payload_index(
+                collection_name=COLLECTION_NAME, field_name=field, field_schema=schema, wait=True
+            )
+
+
+async def provision_collection(async_client, local: bool = False) -> Dict[str, str]:
+    """
+    Create the hybrid collection on first start, else migrate it to the config.
+
+    Qdrant's local mode (local=True) has no HNSW graph, quantization or
+    payload indexes, so there it is only created. Returns the changes applied.
+    """
+    quantization_config()  # fail on a bad QDRANT_QUANTIZATION before touching anything
+    if not await async_client.collection_exists(collection_name=COLLECTION_NAME):
+        await create_collection(async_client)
+        if not local:
+            for field, schema in INDEXED_FIELDS.items():
+                await async_client.create_payload_index(
+                    collection_name=COLLECTION_NAME, field_name=field, field_schema=schema, wait=True
+                )
+        print("Hybrid Collection Created!")
+        return {}
+    if local:
+        return {}
+
+    changes = await plan_migration(async_client)
+    if changes:
+        await migrate_collection(async_client, changes)
+        print(f"🔧 Collection migrated: {changes}")
+    return changes
+
+
+def _print_changes(changes: Dict[str, str]):
+    if not changes:
+        print("Collection matches the config")
+    for key, change in sorted(changes.items()):
+        print(f"  {key}: {change}")
+
+
+async def main(dry_run: bool):
+    from retrieval import QDRANT_PATH, async_client, close_clients
+
+    try:
+        if not await async_client.collection_exists(collection_name=COLLECTION_NAME):
+            print(f"Collection {COLLECTION_NAME} does not exist" + ("" if dry_run else ", creating it"))
+            if not dry_run:
+                await provision_collection(async_client, local=bool(QDRANT_PATH))
+            return
+        changes = await plan_migration(async_client)
+        _print_changes(changes)
+        if changes and not dry_run:
+            await migrate_collection(async_client, changes)
+            print("Applied; Qdrant re-indexes in the background (status yellow until done)")
+    finally:
+        await close_clients()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or migrate the Qdrant collection")
+    parser.add_argument("--dry-run", action="store_true", help="report without changing anything")
+    args = parser.parse_args()
+    asyncio.run(main(args.dry_run))
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, List, Set
+
+from database import (
+    get_conversation_context, get_conversation_messages, get_messages_to_summarize,
+    save_conversation_summary
+)
+from model_registry import get_llm
+from prompt_builder import HISTORY_LABELS, count_tokens, truncate_to_tokens
+
+# Set to "0" to go back to sending the last HISTORY_MESSAGES raw messages
+CONVERSATION_SUMMARIES = os.getenv("CONVERSATION_SUMMARIES", "1") == "1"
+# Most recent messages always sent verbatim (2 turns)
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "4"))
+# Older messages are folded into the summary once this many have piled up
+SUMMARY_FOLD_MESSAGES = int(os.getenv("SUMMARY_FOLD_MESSAGES", "4"))
+# Target length of the summary; it is also cut to this many tokens
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+
+# Raw messages loaded for a prompt; also the fallback when summaries are off
+# or the background update has not caught up yet
+HISTORY_MESSAGES = 10
+# Each message (mostly long answers) is cut to this before it is summarized
+SUMMARY_INPUT_MESSAGE_TOKENS = 400
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between a user and an assistant answering questions about PDF documents, adding to the previous summary.
+
+Keep the topics, names, numbers and conclusions the user may refer back to. Write at most {max_words} words of plain prose.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+async def load_history(conversation_id: str) -> List[Dict]:
+    """
+    History for the prompt: a {"role": "summary"} entry (if the conversation
+    has one) followed by the messages it does not cover yet.
+    """
+    if not CONVERSATION_SUMMARIES:
+        return await get_conversation_messages(conversation_id, limit=HISTORY_MESSAGES)
+    summary, messages = await get_conversation_context(conversation_id, HISTORY_MESSAGES)
+    if summary:
+        return [{"role": "summary", "content": summary, "token_count": None}] + messages
+    return messages
+
+
+class ConversationSummarizer:
+    """
+    Folds messages older than the last SUMMARY_KEEP_MESSAGES into a rolling
+    summary on the conversation row.
+
+    WHY: The prompt used to carry the last 10 raw messages, answers included,
+    so every turn past the fifth paid prefill for ~10 earlier messages and
+    anything older was simply forgotten. With a summary the prompt carries a
+    bounded summary plus the last couple of turns, so its size stays flat as
+    the conversation grows.
+
+    WHY in the background: Summarizing is an extra LLM call. It runs after
+    the answer has been sent, so it never adds to the user's latency; the
+    next question just uses whatever summary is stored by then. Messages
+    the summary does not cover yet are still sent verbatim, so a slow update
+    costs tokens, not context. At most one update runs per conversation;
+    answers arriving meanwhile mark it for another pass.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self.counts = {"updates": 0, "messages_folded": 0, "failed": 0}
+        self.update_seconds = 0.0
+
+    def schedule(self, conversation_id: str):
+        """Update the summary in the background if enough messages have aged out."""
+        if not CONVERSATION_SUMMARIES:
+            return
+        task = self._tasks.get(conversation_id)
+        if task is not None and not task.done():
+            self._pending.add(conversation_id)
+            return
+        self._tasks[conversation_id] = asyncio.create_task(self._run(conversation_id))
+
+    async def _run(self, conversation_id: str):
+        try:
+            while True:
+                self._pending.discard(conversation_id)
+                await self.update(conversation_id)
+                if conversation_id not in self._pending:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._count("failed")
+            print(f"⚠️ Conversation summary update failed for {conversation_id}: {e}")
+        finally:
+            self._tasks.pop(conversation_id, None)
+
+    async def update(self, conversation_id: str) -> bool:
+        """Fold aged-out messages into the summary now. Returns whether it changed."""
+        summary, summarized, messages = await get_messages_to_summarize(
+            conversation_id, SUMMARY_KEEP_MESSAGES
+        )
+        if len(messages) < SUMMARY_FOLD_MESSAGES:
+            return False
+
+        started = time.perf_counter()
+        lines = "\n".join(
+            f"{HISTORY_LABELS.get(m['role'], 'Assistant')}: "
+            f"{truncate_to_tokens(m['content'], SUMMARY_INPUT_MESSAGE_TOKENS)}"
+            for m in messages
+        )
+        prompt = SUMMARY_PROMPT.format(
+            max_words=int(SUMMARY_MAX_TOKENS * 0.75),
+            summary=summary or "(none yet)",
+            lines=lines,
+        )
+        new_summary = (await asyncio.to_thread(get_llm().invoke, prompt)).strip()
+        if not new_summary:
+            raise ValueError("LLM returned an empty summary")
+        if count_tokens(new_summary) > SUMMARY_MAX_TOKENS:
+            new_summary = truncate_to_tokens(new_summary, SUMMARY_MAX_TOKENS)
+
+        await save_conversation_summary(conversation_id, new_summary, summarized + len(messages))
+        self._count("updates", time.perf_counter() - started)
+        self._count("messages_folded", amount=len(messages))
+        return True
+
+    def _count(self, name: str, seconds: float = 0.0, amount: int = 1):
+        with self._lock:
+            self.counts[name] += amount
+            self.update_seconds += seconds
+
+    async def close(self):
+        """Cancel running updates; called at shutdown before the database closes."""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        updates = self.counts["updates"]
+        return {
+            "enabled": CONVERSATION_SUMMARIES,
+            **self.counts,
+            "running": sum(not task.done() for task in self._tasks.values()),
+            "keep_messages": SUMMARY_KEEP_MESSAGES,
+            "avg_update_ms": round(self.update_seconds / updates * 1000, 1) if updates else None,
+        }
+
+
+conversation_summarizer = ConversationSummarizer()
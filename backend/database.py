@@ -1,23 +1,319 @@
 import aiosqlite
+import asyncio
+import os
 import uuid
 import json
-from typing import List, Dict, Optional
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Dict, Optional, Tuple
 from datetime import datetime
 
 DATABASE_PATH = "chat_history.db"
 
+# Read-only connections kept open next to the single writer connection
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+
+# Max write jobs committed together in one transaction by the writer task
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "64"))
+
+# Applied to every pooled connection.
+# WAL lets readers run while the writer commits; synchronous=NORMAL is safe
+# with WAL (a crash can only lose the last commits, never corrupt the file).
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",  # 16 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 134217728",  # 128 MB
+]
+
+# How long add_message() rows wait in memory before being written together
+MESSAGE_FLUSH_INTERVAL_MS = int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "50"))
+# Flush immediately once this many messages are waiting
+MESSAGE_FLUSH_MAX_PENDING = int(os.getenv("MESSAGE_FLUSH_MAX_PENDING", "500"))
+
+# Size of sqlite3's per-connection prepared statement cache. Connections
+# live for the whole process, so every query is compiled once and reused.
+STATEMENT_CACHE_SIZE = 256
+
 def utc_now() -> str:
     """Generate ISO 8601 UTC timestamp with 'Z' suffix."""
     return datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'
 
-async def init_db():
+
+WriteJob = Callable[[aiosqlite.Connection], Awaitable]
+
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections: a pool of readers and one writer.
+
+    WHY: Every aiosqlite.connect() spawns a thread and re-opens the file, and
+    a single streamed query used to do at least four of them. SQLite only
+    allows one writer at a time anyway, so all writes are funnelled through a
+    queue drained by a single writer task, which commits whatever is queued in
+    one transaction (group commit). Reads use their own connections and never
+    wait for the writer thanks to WAL.
+    """
+
+    def __init__(self, database_path: str, readers: int = READ_POOL_SIZE):
+        self.database_path = database_path
+        self.readers = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._reader_queue: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # isolation_level=None: we issue BEGIN/COMMIT ourselves
+        db = await aiosqlite.connect(
+            self.database_path,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            await db.execute(pragma)
+        db.row_factory = aiosqlite.Row
+        return db
+
+    async def open(self):
+        self._writer = await self._connect()
+        self._reader_queue = asyncio.Queue()
+        for _ in range(self.readers):
+            db = await self._connect()
+            self._reader_conns.append(db)
+            self._reader_queue.put_nowait(db)
+        self._write_queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    async def close(self):
+        if self._writer_task:
+            # Let queued writes finish before closing the connection
+            await self._write_queue.join()
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        for db in self._reader_conns:
+            await db.close()
+        self._reader_conns = []
+        if self._writer:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self):
+        db = await self._reader_queue.get()
+        try:
+            yield db
+        finally:
+            self._reader_queue.put_nowait(db)
+
+    async def write(self, job: WriteJob):
+        """
+        Run `job(db)` on the writer connection inside a transaction and return its result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((job, future))
+        return await future
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+
+            results = []
+            try:
+                await self._writer.execute("BEGIN")
+                for job, _ in batch:
+                    # A savepoint per job: one failing write must not roll
+                    # back the others that share this transaction
+                    await self._writer.execute("SAVEPOINT job")
+                    try:
+                        results.append((True, await job(self._writer)))
+                        await self._writer.execute("RELEASE job")
+                    except Exception as e:
+                        await self._writer.execute("ROLLBACK TO job")
+                        await self._writer.execute("RELEASE job")
+                        results.append((False, e))
+                await self._writer.execute("COMMIT")
+            except Exception as e:
+                if self._writer.in_transaction:
+                    await self._writer.execute("ROLLBACK")
+                results = [(False, e)] * len(batch)
+
+            for (_, future), (ok, value) in zip(batch, results):
+                if future.cancelled():
+                    pass
+                elif ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+                self._write_queue.task_done()
+
+
+class MessageWriteBuffer:
     """
-    Create tables if they don't exist. Called once at FastAPI startup.
+    Write-behind log for chat messages.
+
+    WHY: add_message() used to do an INSERT, an UPDATE, a COUNT(*) and
+    maybe another UPDATE on the request's critical path. Now it only appends
+    to this buffer; a background task writes every message queued in the
+    last MESSAGE_FLUSH_INTERVAL_MS - across all conversations - in one
+    transaction, and maintains titles/counters with one UPDATE per
+    conversation instead of counting rows.
+
+    Guarantees:
+    - read-your-writes: readers call flush_conversation() first, so a
+      conversation's own pending messages are always visible to it
+    - messages are written in the order add_message() was called
+    - close() flushes everything, so a clean shutdown loses nothing (a crash
+      can lose at most the last flush interval)
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._pending: List[tuple] = []
+        self._pending_ids: Dict[str, int] = {}  # conversation_id -> queued rows
+        self.written = 0
+        # Rows that could not be written (e.g. their conversation was deleted)
+        self.dropped = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def append(self, row: tuple):
+        # row = (id, conversation_id, role, content, sources, created_at)
+        self._pending.append(row)
+        self._pending_ids[row[1]] = self._pending_ids.get(row[1], 0) + 1
+        self._wakeup.set()
+
+    def has_pending(self, conversation_id: Optional[str] = None) -> bool:
+        if conversation_id is None:
+            return bool(self._pending_ids)
+        return conversation_id in self._pending_ids
+
+    async def flush_conversation(self, conversation_id: Optional[str] = None):
+        """Flush if the conversation (or any, when None) still has queued messages."""
+        if self.has_pending(conversation_id):
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            rows = self._pending
+            self._pending = []
+            try:
+                await self.pool.write(lambda db: self._write_rows(db, rows))
+            except Exception:
+                self.dropped += len(rows)
+                raise
+            finally:
+                # Rows are forgotten either way: failures are counted in
+                # `dropped` and logged per conversation rather than retried forever
+                for row in rows:
+                    remaining = self._pending_ids.get(row[1], 0) - 1
+                    if remaining > 0:
+                        self._pending_ids[row[1]] = remaining
+                    else:
+                        self._pending_ids.pop(row[1], None)
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Give other requests a moment to add rows to the same batch
+            if len(self._pending) < MESSAGE_FLUSH_MAX_PENDING:
+                await asyncio.sleep(MESSAGE_FLUSH_INTERVAL_MS / 1000)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Failed to flush chat messages: {e}")
+
+    async def _write_rows(self, db: aiosqlite.Connection, rows: List[tuple]):
+        by_conversation: Dict[str, List[tuple]] = {}
+        for row in rows:
+            by_conversation.setdefault(row[1], []).append(row)
+
+        for conversation_id, conv_rows in by_conversation.items():
+            # Own savepoint so e.g. a deleted conversation only drops its rows
+            await db.execute("SAVEPOINT conversation")
+            try:
+                await db.executemany(
+                    """INSERT INTO messages (id, conversation_id, role, content, sources, created_at, token_count)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    conv_rows
+                )
+                human_rows = [r for r in conv_rows if r[2] == "human"]
+                # Auto-set title from the first human message ever: the CASE
+                # sees human_count as it was before this UPDATE
+                first_human = human_rows[0][3] if human_rows else None
+                title = None
+                if first_human is not None:
+                    title = first_human[:50] + ("..." if len(first_human) > 50 else "")
+                await db.execute(
+                    """UPDATE conversations SET
+                           updated_at = ?,
+                           title = CASE WHEN human_count = 0 AND ? IS NOT NULL THEN ? ELSE title END,
+                           message_count = message_count + ?,
+                           human_count = human_count + ?
+                       WHERE id = ?""",
+                    (conv_rows[-1][5], title, title, len(conv_rows), len(human_rows), conversation_id)
+                )
+                await db.execute("RELEASE conversation")
+                self.written += len(conv_rows)
+            except Exception as e:
+                await db.execute("ROLLBACK TO conversation")
+                await db.execute("RELEASE conversation")
+                self.dropped += len(conv_rows)
+                print(f"❌ Dropped {len(conv_rows)} messages for conversation {conversation_id}: {e}")
+
+    def stats(self) -> Dict:
+        return {"pending": len(self._pending), "written": self.written, "dropped": self.dropped}
+
+
+_pool: Optional[ConnectionPool] = None
+_message_buffer: Optional[MessageWriteBuffer] = None
+
+
+def get_pool() -> ConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Database is not initialised, call init_db() first")
+    return _pool
+
+
+def get_message_buffer() -> MessageWriteBuffer:
+    if _message_buffer is None:
+        raise RuntimeError("Database is not initialised, call init_db() first")
+    return _message_buffer
+
+
+async def init_db(database_path: str = DATABASE_PATH):
+    """
+    Open the connection pool and create tables if they don't exist.
+    Called once from the FastAPI lifespan.
 
     WHY at startup: We need the tables to exist before any request hits.
-    Using FastAPI's @app.on_event("startup") ensures this runs once.
+    Opening the pool here also means no request ever pays for a connect.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    global _pool, _message_buffer
+    _pool = ConnectionPool(database_path)
+    await _pool.open()
+
+    async def create_schema(db):
         await db.execute("""
             CREATE TABLE IF NOT EXISTS conversations (
                 id TEXT PRIMARY KEY,
@@ -42,25 +338,134 @@ async def init_db():
             CREATE INDEX IF NOT EXISTS idx_messages_conversation
                 ON messages(conversation_id, created_at)
         """)
-        await db.commit()
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_uuid TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                page_count INTEGER NOT NULL DEFAULT 0,
+                byte_size INTEGER,
+                ingest_seconds REAL,
+                ingest_timings TEXT,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP
+            )
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_files_created
+                ON files(created_at)
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS file_pages (
+                file_uuid TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (file_uuid, page),
+                FOREIGN KEY (file_uuid) REFERENCES files(file_uuid) ON DELETE CASCADE
+            )
+        """)
+        # Named groups of files a query or conversation can be scoped to.
+        # Deleting a file removes it from every set (CASCADE)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS document_sets (
+                name TEXT PRIMARY KEY,
+                description TEXT,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS document_set_files (
+                set_name TEXT NOT NULL,
+                file_uuid TEXT NOT NULL,
+                PRIMARY KEY (set_name, file_uuid),
+                FOREIGN KEY (set_name) REFERENCES document_sets(name) ON DELETE CASCADE,
+                FOREIGN KEY (file_uuid) REFERENCES files(file_uuid) ON DELETE CASCADE
+            )
+        """)
+        # Counters maintained by MessageWriteBuffer (added after the first
+        # release, so older databases get them here and are backfilled)
+        cursor = await db.execute("PRAGMA table_info(conversations)")
+        columns = {row["name"] for row in await cursor.fetchall()}
+        if "message_count" not in columns:
+            await db.execute("ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+            await db.execute("ALTER TABLE conversations ADD COLUMN human_count INTEGER NOT NULL DEFAULT 0")
+            await db.execute("""
+                UPDATE conversations SET
+                    message_count = (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.id),
+                    human_count = (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.id AND m.role = 'human')
+            """)
+        # Rolling summary of the messages older than the last few turns,
+        # maintained by conversation_summary.ConversationSummarizer
+        cursor = await db.execute("PRAGMA table_info(conversations)")
+        columns = {row["name"] for row in await cursor.fetchall()}
+        if "summary" not in columns:
+            await db.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+            await db.execute("ALTER TABLE conversations ADD COLUMN summary_message_count INTEGER NOT NULL DEFAULT 0")
+            await db.execute("ALTER TABLE conversations ADD COLUMN summary_updated_at TIMESTAMP")
+        # Scope of conversations over several files (file_uuid stays the
+        # single-file scope): a JSON list of file ids, or a document set
+        if "document_set" not in columns:
+            await db.execute("ALTER TABLE conversations ADD COLUMN file_uuids TEXT")
+            await db.execute("ALTER TABLE conversations ADD COLUMN document_set TEXT")
+        # Cached prompt token count of each message (NULL for older rows)
+        cursor = await db.execute("PRAGMA table_info(messages)")
+        columns = {row["name"] for row in await cursor.fetchall()}
+        if "token_count" not in columns:
+            await db.execute("ALTER TABLE messages ADD COLUMN token_count INTEGER")
+        # sha256 of the uploaded PDF, used to deduplicate uploads
+        cursor = await db.execute("PRAGMA table_info(files)")
+        columns = {row["name"] for row in await cursor.fetchall()}
+        if "content_hash" not in columns:
+            await db.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_files_hash
+                ON files(content_hash)
+        """)
+
+    await _pool.write(create_schema)
+    _message_buffer = MessageWriteBuffer(_pool)
+    _message_buffer.start()
+
 
+async def close_db():
+    """Flush pending writes and close all pooled connections. Called at shutdown."""
+    global _pool, _message_buffer
+    if _message_buffer is not None:
+        await _message_buffer.close()
+        _message_buffer = None
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
 
-async def create_conversation(file_uuid: Optional[str] = None) -> str:
+
+async def create_conversation(
+    file_uuid: Optional[str] = None,
+    file_uuids: Optional[List[str]] = None,
+    document_set: Optional[str] = None
+) -> str:
     """
     Create a new conversation session. Returns the conversation UUID.
 
+    A conversation is scoped to one file, a list of files or a document set.
+
     WHY return UUID: The frontend needs this ID to associate subsequent
     messages with this conversation. It stores it in React state and sends
     it with every query.
     """
     conversation_id = str(uuid.uuid4())
     now = utc_now()
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+
+    async def insert(db):
         await db.execute(
-            "INSERT INTO conversations (id, file_uuid, created_at, updated_at) VALUES (?, ?, ?, ?)",
-            (conversation_id, file_uuid, now, now)
+            """INSERT INTO conversations (id, file_uuid, file_uuids, document_set, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (conversation_id, file_uuid, json.dumps(file_uuids) if file_uuids else None,
+             document_set, now, now)
         )
-        await db.commit()
+
+    await get_pool().write(insert)
     return conversation_id
 
 
@@ -68,7 +473,8 @@ async def add_message(
     conversation_id: str,
     role: str,
     content: str,
-    sources: Optional[List[Dict]] = None
+    sources: Optional[List[Dict]] = None,
+    token_count: Optional[int] = None
 ) -> str:
     """
     Add a message to a conversation. Returns the message UUID.
@@ -80,35 +486,22 @@ async def add_message(
     WHY store sources as JSON: Sources are a complex nested structure (content,
     metadata, score). JSON serialization is the simplest way to store them in
     SQLite without creating additional tables.
+
+    WHY not written immediately: The message is buffered and committed with
+    others within MESSAGE_FLUSH_INTERVAL_MS. Reads through this module always
+    see it, so callers can treat it as stored.
+
+    WHY token_count: The prompt builder budgets history by tokens; storing
+    the count once means old messages are never re-tokenized.
     """
     message_id = str(uuid.uuid4())
     sources_json = json.dumps(sources) if sources else None
     now = utc_now()
 
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            "INSERT INTO messages (id, conversation_id, role, content, sources, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (message_id, conversation_id, role, content, sources_json, now)
-        )
-        # Update conversation's updated_at and title (from first human message)
-        await db.execute(
-            "UPDATE conversations SET updated_at = ? WHERE id = ?",
-            (now, conversation_id)
-        )
-        # Auto-set title from first human message
-        if role == "human":
-            existing = await db.execute(
-                "SELECT COUNT(*) FROM messages WHERE conversation_id = ? AND role = 'human'",
-                (conversation_id,)
-            )
-            count = (await existing.fetchone())[0]
-            if count == 1:  # This is the first human message (just inserted)
-                title = content[:50] + ("..." if len(content) > 50 else "")
-                await db.execute(
-                    "UPDATE conversations SET title = ? WHERE id = ?",
-                    (title, conversation_id)
-                )
-        await db.commit()
+    # Queued for the next batched write; see MessageWriteBuffer
+    get_message_buffer().append(
+        (message_id, conversation_id, role, content, sources_json, now, token_count)
+    )
     return message_id
 
 
@@ -123,25 +516,28 @@ async def get_conversation_messages(
     messages (see Section 7: Token Budget). For the frontend chat display,
     we want all messages.
 
+    WHY rowid as tie-breaker: created_at has one-second resolution, so a
+    question and a fast (e.g. cached) answer can share a timestamp.
+
     Returns list of dicts: [{"role": "human", "content": "..."}, ...]
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    await get_message_buffer().flush_conversation(conversation_id)
+    async with get_pool().read() as db:
         if limit:
             # Get the last `limit` messages (subquery to get them in correct order)
             cursor = await db.execute(
-                """SELECT role, content, sources, created_at FROM messages
+                """SELECT role, content, sources, created_at, token_count FROM messages
                    WHERE conversation_id = ?
-                   ORDER BY created_at DESC LIMIT ?""",
+                   ORDER BY created_at DESC, rowid DESC LIMIT ?""",
                 (conversation_id, limit)
             )
             rows = await cursor.fetchall()
             rows = list(reversed(rows))  # Reverse to chronological order
         else:
             cursor = await db.execute(
-                """SELECT role, content, sources, created_at FROM messages
+                """SELECT role, content, sources, created_at, token_count FROM messages
                    WHERE conversation_id = ?
-                   ORDER BY created_at ASC""",
+                   ORDER BY created_at ASC, rowid ASC""",
                 (conversation_id,)
             )
             rows = await cursor.fetchall()
@@ -151,12 +547,99 @@ async def get_conversation_messages(
                 "role": row["role"],
                 "content": row["content"],
                 "sources": json.loads(row["sources"]) if row["sources"] else None,
-                "created_at": row["created_at"]
+                "created_at": row["created_at"],
+                "token_count": row["token_count"]
+            }
+            for row in rows
+        ]
+
+
+async def get_conversation_context(
+    conversation_id: str,
+    limit: int
+) -> Tuple[Optional[str], List[Dict]]:
+    """
+    Rolling summary of a conversation plus up to `limit` of the most recent
+    messages it does not cover yet, in chronological order.
+
+    WHY: Sending the last N raw messages made every turn of a long
+    conversation pay prefill for full earlier answers. Older messages are
+    folded into `conversations.summary` in the background, so the prompt
+    only carries the summary and the last few turns.
+    """
+    await get_message_buffer().flush_conversation(conversation_id)
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            "SELECT summary, summary_message_count, message_count FROM conversations WHERE id = ?",
+            (conversation_id,)
+        )
+        conversation = await cursor.fetchone()
+        if conversation is None:
+            return None, []
+        unsummarized = conversation["message_count"] - conversation["summary_message_count"]
+        cursor = await db.execute(
+            """SELECT role, content, sources, created_at, token_count FROM messages
+               WHERE conversation_id = ?
+               ORDER BY created_at DESC, rowid DESC LIMIT ?""",
+            (conversation_id, max(0, min(limit, unsummarized)))
+        )
+        rows = list(reversed(await cursor.fetchall()))
+        return conversation["summary"], [
+            {
+                "role": row["role"],
+                "content": row["content"],
+                "sources": json.loads(row["sources"]) if row["sources"] else None,
+                "created_at": row["created_at"],
+                "token_count": row["token_count"]
             }
             for row in rows
         ]
 
 
+async def get_messages_to_summarize(
+    conversation_id: str,
+    keep_recent: int
+) -> Tuple[Optional[str], int, List[Dict]]:
+    """
+    (current summary, messages it covers, the older messages not folded in
+    yet), leaving the last `keep_recent` messages out.
+    """
+    await get_message_buffer().flush_conversation(conversation_id)
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            "SELECT summary, summary_message_count, message_count FROM conversations WHERE id = ?",
+            (conversation_id,)
+        )
+        conversation = await cursor.fetchone()
+        if conversation is None:
+            return None, 0, []
+        summarized = conversation["summary_message_count"]
+        pending = conversation["message_count"] - keep_recent - summarized
+        if pending <= 0:
+            return conversation["summary"], summarized, []
+        cursor = await db.execute(
+            """SELECT role, content FROM messages
+               WHERE conversation_id = ?
+               ORDER BY created_at ASC, rowid ASC LIMIT ? OFFSET ?""",
+            (conversation_id, pending, summarized)
+        )
+        return conversation["summary"], summarized, [dict(row) for row in await cursor.fetchall()]
+
+
+async def save_conversation_summary(conversation_id: str, summary: str, message_count: int):
+    """Store a summary covering the first `message_count` messages."""
+    async def update(db):
+        # Never replace a summary with one covering fewer messages
+        await db.execute(
+            """UPDATE conversations
+               SET summary = ?, summary_message_count = ?, summary_updated_at = ?
+               WHERE id = ? AND summary_message_count < ?""",
+            (summary, message_count, utc_now(), conversation_id, message_count)
+        )
+
+    await get_pool().write(update)
+
+
 async def list_conversations(file_uuid: Optional[str] = None) -> List[Dict]:
     """
     List all conversations, optionally filtered by file.
@@ -164,22 +647,26 @@ async def list_conversations(file_uuid: Optional[str] = None) -> List[Dict]:
     WHY ordered by updated_at DESC: Most recently active conversations
     appear first—standard chat app behavior.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    # Titles and updated_at are maintained by the message buffer
+    await get_message_buffer().flush_conversation()
+    async with get_pool().read() as db:
         if file_uuid:
             cursor = await db.execute(
-                """SELECT id, title, file_uuid, created_at, updated_at
+                """SELECT id, title, file_uuid, file_uuids, document_set, created_at, updated_at
                    FROM conversations WHERE file_uuid = ?
                    ORDER BY updated_at DESC""",
                 (file_uuid,)
             )
         else:
             cursor = await db.execute(
-                """SELECT id, title, file_uuid, created_at, updated_at
+                """SELECT id, title, file_uuid, file_uuids, document_set, created_at, updated_at
                    FROM conversations ORDER BY updated_at DESC"""
             )
         rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+        return [
+            {**dict(row), "file_uuids": json.loads(row["file_uuids"]) if row["file_uuids"] else None}
+            for row in rows
+        ]
 
 
 async def delete_conversation(conversation_id: str) -> bool:
@@ -189,19 +676,228 @@ async def delete_conversation(conversation_id: str) -> bool:
     WHY expose this: Users should be able to clear conversation history.
     GDPR/privacy compliance also requires deletion capability.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Enable foreign keys for CASCADE to work
-        await db.execute("PRAGMA foreign_keys = ON")
+    # Write queued messages first so they are deleted too instead of
+    # failing their foreign key on the next flush
+    await get_message_buffer().flush_conversation(conversation_id)
+
+    async def delete(db):
+        # foreign_keys is ON for every pooled connection, so CASCADE works
         cursor = await db.execute(
             "DELETE FROM conversations WHERE id = ?",
             (conversation_id,)
         )
-        await db.commit()
         return cursor.rowcount > 0
 
+    return await get_pool().write(delete)
+
 async def _conversation_exists(conversation_id: str) -> bool:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with get_pool().read() as db:
         cursor = await db.execute(
             "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)
         )
-        return (await cursor.fetchone()) is not None
\ No newline at end of file
+        return (await cursor.fetchone()) is not None
+
+
+async def upsert_file(
+    file_uuid: str,
+    filename: str,
+    chunk_count: int,
+    page_count: int,
+    byte_size: Optional[int] = None,
+    ingest_timings: Optional[Dict[str, float]] = None,
+    content_hash: Optional[str] = None,
+    pages: Optional[Dict[int, Tuple[str, int]]] = None
+):
+    """
+    Insert or update a file's catalog entry. Called when ingestion finishes.
+
+    WHY a catalog table: Listing files used to scroll up to 10,000 points
+    (with their full text) out of Qdrant on every sidebar load and silently
+    truncated bigger collections. Keeping one row per file makes listing an
+    indexed O(files) query, independent of how many chunks exist.
+
+    `pages` maps page number -> (content hash, chunk count) and replaces the
+    file's page hashes in the same transaction, so the next revision can be
+    re-ingested incrementally.
+    """
+    now = utc_now()
+    timings_json = json.dumps(ingest_timings) if ingest_timings else None
+    ingest_seconds = round(sum(ingest_timings.values()), 3) if ingest_timings else None
+
+    async def upsert(db):
+        # COALESCE keeps size/timings already known when reconciliation
+        # rebuilds a row without them
+        await db.execute(
+            """INSERT INTO files (file_uuid, filename, chunk_count, page_count, byte_size,
+                                  ingest_seconds, ingest_timings, content_hash, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(file_uuid) DO UPDATE SET
+                   filename = excluded.filename,
+                   chunk_count = excluded.chunk_count,
+                   page_count = excluded.page_count,
+                   byte_size = COALESCE(excluded.byte_size, files.byte_size),
+                   ingest_seconds = COALESCE(excluded.ingest_seconds, files.ingest_seconds),
+                   ingest_timings = COALESCE(excluded.ingest_timings, files.ingest_timings),
+                   content_hash = COALESCE(excluded.content_hash, files.content_hash),
+                   updated_at = excluded.updated_at""",
+            (file_uuid, filename, chunk_count, page_count, byte_size,
+             ingest_seconds, timings_json, content_hash, now, now)
+        )
+        if pages is not None:
+            await db.execute("DELETE FROM file_pages WHERE file_uuid = ?", (file_uuid,))
+            await db.executemany(
+                "INSERT INTO file_pages (file_uuid, page, content_hash, chunk_count) VALUES (?, ?, ?, ?)",
+                [(file_uuid, page, page_hash, chunks) for page, (page_hash, chunks) in pages.items()]
+            )
+
+    await get_pool().write(upsert)
+
+
+async def find_file_record(content_hash: str) -> Optional[Dict]:
+    """Catalog entry of an already ingested file with this content hash."""
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            "SELECT * FROM files WHERE content_hash = ? ORDER BY created_at LIMIT 1",
+            (content_hash,)
+        )
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def get_file_record(file_uuid: str) -> Optional[Dict]:
+    async with get_pool().read() as db:
+        cursor = await db.execute("SELECT * FROM files WHERE file_uuid = ?", (file_uuid,))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def get_file_pages(file_uuid: str) -> Dict[int, Tuple[str, int]]:
+    """Page number -> (content hash, chunk count) recorded at the last ingestion."""
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            "SELECT page, content_hash, chunk_count FROM file_pages WHERE file_uuid = ?",
+            (file_uuid,)
+        )
+        return {row["page"]: (row["content_hash"], row["chunk_count"]) for row in await cursor.fetchall()}
+
+
+async def mark_file_incomplete(file_uuid: str, chunk_count: int):
+    """
+    After a failed revision: the row no longer describes one whole upload.
+    Drop its content hash, so uploading either revision again ingests it
+    instead of answering "already ingested", and count only the chunks
+    still in Qdrant.
+    """
+    async def update(db):
+        await db.execute(
+            "UPDATE files SET content_hash = NULL, chunk_count = ?, updated_at = ? WHERE file_uuid = ?",
+            (chunk_count, utc_now(), file_uuid)
+        )
+
+    await get_pool().write(update)
+
+
+async def delete_file_pages(file_uuid: str, pages: List[int]):
+    """Forget page hashes so those pages are re-ingested next time."""
+    async def delete(db):
+        await db.executemany(
+            "DELETE FROM file_pages WHERE file_uuid = ? AND page = ?",
+            [(file_uuid, page) for page in pages]
+        )
+
+    await get_pool().write(delete)
+
+
+async def list_file_records() -> List[Dict]:
+    """List catalogued files, newest first."""
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            """SELECT file_uuid, filename, chunk_count, page_count, byte_size,
+                      ingest_seconds, ingest_timings, created_at, updated_at
+               FROM files ORDER BY created_at DESC"""
+        )
+        rows = await cursor.fetchall()
+        return [
+            {
+                **dict(row),
+                "ingest_timings": json.loads(row["ingest_timings"]) if row["ingest_timings"] else None
+            }
+            for row in rows
+        ]
+
+
+async def delete_file_record(file_uuid: str) -> bool:
+    async def delete(db):
+        cursor = await db.execute("DELETE FROM files WHERE file_uuid = ?", (file_uuid,))
+        return cursor.rowcount > 0
+
+    return await get_pool().write(delete)
+
+
+async def save_document_set(name: str, file_uuids: List[str], description: Optional[str] = None):
+    """Create the document set `name`, or replace its files and description."""
+    now = utc_now()
+
+    async def save(db):
+        await db.execute(
+            """INSERT INTO document_sets (name, description, created_at, updated_at)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET
+                   description = excluded.description,
+                   updated_at = excluded.updated_at""",
+            (name, description, now, now)
+        )
+        await db.execute("DELETE FROM document_set_files WHERE set_name = ?", (name,))
+        await db.executemany(
+            "INSERT INTO document_set_files (set_name, file_uuid) VALUES (?, ?)",
+            [(name, file_uuid) for file_uuid in dict.fromkeys(file_uuids)]
+        )
+
+    await get_pool().write(save)
+
+
+async def get_document_set(name: str) -> Optional[Dict]:
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            "SELECT name, description, created_at, updated_at FROM document_sets WHERE name = ?",
+            (name,)
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        cursor = await db.execute(
+            "SELECT file_uuid FROM document_set_files WHERE set_name = ? ORDER BY file_uuid",
+            (name,)
+        )
+        return {**dict(row), "file_uuids": [r["file_uuid"] for r in await cursor.fetchall()]}
+
+
+async def list_document_sets() -> List[Dict]:
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            """SELECT s.name, s.description, s.created_at, s.updated_at, COUNT(f.file_uuid) AS file_count
+               FROM document_sets s LEFT JOIN document_set_files f ON f.set_name = s.name
+               GROUP BY s.name ORDER BY s.name"""
+        )
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+async def delete_document_set(name: str) -> bool:
+    async def delete(db):
+        cursor = await db.execute("DELETE FROM document_sets WHERE name = ?", (name,))
+        return cursor.rowcount > 0
+
+    return await get_pool().write(delete)
+
+
+async def find_missing_files(file_uuids: List[str]) -> List[str]:
+    """The ids in `file_uuids` that are not in the file catalog."""
+    if not file_uuids:
+        return []
+    async with get_pool().read() as db:
+        cursor = await db.execute(
+            f"SELECT file_uuid FROM files WHERE file_uuid IN ({','.join('?' * len(file_uuids))})",
+            list(file_uuids)
+        )
+        known = {row["file_uuid"] for row in await cursor.fetchall()}
+    return [file_uuid for file_uuid in file_uuids if file_uuid not in known]
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model_registry import (
+    get_dense_embeddings, get_sparse_model, DENSE_MODEL_NAME, SPARSE_MODEL_NAME
+)
+
+# SQLite file holding embeddings of every chunk/sentence ever ingested ("" = disabled)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+# Least recently used embeddings are evicted once the stored vectors exceed this
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+# Evict down to this fraction of the limit so eviction doesn't run on every insert
+EVICT_TO_FRACTION = 0.9
+
+# SQLite's default limit on bound parameters is 999
+_LOOKUP_BATCH = 500
+
+# (sparse indices, sparse values)
+SparseVector = Tuple[List[int], List[float]]
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingCache:
+    """
+    On-disk store of document embeddings keyed on (sha256(text), model name).
+
+    WHY: Legal footers, standard clauses and repeated appendix pages show up
+    in most uploads, and re-uploads repeat almost everything. Ingestion asks
+    this store first and only runs the models on texts it has never seen.
+    Keying on the model name means switching models never serves stale vectors.
+
+    Vectors are stored as raw float32/int64 blobs. Thread-safe: ingestion
+    jobs use it from their pipeline threads.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_mb: float = EMBEDDING_CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                    text_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    first BLOB NOT NULL,
+                    second BLOB,
+                    nbytes INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (text_hash, model)
+                )
+            """)
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunk_embeddings_used ON chunk_embeddings(last_used)"
+            )
+            self._db.commit()
+            self._total_bytes = self._db.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM chunk_embeddings"
+            ).fetchone()[0]
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def get_dense(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        rows = self._get(model, texts)
+        return [
+            np.frombuffer(row[0], dtype=np.float32).tolist() if row else None
+            for row in rows
+        ]
+
+    def put_dense(self, model: str, texts: List[str], vectors: List[List[float]]):
+        self._put(model, [
+            (text, np.asarray(vector, dtype=np.float32).tobytes(), None)
+            for text, vector in zip(texts, vectors)
+        ])
+
+    def get_sparse(self, model: str, texts: List[str]) -> List[Optional[SparseVector]]:
+        rows = self._get(model, texts)
+        return [
+            (
+                np.frombuffer(row[0], dtype=np.int64).tolist(),
+                np.frombuffer(row[1], dtype=np.float32).tolist(),
+            ) if row else None
+            for row in rows
+        ]
+
+    def put_sparse(self, model: str, texts: List[str], vectors: List[SparseVector]):
+        self._put(model, [
+            (
+                text,
+                np.asarray(indices, dtype=np.int64).tobytes(),
+                np.asarray(values, dtype=np.float32).tobytes(),
+            )
+            for text, (indices, values) in zip(texts, vectors)
+        ])
+
+    def _get(self, model: str, texts: List[str]) -> List[Optional[Tuple[bytes, Optional[bytes]]]]:
+        if self._db is None:
+            self.misses += len(texts)
+            return [None] * len(texts)
+
+        hashes = [hash_text(text) for text in texts]
+        found: Dict[str, Tuple[bytes, Optional[bytes]]] = {}
+        with self._lock:
+            unique = list(set(hashes))
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for text_hash, first, second in self._db.execute(
+                    f"""SELECT text_hash, first, second FROM chunk_embeddings
+                        WHERE model = ? AND text_hash IN ({placeholders})""",
+                    (model, *batch)
+                ):
+                    found[text_hash] = (first, second)
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE chunk_embeddings SET last_used = ? WHERE text_hash = ? AND model = ?",
+                    [(now, text_hash, model) for text_hash in found]
+                )
+                self._db.commit()
+
+            rows = [found.get(text_hash) for text_hash in hashes]
+            hits = sum(row is not None for row in rows)
+            self.hits += hits
+            self.misses += len(rows) - hits
+            return rows
+
+    def _put(self, model: str, rows: List[Tuple[str, bytes, Optional[bytes]]]):
+        if self._db is None or not rows:
+            return
+        now = time.time()
+        values = {}
+        for text, first, second in rows:
+            values[hash_text(text)] = (first, second)
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                """INSERT OR IGNORE INTO chunk_embeddings
+                   (text_hash, model, first, second, nbytes, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                [
+                    (text_hash, model, first, second, len(first) + len(second or b""), now)
+                    for text_hash, (first, second) in values.items()
+                ]
+            )
+            if self._db.total_changes != before:
+                # Re-read instead of guessing which rows were ignored as duplicates
+                self._total_bytes = self._db.execute(
+                    "SELECT COALESCE(SUM(nbytes), 0) FROM chunk_embeddings"
+                ).fetchone()[0]
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICT_TO_FRACTION)
+        while self._total_bytes > target:
+            victims = self._db.execute(
+                """SELECT text_hash, model, nbytes FROM chunk_embeddings
+                   ORDER BY last_used LIMIT ?""",
+                (_LOOKUP_BATCH,)
+            ).fetchall()
+            if not victims:
+                break
+            removed = []
+            for text_hash, model, nbytes in victims:
+                removed.append((text_hash, model))
+                self._total_bytes -= nbytes
+                if self._total_bytes <= target:
+                    break
+            self._db.executemany(
+                "DELETE FROM chunk_embeddings WHERE text_hash = ? AND model = ?", removed
+            )
+            self.evictions += len(removed)
+
+    def stats(self) -> Dict:
+        entries = 0
+        if self._db is not None:
+            with self._lock:
+                entries = self._db.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "path": self.path or None,
+            "entries": entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared by the chunker (sentence embeddings) and the ingestion pipeline
+chunk_embedding_cache = ChunkEmbeddingCache()
+
+
+def embed_documents_cached(texts: List[str]) -> List[List[float]]:
+    """Dense document embeddings; only texts missing from the cache hit the model."""
+    vectors = chunk_embedding_cache.get_dense(DENSE_MODEL_NAME, texts)
+    # Boilerplate repeats inside a document too, so embed each text once
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        computed = dict(zip(missing, get_dense_embeddings().embed_documents(missing)))
+        chunk_embedding_cache.put_dense(DENSE_MODEL_NAME, missing, [computed[text] for text in missing])
+        vectors = [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+    return vectors
+
+
+def embed_sparse_cached(texts: List[str]) -> List[SparseVector]:
+    """BM25 document vectors as (indices, values); only uncached texts are encoded."""
+    vectors = chunk_embedding_cache.get_sparse(SPARSE_MODEL_NAME, texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        computed = {
+            text: (embedding.indices.tolist(), embedding.values.tolist())
+            for text, embedding in zip(missing, get_sparse_model().embed(missing))
+        }
+        chunk_embedding_cache.put_sparse(SPARSE_MODEL_NAME, missing, [computed[text] for text in missing])
+        vectors = [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+    return vectors
@@ -0,0 +1,621 @@
+import asyncio
+import functools
+import hashlib
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_community.document_loaders import PyPDFLoader
+from qdrant_client import models
+from qdrant_client.models import PointStruct
+
+from answer_cache import answer_cache
+from database import utc_now, upsert_file, get_file_pages, delete_file_pages, mark_file_incomplete
+from embedding_cache import embed_documents_cached, embed_sparse_cached
+from metrics import observe_ingest_timings, recording, span
+from prompt_builder import count_tokens
+from retrieval import client, COLLECTION_NAME, file_filter
+from semantic_chunker import chunk_documents
+
+# Number of PDFs processed at the same time. Each job runs its CPU-heavy steps
+# (chunking, embedding) on a dedicated thread so the event loop keeps serving
+# chat requests while an upload is in progress.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# Maximum number of uploads waiting for a worker before /upload_pdf starts
+# answering 503 instead of piling up unbounded work.
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+
+# How many finished jobs we keep around for GET /ingest_jobs/{id}
+MAX_FINISHED_JOBS = int(os.getenv("INGEST_MAX_FINISHED_JOBS", "500"))
+
+# Pipeline batch sizes. Peak memory per job is roughly
+# PIPELINE_QUEUE_SIZE batches of each size, independent of the PDF length.
+PAGE_BATCH_SIZE = int(os.getenv("INGEST_PAGE_BATCH_SIZE", "8"))  # pages chunked together
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))  # chunks per sparse/dense embed call
+UPSERT_BATCH_SIZE = int(os.getenv("INGEST_UPSERT_BATCH_SIZE", "64"))  # points per Qdrant upsert
+PIPELINE_QUEUE_SIZE = int(os.getenv("INGEST_PIPELINE_QUEUE_SIZE", "4"))
+
+# load+chunk, embed, upsert
+PIPELINE_STAGES = 3
+
+
+class IngestJob:
+    """
+    Tracks one uploaded PDF as it moves through the ingestion stages.
+
+    WHY track stages with timings: Ingestion runs in the background, so the
+    job record is the only way the frontend (and we) can see how far along
+    an upload is and which stage is slow.
+    """
+
+    def __init__(
+        self,
+        file_uuid: str,
+        filename: str,
+        file_path: str,
+        file_size: int,
+        content_hash: Optional[str] = None,
+        previous: Optional[Dict] = None,
+        upload_path: Optional[str] = None,
+    ):
+        self.id = str(uuid.uuid4())
+        self.file_uuid = file_uuid
+        self.filename = filename
+        self.file_path = file_path
+        # The upload, read from here and moved to file_path only once its
+        # points are written, so a failed revision keeps the previous PDF
+        self.upload_path = upload_path
+        self.file_size = file_size
+        self.content_hash = content_hash
+        # Catalog row of the revision this upload replaces, if any
+        self.previous = previous
+        self.status = "queued"  # queued → running → completed | failed
+        self.stage = "queued"
+        # Set by run_pipeline; stages (and anything they wait on) give up once it is set
+        self.pipeline_stop: Optional[threading.Event] = None
+        self.progress = {
+            "pages": 0,
+            "chunks_total": 0,
+            "chunks_embedded": 0,
+            "chunks_upserted": 0,
+            "pages_reused": 0,
+            "chunks_reused": 0,
+        }
+        self.timings: Dict[str, float] = {}
+        self._timings_lock = threading.Lock()
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = utc_now()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self._stage_started = time.perf_counter()
+
+    def set_stage(self, stage: str):
+        """Close the timing of the current stage and start a new one."""
+        now = time.perf_counter()
+        self.timings[self.stage] = round(
+            self.timings.get(self.stage, 0.0) + now - self._stage_started, 3
+        )
+        self.stage = stage
+        self._stage_started = now
+
+    def add_timing(self, stage: str, seconds: float):
+        """Accumulate busy time of a pipeline stage (stages run concurrently)."""
+        with self._timings_lock:
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + seconds, 3)
+
+    def points_upserted(self, points: List[PointStruct]):
+        """Called from the upsert stage after each batch is written."""
+
+    def covers(self, file_uuid: Optional[str] = None, content_hash: Optional[str] = None) -> bool:
+        """Whether this job writes the file with this uuid or these bytes."""
+        return bool(
+            (file_uuid and self.file_uuid == file_uuid) or (content_hash and self.content_hash == content_hash)
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "file_uuid": self.file_uuid,
+            "original_filename": self.filename,
+            "file_path": self.file_path,
+            "file_size": self.file_size,
+            "content_hash": self.content_hash,
+            "incremental": self.previous is not None,
+            "progress": dict(self.progress),
+            "timings": dict(self.timings),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+JobHandler = Callable[[IngestJob], Awaitable[Optional[Dict]]]
+
+
+class IngestJobManager:
+    """
+    Bounded job queue drained by a fixed number of worker tasks.
+
+    WHY asyncio workers + a thread pool: The handler is a coroutine so it can
+    update job state and talk to async resources, while every blocking step
+    is pushed onto `run_blocking`, whose pool is sized to the number of
+    workers. Uploads therefore never run more than INGEST_WORKERS heavy jobs
+    at once and never block the event loop.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, queue_size: int = INGEST_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.jobs: Dict[str, IngestJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        # Each job runs its pipeline stages on their own threads
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers * PIPELINE_STAGES, thread_name_prefix="ingest"
+        )
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            # Off the loop: a stage thread may still be waiting on a coroutine
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, job: IngestJob, handler: JobHandler) -> IngestJob:
+        """
+        Queue a job. Raises asyncio.QueueFull when the backlog is at capacity.
+        """
+        self._queue.put_nowait((job, handler))
+        self.jobs[job.id] = job
+        self._prune_finished()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def find_active(
+        self, file_uuid: Optional[str] = None, content_hash: Optional[str] = None
+    ) -> Optional[IngestJob]:
+        """A queued or running job for this file or with this content hash."""
+        for job in self.jobs.values():
+            if job.status in ("queued", "running") and job.covers(file_uuid, content_hash):
+                return job
+        return None
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Run a blocking call on the ingestion thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def _worker(self):
+        while True:
+            job, handler = await self._queue.get()
+            job.status = "running"
+            job.started_at = utc_now()
+            try:
+                job.result = await handler(job)
+                job.status = "completed"
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Ingestion cancelled during shutdown"
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"❌ Ingestion job {job.id} failed: {e}")
+            finally:
+                job.set_stage("done")
+                job.timings.pop("done", None)
+                job.finished_at = utc_now()
+                observe_ingest_timings(job.timings)
+                self._queue.task_done()
+
+    def _prune_finished(self):
+        finished = [
+            job_id for job_id, job in self.jobs.items()
+            if job.status in ("completed", "failed")
+        ]
+        # dicts keep insertion order, so the oldest finished jobs come first
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+
+# Background workers that chunk, embed and upsert uploaded PDFs
+ingest_jobs = IngestJobManager()
+
+_END = object()
+
+
+class _PipelineStopped(Exception):
+    """Raised in a stage when another stage failed."""
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    while True:
+        if stop.is_set():
+            raise _PipelineStopped()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _drain(q: queue.Queue, stop: threading.Event) -> Iterator:
+    while True:
+        if stop.is_set():
+            raise _PipelineStopped()
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        yield item
+
+
+def _batched(items: Iterator, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def hash_page(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _page_filter(file_uuid: str, pages: List[int]) -> models.Filter:
+    return models.Filter(
+        must=[
+            models.FieldCondition(key="file_uuid", match=models.MatchValue(value=file_uuid)),
+            models.FieldCondition(key="metadata.page", match=models.MatchAny(any=pages)),
+        ]
+    )
+
+
+def _delete_file_points(job: IngestJob):
+    client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.FilterSelector(filter=file_filter(job.file_uuid)),
+        wait=True,
+    )
+
+
+def _delete_pages(job: IngestJob, pages: List[int]):
+    client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.FilterSelector(filter=_page_filter(job.file_uuid, pages)),
+        wait=True,
+    )
+
+
+class _PageLedger:
+    """
+    Per-page hashes of the previous and the current revision of a file.
+
+    WHY per page: Users re-upload revisions that differ in a handful of
+    pages. Pages whose text hashes the same keep their points in Qdrant;
+    only the others are re-chunked, re-embedded and upserted.
+    """
+
+    def __init__(self, known: Dict[int, Tuple[str, int]]):
+        self.known = known
+        self.pages: Dict[int, Tuple[str, int]] = {}  # page -> (hash, chunk count)
+        self.stale: List[int] = []  # previous pages whose points were deleted
+        self.reingested: List[int] = []
+        self.reused_text_bytes = 0
+
+
+def _load_and_chunk(job: IngestJob, ledger: _PageLedger, out: queue.Queue, stop: threading.Event):
+    """Stage 1: read pages lazily and chunk the changed ones PAGE_BATCH_SIZE at a time."""
+    if job.previous and not ledger.known:
+        # A revision without page hashes: every old point goes
+        _delete_file_points(job)
+    loader = PyPDFLoader(job.upload_path or job.file_path, extract_images=True)
+    pages = loader.lazy_load()
+    page_no = 0
+    chunk_idx = 0
+    while True:
+        start = time.perf_counter()
+        batch = []
+        for page in pages:
+            # Sources point at the stored PDF, not the upload being read
+            page.metadata["source"] = job.file_path
+            batch.append((page.metadata.get("page", page_no), hash_page(page.page_content), page))
+            page_no += 1
+            if len(batch) >= PAGE_BATCH_SIZE:
+                break
+        job.add_timing("loading", time.perf_counter() - start)
+        if not batch:
+            break
+        job.progress["pages"] += len(batch)
+
+        start = time.perf_counter()
+        changed = [(number, page_hash, page) for number, page_hash, page in batch
+                   if ledger.known.get(number, (None, 0))[0] != page_hash]
+        stale = [number for number, _, _ in changed if number in ledger.known]
+        if stale:
+            # Old chunks of revised pages go before their replacements are upserted
+            _delete_pages(job, stale)
+            ledger.stale.extend(stale)
+
+        chunks = chunk_documents([page for _, _, page in changed])
+        chunks_by_page: Dict[int, List[dict]] = {}
+        for chunk in chunks:
+            chunks_by_page.setdefault(chunk["metadata"].get("page"), []).append(chunk)
+
+        # Number chunks in document order, counting the unchanged pages' chunks
+        for number, page_hash, page in batch:
+            if ledger.known.get(number, (None, 0))[0] == page_hash:
+                ledger.pages[number] = ledger.known[number]
+                chunk_idx += ledger.known[number][1]
+                ledger.reused_text_bytes += len(page.page_content.encode("utf-8"))
+                job.progress["pages_reused"] += 1
+                job.progress["chunks_reused"] += ledger.known[number][1]
+                continue
+            page_chunks = chunks_by_page.get(number, [])
+            for chunk in page_chunks:
+                chunk["metadata"]["chunk_idx"] = chunk_idx
+                chunk["file_uuid"] = job.file_uuid
+                chunk["file_name"] = job.filename
+                chunk_idx += 1
+            ledger.pages[number] = (page_hash, len(page_chunks))
+            ledger.reingested.append(number)
+        job.add_timing("chunking", time.perf_counter() - start)
+
+        job.progress["chunks_total"] += len(chunks)
+        for chunk in chunks:
+            _put(out, chunk, stop)
+
+    # Pages the new revision no longer has
+    removed = [number for number in ledger.known if number not in ledger.pages]
+    if removed:
+        _delete_pages(job, removed)
+        ledger.stale.extend(removed)
+    _put(out, _END, stop)
+
+
+def _embed(job: IngestJob, chunks: queue.Queue, out: queue.Queue, stop: threading.Event):
+    """Stage 2: sparse vectors (and dense ones if the chunker did not pool them)."""
+    for batch in _batched(_drain(chunks, stop), EMBED_BATCH_SIZE):
+        start = time.perf_counter()
+        texts = [chunk["content"] for chunk in batch]
+        # The chunker already attaches dense vectors (pooled from its sentence
+        # embeddings) unless CHUNK_VECTOR_MODE=none, so only embed when missing
+        if all("vector" in chunk for chunk in batch):
+            dense_vectors = [chunk["vector"] for chunk in batch]
+        else:
+            with span("embedding.dense"):
+                dense_vectors = embed_documents_cached(texts)
+        with span("embedding.sparse"):
+            sparse_vectors = embed_sparse_cached(texts)
+
+        points = []
+        for chunk, dense_vec, sparse_vec in zip(batch, dense_vectors, sparse_vectors):
+            points.append(
+                PointStruct(
+                    id=str(uuid.uuid4()),
+                    vector={
+                        "dense": dense_vec,
+                        "sparse": models.SparseVector(indices=sparse_vec[0], values=sparse_vec[1])
+                    },
+                    payload={
+                        "text": chunk["content"],
+                        "metadata": chunk["metadata"],
+                        "file_uuid": chunk["file_uuid"],
+                        "file_name": chunk["file_name"],
+                        "chunck_idx": chunk["metadata"]["chunk_idx"],
+                        # Cached so prompt building never re-tokenizes chunks
+                        "token_count": count_tokens(chunk["content"])
+                    }
+                )
+            )
+        job.add_timing("embedding", time.perf_counter() - start)
+        job.progress["chunks_embedded"] += len(points)
+        _put(out, points, stop)
+    _put(out, _END, stop)
+
+
+def _upsert(job: IngestJob, points: queue.Queue, stop: threading.Event):
+    """Stage 3: write points to Qdrant in UPSERT_BATCH_SIZE batches."""
+    pending = []
+    for batch in _drain(points, stop):
+        pending.extend(batch)
+        while len(pending) >= UPSERT_BATCH_SIZE:
+            _upsert_batch(job, pending[:UPSERT_BATCH_SIZE])
+            pending = pending[UPSERT_BATCH_SIZE:]
+    if pending:
+        _upsert_batch(job, pending)
+
+
+def _upsert_batch(job: IngestJob, batch: List[PointStruct]):
+    start = time.perf_counter()
+    client.upsert(collection_name=COLLECTION_NAME, wait=True, points=batch)
+    job.add_timing("upserting", time.perf_counter() - start)
+    job.progress["chunks_upserted"] += len(batch)
+    job.points_upserted(batch)
+
+
+def _run_stage_recorded(job: IngestJob, func: Callable, *args):
+    """Run a pipeline stage with span() timings (e.g. the chunker's) added to the job."""
+    with recording(job.add_timing):
+        return func(*args)
+
+
+async def run_pipeline(
+    job: IngestJob,
+    produce: Callable,
+    produce_args: Tuple = (),
+    on_error: Optional[Callable[[], Awaitable]] = None,
+):
+    """
+    Run `produce` (which puts chunks on a queue), _embed and _upsert as
+    concurrent threads connected by bounded queues.
+
+    If any stage fails the others are stopped, `on_error` cleans up, and the
+    first real error is raised. If the job is cancelled (shutdown), the stages
+    are stopped the same way and `on_error` still runs before the
+    cancellation propagates: threads cannot be interrupted, so without
+    waiting for them they would keep writing points nobody rolls back.
+    """
+    stop = threading.Event()
+    job.pipeline_stop = stop
+    chunk_queue: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE * EMBED_BATCH_SIZE)
+    point_queue: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    async def run_stage(func, *args):
+        try:
+            await ingest_jobs.run_blocking(_run_stage_recorded, job, func, *args)
+        except BaseException:
+            stop.set()  # unblock the other stages
+            raise
+
+    stages = asyncio.gather(
+        run_stage(produce, job, *produce_args, chunk_queue, stop),
+        run_stage(_embed, job, chunk_queue, point_queue, stop),
+        run_stage(_upsert, job, point_queue, stop),
+        return_exceptions=True,
+    )
+
+    async def clean_up():
+        await stages
+        if on_error is not None:
+            await on_error()
+
+    try:
+        # Shielded: cancelling the job must not abandon the stage threads
+        results = await asyncio.shield(stages)
+    except asyncio.CancelledError:
+        stop.set()
+        await asyncio.shield(clean_up())
+        raise
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        if on_error is not None:
+            await on_error()
+        raise next((e for e in errors if not isinstance(e, _PipelineStopped)), errors[0])
+
+
+async def run_ingest_job(job: IngestJob) -> Dict:
+    """
+    Stream one uploaded PDF through load → chunk → embed → upsert. Runs on an ingestion worker.
+
+    WHY a pipeline: Materialising every page, then every chunk, then one
+    giant upsert made peak memory grow with the PDF and left the CPU idle
+    during network I/O (and vice versa). Each stage now runs on its own
+    thread, connected by bounded queues, so parsing, embedding and upserts
+    overlap and memory stays proportional to the batch sizes.
+
+    When the job replaces an earlier revision (`job.previous`), only pages
+    whose text changed are re-ingested; see _PageLedger. A revision without
+    page hashes (catalogued before they were kept, or by reconcile_files.py)
+    has nothing to compare with: all its points are replaced.
+
+    Timings report the busy time of each stage; because they overlap, their
+    sum can exceed the wall-clock time of the job.
+    """
+    try:
+        return await _ingest(job)
+    finally:
+        if job.upload_path:
+            # Only still there if the job failed
+            Path(job.upload_path).unlink(missing_ok=True)
+
+
+async def _ingest(job: IngestJob) -> Dict:
+    job.set_stage("ingesting")
+    ledger = _PageLedger(await get_file_pages(job.file_uuid) if job.previous else {})
+
+    async def roll_back():
+        if ledger.known:
+            # Unchanged pages are still valid. Drop whatever was written for
+            # the touched ones and forget their hashes so a retry redoes them.
+            touched = set(ledger.stale) | set(ledger.reingested)
+            if not touched:
+                return
+            await ingest_jobs.run_blocking(_delete_pages, job, sorted(touched))
+            await delete_file_pages(job.file_uuid, sorted(touched))
+        else:
+            # Don't leave a half-ingested file searchable
+            await ingest_jobs.run_blocking(_delete_file_points, job)
+            touched = set()
+        if job.previous:
+            # The file lost chunks: its catalog row must not match either
+            # revision's bytes any more, and answers quoting it are stale
+            remaining = sum(chunks for page, (_, chunks) in ledger.known.items() if page not in touched)
+            await mark_file_incomplete(job.file_uuid, remaining)
+            answer_cache.invalidate_file(job.file_uuid)
+
+    await run_pipeline(job, _load_and_chunk, (ledger,), on_error=roll_back)
+    if job.upload_path:
+        os.replace(job.upload_path, job.file_path)
+
+    job.set_stage("cataloging")
+    chunks_created = job.progress["chunks_upserted"]
+    chunk_count = chunks_created + job.progress["chunks_reused"]
+    await upsert_file(
+        file_uuid=job.file_uuid,
+        filename=job.filename,
+        chunk_count=chunk_count,
+        page_count=job.progress["pages"],
+        byte_size=job.file_size,
+        ingest_timings={
+            stage: seconds for stage, seconds in job.timings.items() if stage != "queued"
+        },
+        content_hash=job.content_hash,
+        pages=ledger.pages,
+    )
+
+    # Answers built from an earlier version of this file are now stale
+    answer_cache.invalidate_file(job.file_uuid)
+
+    print(f"✅ Ingested {job.filename}: {chunks_created} new chunks, "
+          f"{job.progress['pages_reused']} unchanged pages reused")
+    result = {"chunks_created": chunks_created, "chunks_total": chunk_count}
+    if job.previous:
+        previous_pages = job.previous.get("page_count") or 0
+        previous_seconds = job.previous.get("ingest_seconds") or 0.0
+        result.update({
+            "pages_reingested": len(ledger.reingested),
+            "pages_removed": len([p for p in ledger.stale if p not in ledger.pages]),
+            "chunks_deleted": sum(ledger.known[p][1] for p in ledger.stale) if ledger.known
+            else job.previous.get("chunk_count") or 0,
+            "saved": {
+                "pages": job.progress["pages_reused"],
+                "chunks": job.progress["chunks_reused"],
+                "text_bytes": ledger.reused_text_bytes,
+                # Pro rata share of the previous ingestion time
+                "seconds_estimate": round(
+                    previous_seconds * job.progress["pages_reused"] / previous_pages, 3
+                ) if previous_pages else None,
+            },
+        })
+    return result
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+from model_registry import LLM_MODEL_NAME, LLM_TEMPERATURE, OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE
+from prompt_builder import ANSWER_RESERVE_TOKENS, LLM_CONTEXT_TOKENS, count_tokens
+
+# "1" = continue each conversation from the Ollama `context` of its previous
+# turn and send only the new turn (see OllamaSessions)
+OLLAMA_CONTEXT_REUSE = os.getenv("OLLAMA_CONTEXT_REUSE", "0") == "1"
+# Conversations whose Ollama context is kept (least recently used are dropped)
+OLLAMA_MAX_SESSIONS = int(os.getenv("OLLAMA_MAX_SESSIONS", "256"))
+
+
+def _answer_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class OllamaSessions:
+    """
+    Answer generation against Ollama's /api/generate with KV-cache reuse.
+
+    WHY: Every turn sent a completely rebuilt prompt, so Ollama prefilled
+    the instructions, the history and the retrieved context from scratch
+    (seconds on CPU before the first token). Two mechanisms avoid that:
+
+    1. Prefix reuse (always on). build_answer_prompt puts the stable part
+       (instructions, then history) first and this turn's context + question
+       last, and the model is kept loaded for OLLAMA_KEEP_ALIVE. Ollama only
+       prefills past the longest prefix it still has cached.
+    2. Context reuse (OLLAMA_CONTEXT_REUSE=1). The `context` Ollama returns
+       after a turn is stored per conversation id. The next turn sends it
+       back with only the new context + question, so nothing already
+       evaluated, including the previous answer, is prefilled again. The
+       session restarts with the full prompt when it no longer continues
+       the conversation (another worker or the answer cache produced the
+       last answer, or the server restarted) or when it would outgrow
+       LLM_CONTEXT_TOKENS.
+
+    WHY talk to /api/generate directly: LangChain's Ollama wrapper neither
+    passes `context` through nor returns it, nor exposes prompt_eval_count,
+    which is how prefill savings are measured.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        context_reuse: bool = OLLAMA_CONTEXT_REUSE,
+        max_sessions: int = OLLAMA_MAX_SESSIONS
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.context_reuse = context_reuse
+        self.max_sessions = max_sessions
+        self._client = httpx.Client(timeout=httpx.Timeout(None, connect=10.0))
+        # conversation id -> {"context": [...], "answer_hash": ...}
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {
+            "requests": 0,
+            "context_reused": 0,
+            "session_restarts": 0,
+            "prompt_tokens": 0,
+            "prefill_tokens": 0,
+        }
+
+    def stream(
+        self,
+        prompt: str,
+        stable_prefix_chars: int = 0,
+        conversation_id: Optional[str] = None,
+        chat_history: Optional[List[Dict]] = None,
+        info: Optional[Dict] = None
+    ) -> Iterator[str]:
+        """
+        Yield answer tokens. Closing the generator closes the HTTP stream,
+        which makes Ollama stop generating. `info` receives the prefill stats.
+        """
+        payload = {
+            "model": LLM_MODEL_NAME,
+            "prompt": prompt,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            # Without num_ctx Ollama uses its default window and silently
+            # truncates prompts budgeted for LLM_CONTEXT_TOKENS
+            "options": {"temperature": LLM_TEMPERATURE, "num_ctx": LLM_CONTEXT_TOKENS},
+        }
+        reuse = self.context_reuse and conversation_id is not None
+        context = self._continuation(conversation_id, chat_history) if reuse else None
+        if context is not None:
+            turn = prompt[stable_prefix_chars:]
+            if len(context) + count_tokens(turn) + ANSWER_RESERVE_TOKENS <= LLM_CONTEXT_TOKENS:
+                payload["prompt"] = turn
+                payload["context"] = context
+            else:
+                context = None
+                self._count("session_restarts")
+
+        started = time.perf_counter()
+        answer_parts = []
+        final: Dict = {}
+        with self._client.stream("POST", f"{self.base_url}/api/generate", json=payload) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise RuntimeError(f"Ollama: {data['error']}")
+                if data.get("response"):
+                    answer_parts.append(data["response"])
+                    yield data["response"]
+                if data.get("done"):
+                    final = data
+                    break
+
+        prompt_tokens = count_tokens(prompt)
+        prefill_tokens = final.get("prompt_eval_count", prompt_tokens)
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts["context_reused"] += context is not None
+            self.counts["prompt_tokens"] += prompt_tokens
+            self.counts["prefill_tokens"] += prefill_tokens
+            if reuse and final.get("context"):
+                self._sessions[conversation_id] = {
+                    "context": final["context"],
+                    "answer_hash": _answer_hash("".join(answer_parts)),
+                }
+                self._sessions.move_to_end(conversation_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+
+        if info is not None:
+            info.update({
+                "prompt_tokens": prompt_tokens,
+                "prefill_tokens": prefill_tokens,
+                "prefill_ms": round(final["prompt_eval_duration"] / 1e6, 1)
+                if "prompt_eval_duration" in final else None,
+                "context_reused": context is not None,
+                "llm_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+
+    def invoke(self, prompt: str, **kwargs) -> str:
+        return "".join(self.stream(prompt, **kwargs))
+
+    def _continuation(self, conversation_id: str, chat_history: Optional[List[Dict]]) -> Optional[List[int]]:
+        """The stored context, if its last answer is still the conversation's last answer."""
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                return None
+            last_answer = next(
+                (m["content"] for m in reversed(chat_history or []) if m["role"] == "assistant"), None
+            )
+            if last_answer is None or _answer_hash(last_answer) != session["answer_hash"]:
+                del self._sessions[conversation_id]
+                self.counts["session_restarts"] += 1
+                return None
+            self._sessions.move_to_end(conversation_id)
+            return session["context"]
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def forget(self, conversation_id: str):
+        with self._lock:
+            self._sessions.pop(conversation_id, None)
+
+    def stats(self) -> Dict:
+        counts = dict(self.counts)
+        return {
+            "context_reuse": self.context_reuse,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "sessions": len(self._sessions),
+            **counts,
+            # prompt_tokens is estimated unless PROMPT_TOKENIZER is set
+            "prefill_saved": round(1 - counts["prefill_tokens"] / counts["prompt_tokens"], 4)
+            if counts["prompt_tokens"] else 0.0,
+        }
+
+
+llm_sessions = OllamaSessions()
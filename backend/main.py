@@ -1,37 +1,77 @@
-from langchain_community.llms import Ollama
-from semantic_chunker import semantic_chunker
-from langchain_classic.prompts import PromptTemplate
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-import os, uuid
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from typing import List, Dict, Optional, Tuple
+import os, uuid, hashlib, time
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException
 from fastapi.responses import JSONResponse
 import uuid
 from pathlib import Path
 import shutil
 from PIL import ImageFile
-from qdrant_client import QdrantClient, models
-from qdrant_client.models import PointStruct
-from fastembed import SparseTextEmbedding
+from qdrant_client import models
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-import json, asyncio, queue, threading
+from fastapi.responses import StreamingResponse, PlainTextResponse
+import json, asyncio, threading
 from database import (
-    init_db, create_conversation, add_message,
-    get_conversation_messages, list_conversations, delete_conversation, _conversation_exists
+    init_db, close_db, create_conversation, add_message,
+    get_conversation_messages, list_conversations, delete_conversation, _conversation_exists,
+    get_message_buffer,
+    list_file_records, delete_file_record, find_file_record, get_file_record,
+    save_document_set, get_document_set, list_document_sets, delete_document_set, find_missing_files
 )
+from ingestion import IngestJob, ingest_jobs, run_ingest_job
+from bulk_ingest import BulkIngestJob, run_bulk_ingest_job, find_pdfs, BULK_INGEST_ROOT
+from model_registry import registry
+from retrieval import (
+    async_client, COLLECTION_NAME, ensure_collection, close_clients,
+    embed_query_async, hybrid_search, hybrid_search_batch, fuse_results, file_filter, scope_key,
+    query_embedding_cache
+)
+from answer_cache import answer_cache, split_for_replay
+from embedding_cache import chunk_embedding_cache
+from query_rewrite import query_rewriter
+from prompt_builder import build_answer_prompt, count_tokens
+from conversation_summary import conversation_summarizer, load_history
+from streaming import StreamStats, stream_llm
+from llm_session import llm_sessions
+from reranker import reranker
+from metrics import INGEST_STAGE_SECONDS, RequestTimer, recording, render_metrics, span
 from contextlib import asynccontextmanager
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+# Load all models right after startup instead of on the first request
+WARM_MODELS_ON_STARTUP = os.getenv("WARM_MODELS_ON_STARTUP", "1") == "1"
+
+# Search the raw query while it is being rewritten: "rrf" fuses both result
+# lists, "replace" uses the rewritten query's results, "off" disables it
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "rrf")
+# Most questions accepted by one /query_batch request
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "1000"))
+# Questions embedded and searched together (one query_batch_points call)
+QUERY_BATCH_SEARCH_SIZE = int(os.getenv("QUERY_BATCH_SEARCH_SIZE", "32"))
+# Simultaneous LLM generations per batch (default / upper bound of the
+# request's "concurrency"); Ollama runs OLLAMA_NUM_PARALLEL at once
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "2"))
+QUERY_BATCH_MAX_CONCURRENCY = int(os.getenv("QUERY_BATCH_MAX_CONCURRENCY", "8"))
+
 # Initialize a FastAPI app
 
 @asynccontextmanager
 async def startup(app: FastAPI):
     await init_db()
     print("✅ Database ready!")
+    await ensure_collection()
+    await ingest_jobs.start()
+    print(f"✅ Ingestion workers ready ({ingest_jobs.workers})!")
+    # Load models in the background so the worker can already answer
+    # health checks while all-mpnet-base-v2 and BM25 are warming up
+    if WARM_MODELS_ON_STARTUP:
+        threading.Thread(target=registry.warm_up, daemon=True).start()
     yield  # App runs here
+    await ingest_jobs.stop()
+    await conversation_summarizer.close()
+    await close_db()
+    await close_clients()
 
 app = FastAPI(lifespan=startup)
 
@@ -50,55 +90,32 @@ PDF_STORAGE_DIR.mkdir(exist_ok=True)
 # Initialize the RecursiveCharacterTextSplitter for splitting the pages into chunks
 # text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
 
-# Initializing the HuggingFaceEmbeddings to create embeddings for the created chunks
-# Using the sentence transformer
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-mpnet-base-v2",
-    model_kwargs={'device': 'cpu'},
-)
-
-# Connecting to the Qdrant database and creating a collection
-client = QdrantClient(url="http://localhost:6333")
-collection_name = "test_collection"
-if not client.collection_exists(collection_name=collection_name):
-    client.create_collection(
-        collection_name=collection_name,
-        # 1. Dense Vector Configuration (OpenAI)
-        vectors_config={
-            "dense": models.VectorParams(
-                size=768,  # Matches text-embedding-3-small
-                distance=models.Distance.COSINE
-            )
-        },
-        # 2. Sparse Vector Configuration (Keywords/BM25)
-        sparse_vectors_config={
-            "sparse": models.SparseVectorParams(
-                index=models.SparseIndexParams(
-                    on_disk=False, # Keep in RAM for speed
-                )
-            )
-        }
-    )
-    print("Hybrid Collection Created!")
-
-# Initialize the Sparse Embedding Model (Run this once, it downloads a small model)
-# "Qdrant/bm25" is a model that mimics BM25 but creates vector-compatible outputs
-sparse_embedding_model = SparseTextEmbedding(model_name="Qdrant/bm25")
-
-# Initialize Ollama LLM
-llm = Ollama(
-    model="llama3.2",  # or "mistral", "phi3"
-    temperature=0.7,
-)
-
 class QueryRequest(BaseModel):
     query: str
     k: int = 3
     file_uuid: Optional[str] = None
+    file_uuids: Optional[List[str]] = None  # search several files at once
+    document_set: Optional[str] = None  # or a named set (see /document_sets)
     conversation_id: Optional[str] = None  # ← NEW: ties query to a conversation
+    timings: bool = False  # attach per-stage timings (ms) to the response / done event
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    k: int = 3
+    file_uuid: Optional[str] = None
+    file_uuids: Optional[List[str]] = None
+    document_set: Optional[str] = None
+    concurrency: Optional[int] = None  # simultaneous LLM generations
+    timings: bool = False  # per-stage timings (ms) in the final line
 
 class ConversationCreate(BaseModel):
     file_uuid: Optional[str] = None
+    file_uuids: Optional[List[str]] = None
+    document_set: Optional[str] = None
+
+class DocumentSetRequest(BaseModel):
+    file_uuids: List[str]
+    description: Optional[str] = None
 
 class MessageResponse(BaseModel):
     role: str
@@ -110,78 +127,40 @@ class ConversationResponse(BaseModel):
     id: str
     title: str
     file_uuid: Optional[str]
+    file_uuids: Optional[List[str]] = None
+    document_set: Optional[str] = None
     created_at: str
     updated_at: str
     messages: Optional[List[MessageResponse]] = None
 
-def build_answer_prompt(query, retrieved_docs, chat_history) -> str:
-    # Build context from retrieved documents
-    context = "\n\n".join(
-        [f"[Source {i+1}]:\n{doc['content']}" for i, doc in enumerate(retrieved_docs)]
+async def get_cached_answer(scope: Optional[str], search_query: str, retrieved_docs: List[Dict]) -> Optional[Dict]:
+    """Look up a previous answer to this question over exactly these chunks (scope: scope_key())."""
+    query_vector = None
+    if answer_cache.similarity_threshold:
+        query_vector = (await embed_query_async(search_query))[0]  # served from the query cache
+    return answer_cache.get(
+        scope, search_query,
+        [doc["point_id"] for doc in retrieved_docs],
+        query_vector=query_vector
     )
 
-    # Build conversation history string
-    history_str = ""
-    if chat_history:
-        history_parts = []
-        for msg in chat_history:
-            role_label = "Human" if msg["role"] == "human" else "Assistant"
-            history_parts.append(f"{role_label}: {msg['content']}")
-        history_str = "\n".join(history_parts)
-
-    # Build prompt with or without history
-    if history_str:
-        prompt_template = """You are a helpful assistant that answers questions based on the provided context from a PDF document.
-
-        Context from the document:
-        {context}
-
-        Previous conversation:
-        {history}
-
-        Current question: {question}
-
-        Instructions:
-        - Answer the question based ONLY on the information provided in the context above
-        - Use the previous conversation to understand what the user is referring to (pronouns like "it", "that", "this", references like "the second point", etc.)
-        - If the answer is not in the context, say "I cannot find this information in the document"
-        - Be concise and specific
-        - If relevant, mention which source section supports your answer
-
-        Answer:"""
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question", "history"]
-        )
-        formatted_prompt = prompt.format(
-            context=context, question=query, history=history_str
-        )
-    else:
-        prompt_template = """You are a helpful assistant that answers questions based on the provided context from a PDF document.
-
-        Context from the document:
-        {context}
-
-        Question: {question}
-
-        Instructions:
-        - Answer the question based ONLY on the information provided in the context above
-        - If the answer is not in the context, say "I cannot find this information in the document"
-        - Be concise and specific
-        - If relevant, mention which source section supports your answer
-
-        Answer:"""
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
-        formatted_prompt = prompt.format(context=context, question=query)
-    return formatted_prompt
+async def cache_answer(scope: Optional[str], search_query: str, retrieved_docs: List[Dict], answer: str, sources: List[Dict]):
+    query_vector = None
+    if answer_cache.similarity_threshold:
+        query_vector = (await embed_query_async(search_query))[0]
+    answer_cache.put(
+        scope, search_query,
+        [doc["point_id"] for doc in retrieved_docs],
+        answer, sources,
+        source_files=[doc["file_uuid"] for doc in retrieved_docs],
+        query_vector=query_vector
+    )
 
 def generate_answer(
     query: str,
     retrieved_docs: List[Dict],
-    chat_history: Optional[List[Dict]] = None
+    chat_history: Optional[List[Dict]] = None,
+    conversation_id: Optional[str] = None
 ) -> Dict:
     """
     Generate an answer using the LLM based on retrieved documents and conversation history.
@@ -190,14 +169,24 @@ def generate_answer(
         query: The user's current question
         retrieved_docs: List of retrieved documents from Qdrant
         chat_history: List of previous messages [{"role": "human"|"assistant", "content": "..."}]
+        conversation_id: Lets Ollama continue from this conversation's KV cache
 
     Returns:
-        Dict with answer and sources
+        Dict with answer, sources and prompt token stats
     """
-    formatted_prompt = build_answer_prompt(query, retrieved_docs, chat_history)
+    with span("prompt_build"):
+        formatted_prompt, prompt_stats = build_answer_prompt(query, retrieved_docs, chat_history)
 
     # Generate answer
-    answer = llm.invoke(formatted_prompt)
+    llm_stats = {}
+    with span("generation"):
+        answer = llm_sessions.invoke(
+            formatted_prompt,
+            stable_prefix_chars=prompt_stats["stable_prefix_chars"],
+            conversation_id=conversation_id,
+            chat_history=chat_history,
+            info=llm_stats
+        )
 
     return {
         "answer": answer,
@@ -209,9 +198,48 @@ def generate_answer(
             }
             for doc in retrieved_docs
         ],
-        "num_sources": len(retrieved_docs)
+        "num_sources": len(retrieved_docs),
+        "prompt": {**prompt_stats, **llm_stats}
+    }
+
+@app.get("/health")
+async def health():
+    """
+    Liveness/readiness probe with model load status.
+
+    WHY always 200: The process is healthy as soon as it serves requests;
+    `models.ready` tells load balancers whether the models have finished
+    warming up, along with per-model load time and memory footprint.
+    """
+    return {"status": "ok", "models": registry.stats()}
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Hit/miss counters and sizes of the in-process and on-disk caches."""
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "answers": answer_cache.stats(),
+        "chunk_embeddings": await asyncio.to_thread(chunk_embedding_cache.stats),
+        "query_rewrites": query_rewriter.stats.stats(),
+        "conversation_summaries": conversation_summarizer.stats(),
+        "llm_sessions": llm_sessions.stats(),
+        "reranker": reranker.stats(),
+        "message_buffer": get_message_buffer().stats(),
     }
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus histograms of per-stage query and ingestion latency.
+
+    WHY per stage: "the query was slow" isn't actionable; history load,
+    rewrite, embedding, Qdrant, prompt building, time-to-first-token and
+    the DB write each have their own series (rag_query_stage_seconds),
+    ingestion stages theirs (rag_ingest_stage_seconds). Series are per
+    worker process.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/conversations")
 async def create_new_conversation(request: ConversationCreate):
     """
@@ -221,9 +249,13 @@ async def create_new_conversation(request: ConversationCreate):
     The frontend needs the conversation_id BEFORE the first message is sent,
     so it can associate the conversation with UI state (which chat tab is open,
     which file is selected, etc.). Creating it upfront also lets us set the
-    file_uuid at conversation creation time.
+    file_uuid (or file_uuids / document_set) at conversation creation time.
     """
-    conversation_id = await create_conversation(file_uuid=request.file_uuid)
+    if request.document_set and await get_document_set(request.document_set) is None:
+        raise HTTPException(status_code=404, detail="Document set not found")
+    conversation_id = await create_conversation(
+        file_uuid=request.file_uuid, file_uuids=request.file_uuids, document_set=request.document_set
+    )
     return {"conversation_id": conversation_id}
 
 
@@ -262,42 +294,125 @@ async def remove_conversation(conversation_id: str):
     for privacy/data management.
     """
     deleted = await delete_conversation(conversation_id)
+    llm_sessions.forget(conversation_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return {"message": "Conversation deleted"}
 
 @app.get("/list_files")
 async def list_files():
-    """Get all unique files in the database"""
-
-    scroll_result = client.scroll(
-        collection_name="test_collection",
-        limit=10000,
-        with_payload=True,
-        with_vectors=False
-    )
+    """
+    Get all ingested files from the file catalog.
 
-    files = {}
-    for point in scroll_result[0]:
-        file_id = point.payload.get("file_uuid")
-        if file_id and file_id not in files:
-            files[file_id] = {
-                "file_id": file_id,
-                "filename": point.payload.get("file_name"),
-                "chunks": 0
-            }
-        if file_id:
-            files[file_id]["chunks"] += 1
-        
-    print(files)
-    
+    WHY not scroll Qdrant: The catalog holds one row per file, filled in at
+    ingest time, so this stays fast no matter how many chunks exist.
+    See reconcile_files.py to rebuild it from Qdrant.
+    """
+    records = await list_file_records()
+    files = [
+        {
+            "file_id": record["file_uuid"],
+            "filename": record["filename"],
+            "chunks": record["chunk_count"],
+            "pages": record["page_count"],
+            "file_size": record["byte_size"],
+            "ingest_seconds": record["ingest_seconds"],
+            "created_at": record["created_at"]
+        }
+        for record in records
+    ]
     return {
         "total_files": len(files),
-        "files": list(files.values())
+        "files": files
     }
 
-@app.post("/upload_pdf")
-async def upload_pdf(file: UploadFile = File(...)):
+@app.delete("/files/{file_uuid}")
+async def delete_file(file_uuid: str):
+    """
+    Delete a file's chunks from Qdrant and its stored PDF.
+
+    WHY invalidate the answer cache here: Cached answers may quote chunks of
+    this file; they must not be served once the document is gone.
+
+    A catalogued file is deleted even if it has no points left (a failed
+    job, a manual Qdrant cleanup); an uncatalogued one only if it has points.
+    """
+    if ingest_jobs.find_active(file_uuid=file_uuid):
+        raise HTTPException(
+            status_code=409,
+            detail="This file is being ingested, delete it once the job has finished"
+        )
+    points_filter = file_filter(file_uuid)
+    if await get_file_record(file_uuid) is None:
+        count = await async_client.count(
+            collection_name=COLLECTION_NAME, count_filter=points_filter, exact=True
+        )
+        if count.count == 0:
+            raise HTTPException(status_code=404, detail="File not found")
+
+    await async_client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.FilterSelector(filter=points_filter),
+        wait=True,
+    )
+    (PDF_STORAGE_DIR / f"{file_uuid}.pdf").unlink(missing_ok=True)
+    await delete_file_record(file_uuid)
+    answer_cache.invalidate_file(file_uuid)
+    return {"message": "File deleted"}
+
+@app.get("/document_sets")
+async def get_document_sets():
+    """List the named document sets with their file counts."""
+    return {"document_sets": await list_document_sets()}
+
+@app.get("/document_sets/{name}")
+async def get_document_set_files(name: str):
+    document_set = await get_document_set(name)
+    if document_set is None:
+        raise HTTPException(status_code=404, detail="Document set not found")
+    return document_set
+
+@app.put("/document_sets/{name}")
+async def put_document_set(name: str, request: DocumentSetRequest):
+    """
+    Create a document set, or replace its files.
+
+    WHY named sets: Users comparing the same contracts or reports over and
+    over would otherwise resend every file id with every question; a query
+    or conversation can name the set instead (document_set).
+    """
+    if not request.file_uuids:
+        raise HTTPException(status_code=400, detail="A document set needs at least one file")
+    missing = await find_missing_files(request.file_uuids)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Unknown file_uuids: {missing}")
+    await save_document_set(name, request.file_uuids, request.description)
+    return await get_document_set(name)
+
+@app.delete("/document_sets/{name}")
+async def remove_document_set(name: str):
+    if not await delete_document_set(name):
+        raise HTTPException(status_code=404, detail="Document set not found")
+    return {"message": "Document set deleted"}
+
+# Bytes read per iteration while saving and hashing an upload
+UPLOAD_READ_SIZE = 1024 * 1024
+
+@app.post("/upload_pdf", status_code=202)
+async def upload_pdf(file: UploadFile = File(...), replaces: Optional[str] = None):
+    """
+    Save the PDF and queue it for background ingestion.
+
+    WHY 202 + job id: Chunking and embedding a large PDF takes seconds to
+    minutes of CPU. Doing it inline froze the event loop and stalled every
+    concurrent chat stream. The client polls GET /ingest_jobs/{job_id}.
+
+    WHY hash the upload: Users re-upload the same PDFs constantly. A byte
+    identical file is answered with the existing file_uuid (200, no job).
+    Pass `replaces=<file_uuid>` to upload a new revision of an ingested
+    file: it keeps that file_uuid and the job only re-ingests pages whose
+    text changed. Never inferred from the filename, which is not unique.
+    """
     # Validate that the uploaded file is a PDF
     if not file.filename.endswith('.pdf'):
         raise HTTPException(
@@ -312,74 +427,107 @@ async def upload_pdf(file: UploadFile = File(...)):
             detail="Invalid content type. Must be application/pdf"
         )
     
+    # Saved under a temporary name until we know which file_uuid it belongs to;
+    # a job moves it into place once ingested
+    upload_path = PDF_STORAGE_DIR / f"{uuid.uuid4()}.upload"
+    job = None
     try:
-        # Generate a unique UUID for the file
-        file_uuid = str(uuid.uuid4())
-        
-        # Create filename with UUID
-        file_path = PDF_STORAGE_DIR / f"{file_uuid}.pdf"
-        
-        # Save the file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # loader = PyPDFLoader(file_path, extract_images=True)
-
-        # docs = loader.load()
-        # print(f'Number of pages in file: {len(docs)}')
-
-        # texts = text_splitter.split_documents(docs)
-        result = semantic_chunker(file_path=file_path)
-        # print(result)
-        texts_chunk = [text.get("content") for text in result]
-
-        dense_vectors = embeddings.embed_documents(texts=texts_chunk)
-
-        # 2. Generate Sparse Vectors (FastEmbed)
-        # This returns a generator, so we convert to list
-        sparse_vectors = list(sparse_embedding_model.embed(texts_chunk))
-
-        points = []
-        for idx, (text, dense_vec, sparse_vec) in enumerate(zip(texts_chunk, dense_vectors, sparse_vectors)):
-            # 3. Create the Point with Named Vectors
-            points.append(
-                PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector={
-                        "dense": dense_vec,
-                        "sparse": models.SparseVector(
-                            indices=sparse_vec.indices.tolist(), values=sparse_vec.values.tolist()
-                        )
-                    },
-                    payload={
-                        "text": text,
-                        "metadata": result[idx].get("metadata"),
-                        "file_uuid": file_uuid,
-                        "file_name": file.filename,
-                        "chunck_idx": idx
-                    }
-                )
+        # Save and hash the file in one pass (off the event loop, uploads can be large)
+        def save_upload():
+            digest = hashlib.sha256()
+            with open(upload_path, "wb") as buffer:
+                while block := file.file.read(UPLOAD_READ_SIZE):
+                    digest.update(block)
+                    buffer.write(block)
+            return digest.hexdigest()
+        upload_started = time.perf_counter()
+        content_hash = await asyncio.to_thread(save_upload)
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - upload_started, stage="upload")
+        file_size = os.path.getsize(upload_path)
+
+        # 1. Same bytes already ingested: nothing to do
+        existing = await find_file_record(content_hash=content_hash)
+        if existing:
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "message": "PDF already ingested",
+                    "job_id": None,
+                    "uuid": existing["file_uuid"],
+                    "original_filename": existing["filename"],
+                    "file_path": str(PDF_STORAGE_DIR / f"{existing['file_uuid']}.pdf"),
+                    "file_size": file_size,
+                    "chunks_created": existing["chunk_count"],
+                    "content_hash": content_hash,
+                    "duplicate": True,
+                    "saved": {"bytes": file_size, "seconds": existing["ingest_seconds"]},
+                }
             )
 
-        operation_info = client.upsert(
-            collection_name="test_collection",
-            wait=True,
-            points=points,
+        # ...or currently being ingested: follow that job
+        active = ingest_jobs.find_active(content_hash=content_hash)
+        if isinstance(active, BulkIngestJob):
+            # Its job only reports a file_uuid per file, once the whole batch is done
+            raise HTTPException(
+                status_code=409,
+                detail=f"This PDF is being ingested by bulk job {active.id}, it is searchable once that file completes"
+            )
+        if active:
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "message": "PDF already being ingested",
+                    **_upload_job_response(active),
+                    "duplicate": True,
+                }
+            )
+
+        # 2. New revision of a file we already have: re-ingest changed pages only
+        previous = None
+        if replaces:
+            previous = await get_file_record(replaces)
+            if previous is None:
+                raise HTTPException(status_code=404, detail="File to replace not found")
+            if ingest_jobs.find_active(file_uuid=replaces):
+                raise HTTPException(
+                    status_code=409,
+                    detail="A previous revision of this file is still being ingested"
+                )
+
+        # 3. Otherwise a brand new file
+        file_uuid = previous["file_uuid"] if previous else str(uuid.uuid4())
+        file_path = PDF_STORAGE_DIR / f"{file_uuid}.pdf"
+
+        job = IngestJob(
+            file_uuid=file_uuid,
+            filename=file.filename,
+            file_path=str(file_path),
+            file_size=file_size,
+            content_hash=content_hash,
+            previous=previous,
+            upload_path=str(upload_path),
         )
-        print(operation_info)
-        
+        try:
+            ingest_jobs.submit(job, run_ingest_job)
+        except asyncio.QueueFull:
+            job = None
+            raise HTTPException(
+                status_code=503,
+                detail="Ingestion queue is full, please retry later"
+            )
+
         return JSONResponse(
-            status_code=200,
+            status_code=202,
             content={
-                "message": "PDF uploaded successfully",
-                "uuid": file_uuid,
-                "original_filename": file.filename,
-                "file_path": str(file_path),
-                "file_size": os.path.getsize(file_path),
-                "chunks_created": len(points)
+                "message": "PDF accepted for ingestion",
+                **_upload_job_response(job),
+                "duplicate": False,
             }
         )
-    
+
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -387,65 +535,223 @@ async def upload_pdf(file: UploadFile = File(...)):
         )
     
     finally:
+        if job is None:
+            upload_path.unlink(missing_ok=True)
         # Close the file
         await file.close()
 
-@app.post("/query_file_stream")
-async def query_file_stream(query_request: QueryRequest):
-    query_text = query_request.query
-    conversation_id = query_request.conversation_id
+def _upload_job_response(job: IngestJob) -> Dict:
+    return {
+        "job_id": job.id,
+        "uuid": job.file_uuid,
+        "original_filename": job.filename,
+        "file_path": job.file_path,
+        "file_size": job.file_size,
+        "content_hash": job.content_hash,
+        "incremental": job.previous is not None,
+        "status_url": f"/ingest_jobs/{job.id}"
+    }
+
+@app.post("/bulk_ingest", status_code=202)
+async def bulk_ingest(
+    files: List[UploadFile] = File(default=[]),
+    directory: Optional[str] = Form(default=None),
+    recursive: bool = Form(default=False),
+):
+    """
+    Queue many PDFs as one background job: uploaded files and/or every PDF
+    in a server-side directory under BULK_INGEST_ROOT.
+
+    WHY one job: PDFs are parsed on a process pool and chunked across
+    documents with shared embedding calls, which is far faster than one
+    /upload_pdf per file. Progress, docs/min and chunks/sec are reported by
+    GET /ingest_jobs/{job_id}. Files identical to already ingested ones are
+    skipped.
+    """
+    items = []
+    if directory:
+        root = Path(BULK_INGEST_ROOT).resolve() if BULK_INGEST_ROOT else None
+        target = Path(directory).resolve()
+        if root is None or not target.is_relative_to(root):
+            raise HTTPException(
+                status_code=403,
+                detail="Directory is outside BULK_INGEST_ROOT"
+            )
+        if not target.is_dir():
+            raise HTTPException(status_code=404, detail="Directory not found")
+        items.extend(await asyncio.to_thread(find_pdfs, str(target), recursive))
 
-    # --- Step A: Session Management ---
-    if not conversation_id:
-        conversation_id = await create_conversation(file_uuid=query_request.file_uuid)
+    saved = []
+    try:
+        for upload in files:
+            if not upload.filename.endswith('.pdf'):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Only PDF files are allowed: {upload.filename}"
+                )
+            upload_path = PDF_STORAGE_DIR / f"{uuid.uuid4()}.upload"
+            saved.append(upload_path)
 
-    # --- Step B: Load Chat History ---
-    chat_history = await get_conversation_messages(conversation_id, limit=10)
+            def save_upload():
+                with open(upload_path, "wb") as buffer:
+                    shutil.copyfileobj(upload.file, buffer)
+            await asyncio.to_thread(save_upload)
+            items.append((str(upload_path), upload.filename, True))
 
-    # --- Step C: Store the Human Message ---
-    await add_message(conversation_id, "human", query_text)
+        if not items:
+            raise HTTPException(status_code=400, detail="No PDFs to ingest")
 
-    # --- Step D: Rewrite Query for Better Retrieval ---
-    search_query = await rewrite_query_if_needed(query_text, chat_history)
+        job = BulkIngestJob(items)
+        try:
+            ingest_jobs.submit(job, run_bulk_ingest_job)
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=503,
+                detail="Ingestion queue is full, please retry later"
+            )
+        saved = []  # owned by the job now
+    finally:
+        for upload_path in saved:
+            upload_path.unlink(missing_ok=True)
+        for upload in files:
+            await upload.close()
 
-    # --- Step E: Hybrid Search ---
-    query_dense = embeddings.embed_query(search_query)
-    raw_sparse_output = next(sparse_embedding_model.query_embed(search_query))
-    query_sparse_formatted = models.SparseVector(
-        indices=raw_sparse_output.indices.tolist(),
-        values=raw_sparse_output.values.tolist()
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "PDFs accepted for bulk ingestion",
+            "job_id": job.id,
+            "files": len(items),
+            "status_url": f"/ingest_jobs/{job.id}"
+        }
     )
 
-    query_filter = None
-    if query_request.file_uuid:
-        query_filter = models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="file_uuid",
-                    match=models.MatchValue(value=query_request.file_uuid)
-                )
-            ]
-        )
+@app.get("/ingest_jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """
+    Report stage, progress and per-stage timings of an ingestion job.
 
-    search_result = client.query_points(
-        collection_name=collection_name,
-        prefetch=[
-            models.Prefetch(query=query_dense, using="dense", limit=10, filter=query_filter),
-            models.Prefetch(query=query_sparse_formatted, using="sparse", limit=10, filter=query_filter),
-        ],
-        query=models.FusionQuery(fusion=models.Fusion.RRF),
-        limit=query_request.k,
-    )
+    WHY: Uploads return immediately, so this is how the frontend learns when
+    the document is searchable (status == "completed") or why it failed.
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job.to_dict()
+
+async def resolve_scope(request) -> Optional[List[str]]:
+    """
+    Files a query request is scoped to; None = every file.
+
+    A document set stands on its own; file_uuid and file_uuids combine.
+    """
+    if request.document_set:
+        if request.file_uuid or request.file_uuids:
+            raise HTTPException(status_code=400, detail="Use either document_set or file_uuid(s), not both")
+        document_set = await get_document_set(request.document_set)
+        if document_set is None:
+            raise HTTPException(status_code=404, detail="Document set not found")
+        if not document_set["file_uuids"]:
+            raise HTTPException(status_code=400, detail="Document set has no files")
+        return document_set["file_uuids"]
+    file_uuids = ([request.file_uuid] if request.file_uuid else []) + (request.file_uuids or [])
+    return list(dict.fromkeys(file_uuids)) or None
+
+async def prepare_retrieval(query_request: QueryRequest) -> Tuple[str, List[Dict], str, List[Dict], Optional[List[str]]]:
+    """
+    Create/load the conversation, store the question, rewrite it and retrieve chunks.
+
+    Returns (conversation_id, chat_history, search_query, retrieved_docs, scope).
+
+    WHY speculative retrieval: The rewrite needs the history and may need
+    the LLM, and only then could retrieval start. Unless
+    SPECULATIVE_RETRIEVAL is "off", a search on the raw query starts right
+    away, concurrently with conversation setup, history loading and the
+    rewrite. If the rewrite keeps the query unchanged (the common case) its
+    result is used as is; otherwise the rewritten query's results are fused
+    with it by RRF ("rrf") or replace it ("replace").
+    """
+    query_text = query_request.query
+    k = query_request.k
+    # One indexed lookup at most (document sets), so resolved before the
+    # speculative search rather than alongside it
+    scope = await resolve_scope(query_request)
+
+    speculative = None
+    if SPECULATIVE_RETRIEVAL != "off":
+        speculative = asyncio.create_task(hybrid_search(query_text, scope, k))
+    try:
+        # --- Step A: Session Management ---
+        # Auto-create conversation if not provided
+        # WHY: Backwards-compatible. Old frontend code that doesn't send
+        # conversation_id will still work—each query just creates a new session.
+        conversation_id = query_request.conversation_id
+        if not conversation_id:
+            conversation_id = await create_conversation(
+                file_uuid=query_request.file_uuid,
+                file_uuids=query_request.file_uuids,
+                document_set=query_request.document_set
+            )
+        elif not await _conversation_exists(conversation_id):
+            # Messages are written behind (MessageWriteBuffer), where an
+            # unknown conversation would only fail the foreign key later
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+        # --- Step B: Load Chat History ---
+        # Rolling summary of older turns + the (up to 10) messages it doesn't
+        # cover yet, so long conversations don't grow the prompt
+        # (see ConversationSummarizer)
+        with span("history_load"):
+            chat_history = await load_history(conversation_id)
+
+        # --- Step C: Store the Human Message ---
+        # WHY store BEFORE generating the answer: If the server crashes mid-generation,
+        # we don't lose the user's question. The conversation remains consistent.
+        # WHY after loading history: the history must not contain this question.
+        # add_message only queues the row (see MessageWriteBuffer), so this
+        # does not delay retrieval.
+        with span("message_insert"):
+            await add_message(conversation_id, "human", query_text, token_count=count_tokens(query_text))
+
+        # --- Step D: Rewrite Query for Better Retrieval ---
+        # WHY: If the user says "tell me more about that", searching Qdrant for
+        # "tell me more about that" returns garbage. We use the LLM to rewrite
+        # the query into a standalone question using conversation context, but
+        # only when the query actually depends on it (see QueryRewriter).
+        with span("rewrite"):
+            search_query = await query_rewriter.rewrite(query_text, chat_history, conversation_id)
+
+        # --- Step E: Hybrid Search ---
+        # "retrieval" is only what is left of it after the rewrite
+        with span("retrieval"):
+            if speculative is None:
+                retrieved = await hybrid_search(search_query, scope, k)
+            elif search_query == query_text:
+                retrieved = await speculative
+            else:
+                retrieved = await hybrid_search(search_query, scope, k)
+                if SPECULATIVE_RETRIEVAL == "rrf":
+                    try:
+                        retrieved = fuse_results([retrieved, await speculative], k)
+                    except Exception as e:
+                        # The rewritten query's results are enough on their own
+                        print(f"⚠️ Speculative retrieval failed: {e}")
+        return conversation_id, chat_history, search_query, retrieved, scope
+    finally:
+        if speculative is not None:
+            if not speculative.done():
+                speculative.cancel()
+            elif not speculative.cancelled():
+                speculative.exception()  # retrieved, so an unused failure isn't logged
+
+@app.post("/query_file_stream")
+async def query_file_stream(query_request: QueryRequest):
+    query_text = query_request.query
+    timer = RequestTimer("query_file_stream")
 
-    formatted_results = []
-    for point in search_result.points:
-        formatted_results.append({
-            "content": point.payload["text"],
-            "metadata": point.payload['metadata'],
-            "similarity_score": float(point.score),
-            "file_uuid": query_request.file_uuid,
-            "file_name": point.payload.get("file_name")
-        })
+    # --- Steps A-E: Session, History, Human Message, Rewrite, Hybrid Search ---
+    with recording(timer.record):
+        conversation_id, chat_history, search_query, formatted_results, scope = await prepare_retrieval(query_request)
 
     sources = [
         {
@@ -456,51 +762,72 @@ async def query_file_stream(query_request: QueryRequest):
         for doc in formatted_results
     ]
 
-    formatted_prompt = build_answer_prompt(query_text, formatted_results, chat_history)
+    cached = await get_cached_answer(scope_key(scope), search_query, formatted_results)
+    if cached is None:
+        with timer.span("prompt_build"):
+            formatted_prompt, prompt_stats = build_answer_prompt(query_text, formatted_results, chat_history)
+
+    def finish(done: Dict) -> Dict:
+        timer.finish()
+        if query_request.timings:
+            done["timings"] = timer.to_dict()
+        return done
 
     # --- Step F: Stream the LLM response ---
     async def event_generator():
-        token_queue = queue.Queue()
-        full_answer_parts = []
-
-        def run_stream():
-            try:
-                for chunk in llm.stream(formatted_prompt):
-                    token_queue.put(chunk)
-                token_queue.put(None)  # sentinel: stream complete
-            except Exception as e:
-                token_queue.put(e)
-
-        thread = threading.Thread(target=run_stream, daemon=True)
-        thread.start()
-
-        loop = asyncio.get_event_loop()
-
         try:
-            while True:
-                item = await loop.run_in_executor(None, token_queue.get)
-                if item is None:
-                    break
-                if isinstance(item, Exception):
-                    yield f"event: error\ndata: {json.dumps({'detail': str(item)})}\n\n"
-                    return
-                full_answer_parts.append(item)
-                yield f"event: token\ndata: {json.dumps({'token': item})}\n\n"
+            if cached is not None:
+                # Replay the cached answer as tokens so the frontend sees no difference
+                for token in split_for_replay(cached["answer"]):
+                    yield f"event: token\ndata: {json.dumps({'token': token})}\n\n"
+                yield f"event: sources\ndata: {json.dumps({'sources': cached['sources'], 'num_sources': len(cached['sources'])})}\n\n"
+                with timer.span("db_write"):
+                    await add_message(
+                        conversation_id, "assistant",
+                        cached["answer"],
+                        sources=cached["sources"],
+                        token_count=count_tokens(cached["answer"])
+                    )
+                conversation_summarizer.schedule(conversation_id)
+                done = finish({'conversation_id': conversation_id, 'full_answer': cached['answer'], 'cached': True})
+                yield f"event: done\ndata: {json.dumps(done)}\n\n"
+                return
+
+            full_answer_parts = []
+            stream_stats = StreamStats()
+
+            async for frame in stream_llm(
+                formatted_prompt, stream_stats,
+                prompt_stats["stable_prefix_chars"], conversation_id, chat_history
+            ):
+                if not full_answer_parts:
+                    timer.record("ttft", stream_stats.first_token_at - stream_stats.started)
+                full_answer_parts.append(frame)
+                yield f"event: token\ndata: {json.dumps({'token': frame})}\n\n"
+            timer.record("generation", time.perf_counter() - stream_stats.started)
 
             full_answer = "".join(full_answer_parts)
+            await cache_answer(scope_key(scope), search_query, formatted_results, full_answer, sources)
 
             yield f"event: sources\ndata: {json.dumps({'sources': sources, 'num_sources': len(sources)})}\n\n"
 
-            await add_message(
-                conversation_id, "assistant",
-                full_answer,
-                sources=sources
-            )
+            with timer.span("db_write"):
+                await add_message(
+                    conversation_id, "assistant",
+                    full_answer,
+                    sources=sources,
+                    token_count=count_tokens(full_answer)
+                )
+            conversation_summarizer.schedule(conversation_id)
+            print(f"⏱️ Stream stats: {stream_stats.to_dict()}, prompt: {prompt_stats}")
 
-            yield f"event: done\ndata: {json.dumps({'conversation_id': conversation_id, 'full_answer': full_answer})}\n\n"
+            done = finish({'conversation_id': conversation_id, 'full_answer': full_answer, 'prompt': {**prompt_stats, **stream_stats.llm}})
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
 
         except Exception as e:
             yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        finally:
+            timer.finish()  # errors and client disconnects count too
 
     return StreamingResponse(
         event_generator(),
@@ -511,142 +838,176 @@ async def query_file_stream(query_request: QueryRequest):
 @app.post("/query_file")
 async def query_file(query_request: QueryRequest):
     query_text = query_request.query
-    conversation_id = query_request.conversation_id
-
-    # --- Step A: Session Management ---
-    # Auto-create conversation if not provided
-    # WHY: Backwards-compatible. Old frontend code that doesn't send
-    # conversation_id will still work—each query just creates a new session.
-    if not conversation_id:
-        conversation_id = await create_conversation(file_uuid=query_request.file_uuid)
-
-    # --- Step B: Load Chat History ---
-    # Retrieve last 10 messages (5 human + 5 assistant turns)
-    # WHY 10: Balances context quality vs token budget. See Section 7.
-    chat_history = await get_conversation_messages(conversation_id, limit=10)
-
-    # --- Step C: Store the Human Message ---
-    # WHY store BEFORE generating the answer: If the server crashes mid-generation,
-    # we don't lose the user's question. The conversation remains consistent.
-    await add_message(conversation_id, "human", query_text)
-
-    # --- Step D: Rewrite Query for Better Retrieval ---
-    # WHY: If the user says "tell me more about that", searching Qdrant for
-    # "tell me more about that" returns garbage. We use the LLM to rewrite
-    # the query into a standalone question using conversation context.
-    search_query = await rewrite_query_if_needed(query_text, chat_history)
-
-    # --- Step E: Hybrid Search (same as before, but using rewritten query) ---
-    query_dense = embeddings.embed_query(search_query)  # ← uses rewritten query
-    raw_sparse_output = next(sparse_embedding_model.query_embed(search_query))
-    query_sparse_formatted = models.SparseVector(
-        indices=raw_sparse_output.indices.tolist(),
-        values=raw_sparse_output.values.tolist()
-    )
-
-    query_filter = None
-    if query_request.file_uuid:
-        query_filter = models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="file_uuid",
-                    match=models.MatchValue(value=query_request.file_uuid)
-                )
-            ]
-        )
-
-    search_result = client.query_points(
-        collection_name=collection_name,
-        prefetch=[
-            models.Prefetch(query=query_dense, using="dense", limit=10, filter=query_filter),
-            models.Prefetch(query=query_sparse_formatted, using="sparse", limit=10, filter=query_filter),
-        ],
-        query=models.FusionQuery(fusion=models.Fusion.RRF),
-        limit=query_request.k,
-    )
+    timer = RequestTimer("query_file")
 
-    formatted_results = []
-    for point in search_result.points:
-        formatted_results.append({
-            "content": point.payload["text"],
-            "metadata": point.payload['metadata'],
-            "similarity_score": float(point.score),
-            "file_uuid": query_request.file_uuid,
-            "file_name": point.payload.get("file_name")
-        })
+    # --- Steps A-E: Session, History, Human Message, Rewrite, Hybrid Search ---
+    with recording(timer.record):
+        conversation_id, chat_history, search_query, formatted_results, scope = await prepare_retrieval(query_request)
 
     # --- Step F: Generate Answer WITH History ---
-    result = generate_answer(
-        query=query_text,          # Original query (not rewritten)
-        retrieved_docs=formatted_results,
-        chat_history=chat_history   # ← NEW: pass conversation history
-    )
+    # WHY check the answer cache first: the same standalone question over the
+    # same retrieved chunks produces the same answer, so skip Ollama entirely
+    cached = await get_cached_answer(scope_key(scope), search_query, formatted_results)
+    if cached is not None:
+        result = {
+            "answer": cached["answer"],
+            "sources": cached["sources"],
+            "num_sources": len(cached["sources"])
+        }
+    else:
+        # Blocking Ollama call: run it off the event loop
+        with recording(timer.record):
+            result = await asyncio.to_thread(
+                generate_answer,
+                query=query_text,          # Original query (not rewritten)
+                retrieved_docs=formatted_results,
+                chat_history=chat_history,   # ← NEW: pass conversation history
+                conversation_id=conversation_id
+            )
+        await cache_answer(scope_key(scope), search_query, formatted_results, result["answer"], result["sources"])
 
     # --- Step G: Store the Assistant Message ---
-    await add_message(
-        conversation_id, "assistant",
-        result["answer"],
-        sources=result["sources"]
-    )
+    with timer.span("db_write"):
+        await add_message(
+            conversation_id, "assistant",
+            result["answer"],
+            sources=result["sources"],
+            token_count=count_tokens(result["answer"])
+        )
+    # Fold older turns into the summary after the answer, off the request path
+    conversation_summarizer.schedule(conversation_id)
+    timer.finish()
 
     # --- Step H: Return response WITH conversation_id ---
-    return JSONResponse(
-        status_code=200,
-        content={
-            "query": query_request.query,
-            "answer": result["answer"],
-            "sources": result["sources"],
-            "num_sources": result["num_sources"],
-            "conversation_id": conversation_id  # ← NEW: frontend stores this
-        }
-    )
+    content = {
+        "query": query_request.query,
+        "answer": result["answer"],
+        "sources": result["sources"],
+        "num_sources": result["num_sources"],
+        "prompt": result.get("prompt"),  # None when served from the answer cache
+        "conversation_id": conversation_id  # ← NEW: frontend stores this
+    }
+    if query_request.timings:
+        content["timings"] = timer.to_dict()
+    return JSONResponse(status_code=200, content=content)
 
-async def rewrite_query_if_needed(
-    query: str,
-    chat_history: List[Dict]
-) -> str:
+@app.post("/query_batch")
+async def query_batch(batch: BatchQueryRequest):
     """
-    Rewrite a follow-up query into a standalone question using conversation context.
-
-    WHY: Vague follow-ups like "tell me more" or "what about that" produce poor
-    embeddings for retrieval. Rewriting them into specific standalone questions
-    dramatically improves retrieval quality.
-
-    WHY only when history exists: If this is the first message in a conversation,
-    there's nothing to contextualize—the query is already standalone.
-
-    WHY use the same LLM: We already have Ollama running. The rewrite prompt is
-    short and fast. No need for a separate model.
+    Answer many standalone questions over the same scope, streamed as NDJSON.
+
+    WHY: QA runs thousands of questions against documents. One /query_file
+    call each meant one embedding, one Qdrant request, one LLM call and a
+    conversation per question. Here the questions (deduplicated) are
+    embedded in one batched pass per QUERY_BATCH_SEARCH_SIZE, searched with
+    one query_batch_points call, and answered by at most `concurrency`
+    simultaneous generations (match OLLAMA_NUM_PARALLEL). No conversation,
+    history or rewrite: every question stands alone.
+
+    One line per question as soon as it is answered, in completion order:
+    {"index", "query", "answer", "sources", "num_sources", "cached"} or
+    {"index", "query", "error"}; then a final {"done": true, ...} summary.
     """
-    if not chat_history:
-        return query  # No history → query is already standalone
-
-    # Build a concise history summary (only last 4 messages to keep rewrite prompt small)
-    recent_history = chat_history[-4:]
-    history_str = "\n".join(
-        [f"{'Human' if m['role'] == 'human' else 'Assistant'}: {m['content'][:200]}"
-         for m in recent_history]
+    if not batch.queries:
+        raise HTTPException(status_code=400, detail="No queries")
+    if len(batch.queries) > QUERY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {QUERY_BATCH_MAX} queries per batch")
+    scope = await resolve_scope(batch)
+    concurrency = max(1, min(batch.concurrency or QUERY_BATCH_CONCURRENCY, QUERY_BATCH_MAX_CONCURRENCY))
+    return StreamingResponse(
+        batch_results(batch, scope, concurrency),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache"}
     )
 
-    rewrite_prompt = f"""Given the following conversation history and a follow-up question, rewrite the follow-up question to be a standalone question that captures the full intent without needing the conversation context.
-
-    If the question is already standalone and clear, return it unchanged.
-
-    Conversation history:
-    {history_str}
-
-    Follow-up question: {query}
-
-    Standalone question:"""
+async def batch_results(batch: BatchQueryRequest, scope: Optional[List[str]], concurrency: int):
+    timer = RequestTimer("query_batch")
+    questions = list(dict.fromkeys(batch.queries))
+    indices: Dict[str, List[int]] = {}
+    for index, question in enumerate(batch.queries):
+        indices.setdefault(question, []).append(index)
+    answered: asyncio.Queue = asyncio.Queue()
+    generation_slots = asyncio.Semaphore(concurrency)
+    tasks: List[asyncio.Task] = []
+
+    async def answer(question: str, docs: List[Dict]):
+        try:
+            cached = await get_cached_answer(scope_key(scope), question, docs)
+            if cached is not None:
+                line = {"answer": cached["answer"], "sources": cached["sources"], "cached": True}
+            else:
+                async with generation_slots:
+                    result = await asyncio.to_thread(generate_answer, query=question, retrieved_docs=docs)
+                await cache_answer(scope_key(scope), question, docs, result["answer"], result["sources"])
+                line = {"answer": result["answer"], "sources": result["sources"], "cached": False}
+            line["num_sources"] = len(line["sources"])
+        except Exception as e:
+            line = {"error": str(e)}
+        await answered.put((question, line))
 
-    rewritten = llm.invoke(rewrite_prompt).strip()
+    # Questions whose line is on its way: an answer task or an error
+    handed_off = set()
 
-    # Fallback: if the LLM returns something weird (empty, too long, or looks like
-    # a full answer instead of a question), use the original query
-    if not rewritten or len(rewritten) > 300 or len(rewritten) < 5:
-        return query
+    def fail(unanswered: List[str], error: BaseException):
+        for question in unanswered:
+            if question not in handed_off:
+                handed_off.add(question)
+                answered.put_nowait((question, {"error": f"Retrieval failed: {error}"}))
 
-    return rewritten
+    async def retrieve_all():
+        # Generation of one slice overlaps retrieval of the next
+        try:
+            for start in range(0, len(questions), QUERY_BATCH_SEARCH_SIZE):
+                chunk = questions[start:start + QUERY_BATCH_SEARCH_SIZE]
+                try:
+                    with span("retrieval"):
+                        retrieved = await hybrid_search_batch(chunk, scope, batch.k)
+                    if len(retrieved) != len(chunk):
+                        raise RuntimeError(f"{len(retrieved)} results for {len(chunk)} questions")
+                except Exception as e:
+                    fail(chunk, e)
+                    continue
+                for question, docs in zip(chunk, retrieved):
+                    handed_off.add(question)
+                    tasks.append(asyncio.create_task(answer(question, docs)))
+        except Exception as e:
+            print(f"❌ Batch retrieval failed: {e}")
+            fail(questions, e)
+
+    def retrieval_finished(task: asyncio.Task):
+        # However retrieval ended, no question is left without a line, so
+        # the loop below never waits for one that will not come
+        error = None if task.cancelled() else task.exception()
+        fail(questions, error or RuntimeError("question was not retrieved"))
+
+    with recording(timer.record):
+        retrieval = asyncio.create_task(retrieve_all())
+    retrieval.add_done_callback(retrieval_finished)
+    tasks.append(retrieval)
+    errors = cache_hits = 0
+    try:
+        for _ in questions:
+            question, line = await answered.get()
+            errors += "error" in line
+            cache_hits += line.get("cached", False)
+            for index in indices[question]:
+                yield json.dumps({"index": index, "query": question, **line}) + "\n"
+        timer.finish()
+        done = {
+            "done": True,
+            "scope": scope,
+            "num_queries": len(batch.queries),
+            "unique_queries": len(questions),
+            "cached": cache_hits,
+            "errors": errors,
+        }
+        if batch.timings:
+            done["timings"] = timer.to_dict()
+        yield json.dumps(done) + "\n"
+    finally:
+        # Client went away: stop queued generations (running ones finish in their thread)
+        for task in tasks:
+            task.cancel()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,159 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds: sub-millisecond cache hits up to multi-minute ingests
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    """
+    Prometheus histogram with labels, rendered in the text exposition format.
+
+    WHY not prometheus_client: /metrics only needs a few histograms; this
+    keeps the backend free of another dependency and of its multiprocess
+    setup (each uvicorn worker exposes its own series, like /cache_stats).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Iterable[str],
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, seconds: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, key))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return lines
+
+
+QUERY_STAGE_SECONDS = Histogram(
+    "rag_query_stage_seconds",
+    "Time spent in each stage of a query request.",
+    ["endpoint", "stage"],
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds",
+    "Time spent in each ingestion stage, per document.",
+    ["stage"],
+)
+
+# Where span() reports to: a RequestTimer on the query path, an ingestion
+# job's add_timing in pipeline threads, nothing elsewhere
+_span_sink: ContextVar[Optional[Callable[[str, float], None]]] = ContextVar("span_sink", default=None)
+
+
+@contextmanager
+def recording(sink: Callable[[str, float], None]) -> Iterator[None]:
+    """Send span() timings of this context (and tasks/threads it starts) to `sink`."""
+    token = _span_sink.set(sink)
+    try:
+        yield
+    finally:
+        _span_sink.reset(token)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a block as `stage` for whatever is recording.
+
+    WHY a context variable: Stages like the Qdrant query or the dense
+    embedding live deep in retrieval/semantic_chunker; this way they are
+    timed without threading a timer through every signature. asyncio tasks
+    and asyncio.to_thread inherit it; run_embedding copies it explicitly.
+    """
+    sink = _span_sink.get()
+    if sink is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sink(stage, time.perf_counter() - started)
+
+
+class RequestTimer:
+    """
+    Per-stage timings of one query request.
+
+    Every span is observed into QUERY_STAGE_SECONDS as it ends; to_dict()
+    sums them per stage for the response. Stages that run concurrently
+    (speculative retrieval) each count their own time.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def record(self, stage: str, seconds: float):
+        QUERY_STAGE_SECONDS.observe(seconds, endpoint=self.endpoint, stage=stage)
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def finish(self):
+        """Record the request's total time (once)."""
+        if not self._finished:
+            self._finished = True
+            self.record("total", time.perf_counter() - self.started)
+
+    def to_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()}
+
+
+def observe_ingest_timings(timings: Dict[str, float]):
+    """Export an ingestion job's per-stage totals once it has finished."""
+    for stage, seconds in timings.items():
+        INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in (QUERY_STAGE_SECONDS, INGEST_STAGE_SECONDS):
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,181 @@
+import os
+import resource
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+# Names of the models used by the backend
+DENSE_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+SPARSE_MODEL_NAME = "Qdrant/bm25"
+LLM_MODEL_NAME = os.getenv("OLLAMA_MODEL", "llama3.2")  # or "mistral", "phi3"
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# How long Ollama keeps the model (and its KV cache) loaded after a request;
+# unloading drops every cached prompt prefix
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+LLM_TEMPERATURE = 0.7
+# Hugging Face tokenizer matching the LLM, used to count prompt tokens
+# ("" = estimate from text length, e.g. "unsloth/Llama-3.2-1B-Instruct" for llama3.2)
+PROMPT_TOKENIZER_NAME = os.getenv("PROMPT_TOKENIZER", "")
+# fastembed cross-encoder that reranks hybrid search results
+# ("" = no reranking, e.g. "Xenova/ms-marco-MiniLM-L-6-v2"; see reranker.py)
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL", "")
+
+
+def _current_rss_mb() -> float:
+    """Resident memory of this process in MB (Linux /proc, falls back to peak RSS)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ModelRegistry:
+    """
+    Loads each model once per process, on first use.
+
+    WHY a registry: main.py and semantic_chunker.py used to build their own
+    all-mpnet-base-v2 at import time, so every worker held two copies
+    (~900 MB wasted) and could not answer anything until both had loaded.
+    Here every model is created lazily behind a per-model lock, shared by
+    all modules, and its load time and memory footprint are recorded.
+    """
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], object]] = {}
+        self._models: Dict[str, object] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+
+    def register(self, name: str, loader: Callable[[], object]):
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+        self._stats[name] = {"status": "not_loaded"}
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            if name in self._models:
+                return self._models[name]
+
+            self._stats[name] = {"status": "loading"}
+            rss_before = _current_rss_mb()
+            start = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                self._stats[name] = {"status": "failed", "error": str(e)}
+                raise
+            self._stats[name] = {
+                "status": "loaded",
+                "load_seconds": round(time.perf_counter() - start, 3),
+                "rss_delta_mb": round(_current_rss_mb() - rss_before, 1),
+            }
+            self._models[name] = model
+            print(f"✅ Loaded model '{name}' in {self._stats[name]['load_seconds']}s")
+            return model
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def is_ready(self) -> bool:
+        return all(name in self._models for name in self._loaders)
+
+    def warm_up(self, names: Optional[Iterable[str]] = None):
+        """
+        Load models ahead of the first request.
+
+        WHY sequential: Loading in parallel would fight for the same CPU and
+        make the per-model memory deltas meaningless.
+        """
+        for name in names or list(self._loaders):
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"❌ Failed to load model '{name}': {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "ready": self.is_ready(),
+            "rss_mb": round(_current_rss_mb(), 1),
+            "models": {name: dict(stat) for name, stat in self._stats.items()},
+        }
+
+
+def _load_dense():
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=DENSE_MODEL_NAME,
+        model_kwargs={'device': 'cpu'},
+    )
+
+
+def _load_sparse():
+    # "Qdrant/bm25" is a model that mimics BM25 but creates vector-compatible outputs
+    from fastembed import SparseTextEmbedding
+    return SparseTextEmbedding(model_name=SPARSE_MODEL_NAME)
+
+
+def _load_llm():
+    from langchain_community.llms import Ollama
+    # prompt_builder imports this module, so not at the top. The same
+    # num_ctx as llm_session's requests: Ollama reloads the model whenever
+    # it changes between requests
+    from prompt_builder import LLM_CONTEXT_TOKENS
+    return Ollama(
+        model=LLM_MODEL_NAME,
+        base_url=OLLAMA_BASE_URL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        temperature=LLM_TEMPERATURE,
+        num_ctx=LLM_CONTEXT_TOKENS,
+    )
+
+
+def _load_tokenizer():
+    # transformers is already installed as a sentence-transformers dependency
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(PROMPT_TOKENIZER_NAME)
+
+
+def _load_reranker():
+    # ONNX on CPU, like the BM25 model
+    from fastembed.rerank.cross_encoder import TextCrossEncoder
+    return TextCrossEncoder(model_name=RERANK_MODEL_NAME)
+
+
+registry = ModelRegistry()
+registry.register("dense", _load_dense)
+registry.register("sparse", _load_sparse)
+registry.register("llm", _load_llm)
+if PROMPT_TOKENIZER_NAME:
+    registry.register("tokenizer", _load_tokenizer)
+if RERANK_MODEL_NAME:
+    registry.register("reranker", _load_reranker)
+
+
+def get_dense_embeddings():
+    return registry.get("dense")
+
+
+def get_sparse_model():
+    return registry.get("sparse")
+
+
+def get_llm():
+    return registry.get("llm")
+
+
+def get_tokenizer():
+    """The configured prompt tokenizer, or None when token counts are estimated."""
+    return registry.get("tokenizer") if PROMPT_TOKENIZER_NAME else None
+
+
+def get_reranker():
+    return registry.get("reranker")
@@ -0,0 +1,218 @@
+import functools
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from langchain_classic.prompts import PromptTemplate
+
+from model_registry import get_tokenizer
+
+# Context window the LLM is run with (Ollama's num_ctx)
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "4096"))
+# Tokens kept free for the answer
+ANSWER_RESERVE_TOKENS = int(os.getenv("ANSWER_RESERVE_TOKENS", "512"))
+# Share of the remaining prompt budget history may use; retrieved context gets the rest
+HISTORY_BUDGET_FRACTION = float(os.getenv("HISTORY_BUDGET_FRACTION", "0.3"))
+# Longer history messages (usually earlier answers) are cut to this many tokens
+HISTORY_MESSAGE_MAX_TOKENS = int(os.getenv("HISTORY_MESSAGE_MAX_TOKENS", "256"))
+# History never takes the room the best chunk needs, up to this many tokens of it
+MIN_TOP_CHUNK_TOKENS = int(os.getenv("MIN_TOP_CHUNK_TOKENS", "256"))
+
+# Rough English average for Llama-style BPE vocabularies
+CHARS_PER_TOKEN = 4
+# "[Source N]:\n" / "Assistant: " and the separating newlines
+SOURCE_OVERHEAD_TOKENS = 6
+MESSAGE_OVERHEAD_TOKENS = 3
+TRUNCATION_MARK = " …"
+
+HISTORY_LABELS = {
+    "human": "Human",
+    "assistant": "Assistant",
+    # Rolling summary from conversation_summary, always the oldest entry
+    "summary": "Summary of earlier conversation",
+}
+
+# Precompiled once instead of building a PromptTemplate per request.
+#
+# WHY split into a prefix and a turn: Ollama only skips prefill for the
+# longest prefix a new prompt shares with one it has already evaluated. The
+# instructions and the conversation so far are the same on the next turn
+# (history only grows at the end), while the retrieved context and question
+# change every time, so the stable part goes first and the volatile part last.
+ANSWER_PREFIX_WITH_HISTORY = PromptTemplate(
+    template="""You are a helpful assistant that answers questions based on the provided context from a PDF document.
+
+Instructions:
+- Answer the question based ONLY on the information provided in the context below
+- Use the previous conversation to understand what the user is referring to (pronouns like "it", "that", "this", references like "the second point", etc.)
+- If the answer is not in the context, say "I cannot find this information in the document"
+- Be concise and specific
+- If relevant, mention which source section supports your answer
+
+Previous conversation:
+{history}
+""",
+    input_variables=["history"]
+)
+
+ANSWER_PREFIX = PromptTemplate(
+    template="""You are a helpful assistant that answers questions based on the provided context from a PDF document.
+
+Instructions:
+- Answer the question based ONLY on the information provided in the context below
+- If the answer is not in the context, say "I cannot find this information in the document"
+- Be concise and specific
+- If relevant, mention which source section supports your answer
+""",
+    input_variables=[]
+)
+
+ANSWER_TURN = PromptTemplate(
+    template="""
+Context from the document:
+{context}
+
+Question: {question}
+
+Answer:""",
+    input_variables=["context", "question"]
+)
+
+_tokenizer_failed = False
+
+
+def _tokenizer():
+    global _tokenizer_failed
+    if _tokenizer_failed:
+        return None
+    try:
+        return get_tokenizer()
+    except Exception as e:
+        _tokenizer_failed = True
+        print(f"⚠️ Prompt tokenizer unavailable, estimating token counts: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """
+    Tokens of `text` for the LLM. Exact with PROMPT_TOKENIZER set, otherwise
+    estimated from its length. Counts are cached per chunk (Qdrant payload)
+    and per message (SQLite) so requests rarely tokenize anything.
+    """
+    tokenizer = _tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    tokenizer = _tokenizer()
+    if tokenizer is not None:
+        ids = tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+        return tokenizer.decode(ids).rstrip() + TRUNCATION_MARK
+    return text[:max_tokens * CHARS_PER_TOKEN].rstrip() + TRUNCATION_MARK
+
+
+@functools.lru_cache(maxsize=None)
+def _template_tokens(with_history: bool) -> int:
+    prefix = ANSWER_PREFIX_WITH_HISTORY.format(history="") if with_history else ANSWER_PREFIX.format()
+    return count_tokens(prefix + ANSWER_TURN.format(context="", question=""))
+
+
+def build_answer_prompt(
+    query: str,
+    retrieved_docs: List[Dict],
+    chat_history: Optional[List[Dict]],
+    budget: Optional[int] = None
+) -> Tuple[str, Dict]:
+    """
+    Fill the answer template within a token budget. Returns (prompt, token stats).
+
+    WHY a budget: Retrieved chunks and earlier answers were pasted in
+    verbatim, so long ones blew up the prompt (and Ollama's prefill time)
+    or silently overflowed the context window. Now:
+      - history keeps the newest messages, each capped at
+        HISTORY_MESSAGE_MAX_TOKENS, within HISTORY_BUDGET_FRACTION (a
+        leading {"role": "summary"} entry stands in for older turns) and
+        without eating into the first MIN_TOP_CHUNK_TOKENS of the best chunk;
+      - context keeps chunks in retrieval order while they fit (the best
+        chunk is truncated rather than dropped); source numbers stay those
+        of the retrieval results so citations still match the sources list.
+
+    stats["stable_prefix_chars"] marks where the instructions + history end
+    and this turn's context + question begin (see llm_session).
+    """
+    budget = budget or LLM_CONTEXT_TOKENS - ANSWER_RESERVE_TOKENS
+    question_tokens = count_tokens(query)
+    truncated = 0
+
+    # History: newest first until its share of the budget is used
+    history_parts = []
+    history_tokens = 0
+    if chat_history:
+        available = max(0, budget - _template_tokens(True) - question_tokens)
+        history_budget = int(available * HISTORY_BUDGET_FRACTION)
+        if retrieved_docs:
+            top = retrieved_docs[0]
+            top_tokens = top.get("token_count") or count_tokens(top["content"])
+            reserved = min(top_tokens, MIN_TOP_CHUNK_TOKENS) + SOURCE_OVERHEAD_TOKENS
+            history_budget = min(history_budget, available - reserved)
+        for msg in reversed(chat_history):
+            content = msg["content"]
+            tokens = msg.get("token_count") or count_tokens(content)
+            cut = tokens > HISTORY_MESSAGE_MAX_TOKENS
+            if cut:
+                content = truncate_to_tokens(content, HISTORY_MESSAGE_MAX_TOKENS)
+                tokens = count_tokens(content)
+            if history_tokens + tokens + MESSAGE_OVERHEAD_TOKENS > history_budget:
+                break
+            history_parts.append(f"{HISTORY_LABELS.get(msg['role'], 'Assistant')}: {content}")
+            history_tokens += tokens + MESSAGE_OVERHEAD_TOKENS
+            truncated += cut
+        history_parts.reverse()
+
+    with_history = bool(history_parts)
+    template_tokens = _template_tokens(with_history)
+    context_budget = max(0, budget - template_tokens - question_tokens - history_tokens)
+
+    # Context: best chunks first; skip ones that no longer fit
+    context_parts = []
+    context_tokens = 0
+    for i, doc in enumerate(retrieved_docs):
+        content = doc["content"]
+        tokens = doc.get("token_count") or count_tokens(content)
+        remaining = context_budget - context_tokens - SOURCE_OVERHEAD_TOKENS
+        if tokens > remaining:
+            kept = remaining - count_tokens(TRUNCATION_MARK)
+            if context_parts or kept <= 0:
+                continue
+            # Never send the LLM an empty context because the top chunk is long
+            content = truncate_to_tokens(content, kept)
+            tokens = count_tokens(content)
+            truncated += 1
+        context_parts.append(f"[Source {i+1}]:\n{content}")
+        context_tokens += tokens + SOURCE_OVERHEAD_TOKENS
+
+    if with_history:
+        prefix = ANSWER_PREFIX_WITH_HISTORY.format(history="\n".join(history_parts))
+    else:
+        prefix = ANSWER_PREFIX.format()
+    prompt = prefix + ANSWER_TURN.format(context="\n\n".join(context_parts), question=query)
+
+    stats = {
+        "prompt_tokens": template_tokens + question_tokens + history_tokens + context_tokens,
+        "budget": budget,
+        "context_tokens": context_tokens,
+        "history_tokens": history_tokens,
+        "question_tokens": question_tokens,
+        "chunks_used": len(context_parts),
+        "chunks_dropped": len(retrieved_docs) - len(context_parts),
+        "messages_used": len(history_parts),
+        "messages_dropped": len(chat_history or []) - len(history_parts),
+        "truncated": truncated,
+        "stable_prefix_chars": len(prefix),
+    }
+    return prompt, stats
@@ -0,0 +1,234 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# In-memory entries kept before the least recently used one is evicted
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+# Seconds before an entry is recomputed (0 = never expires)
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "0"))
+# Optional SQLite file used as a second tier that survives restarts
+QUERY_CACHE_DISK_PATH = os.getenv("QUERY_CACHE_DISK_PATH", "")
+# Least recently used rows are pruned once the disk tier holds more than this
+QUERY_CACHE_DISK_MAX_ROWS = int(os.getenv("QUERY_CACHE_DISK_MAX_ROWS", "100000"))
+# Prune down to this fraction of the limit so pruning doesn't run on every insert
+PRUNE_TO_FRACTION = 0.9
+# Disk writes are committed every this many puts or seconds, whichever comes first
+DISK_COMMIT_EVERY = 32
+DISK_COMMIT_SECONDS = 1.0
+# Seconds between sweeps of expired disk rows (with a TTL)
+DISK_SWEEP_SECONDS = 300
+
+# (dense vector, (sparse indices, sparse values))
+QueryVectors = Tuple[List[float], Tuple[List[int], List[float]]]
+
+
+def normalize_query(text: str) -> str:
+    """Collapse whitespace and case so trivially different spellings share an entry."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of dense + sparse query vectors, with optional TTL and disk tier.
+
+    WHY: Users ask the same questions over and over across conversations,
+    and every one of them used to pay a full all-mpnet-base-v2 forward pass
+    plus a BM25 encode. Keys include the model ids so switching models never
+    serves stale vectors.
+
+    The disk tier is bounded like the chunk embedding cache: beyond
+    QUERY_CACHE_DISK_MAX_ROWS the least recently used rows are pruned, and
+    with a TTL expired rows are swept periodically, not only when read.
+    Writes are committed in batches; a crash loses at most the last batch.
+
+    Thread-safe: lookups happen on the embedding executor threads.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        max_entries: int = QUERY_CACHE_SIZE,
+        ttl_seconds: float = QUERY_CACHE_TTL,
+        disk_path: str = QUERY_CACHE_DISK_PATH,
+        disk_max_rows: int = QUERY_CACHE_DISK_MAX_ROWS,
+    ):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, QueryVectors]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_max_rows = disk_max_rows
+        self.disk_evictions = 0
+        self._disk_rows = 0
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+        self._last_sweep = time.monotonic()
+
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode = WAL")
+            self._disk.execute("PRAGMA synchronous = NORMAL")
+            self._disk.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    dense BLOB NOT NULL,
+                    sparse_indices BLOB NOT NULL,
+                    sparse_values BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL
+                )
+            """)
+            columns = {row[1] for row in self._disk.execute("PRAGMA table_info(query_embeddings)")}
+            if "last_used" not in columns:
+                self._disk.execute("ALTER TABLE query_embeddings ADD COLUMN last_used REAL")
+            # Rows written before last_used existed count as used when created
+            self._disk.execute("UPDATE query_embeddings SET last_used = created_at WHERE last_used IS NULL")
+            self._disk.execute(
+                "CREATE INDEX IF NOT EXISTS idx_query_embeddings_used ON query_embeddings(last_used)"
+            )
+            self._disk_rows = self._disk.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            self._prune()
+            self._disk.commit()
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_id}\x00{normalize_query(text)}"
+
+    def _expired(self, created_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - created_at > self.ttl_seconds
+
+    def get(self, text: str) -> Optional[QueryVectors]:
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+            vectors = self._disk_get(key)
+            if vectors is not None:
+                self.disk_hits += 1
+                self._remember(key, vectors[0], vectors[1])
+                return vectors[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, dense: List[float], sparse_indices: List[int], sparse_values: List[float]):
+        key = self._key(text)
+        vectors = (list(dense), (list(sparse_indices), list(sparse_values)))
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, vectors)
+            if self._disk is not None:
+                self._disk_put(key, dense, sparse_indices, sparse_values, created_at)
+
+    def _remember(self, key: str, created_at: float, vectors: QueryVectors):
+        self._entries[key] = (created_at, vectors)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_put(
+        self, key: str, dense: List[float], sparse_indices: List[int], sparse_values: List[float], created_at: float
+    ):
+        row = (
+            np.asarray(dense, dtype=np.float32).tobytes(),
+            np.asarray(sparse_indices, dtype=np.int64).tobytes(),
+            np.asarray(sparse_values, dtype=np.float32).tobytes(),
+            created_at,
+            created_at,
+        )
+        cursor = self._disk.execute(
+            """UPDATE query_embeddings SET dense = ?, sparse_indices = ?, sparse_values = ?,
+                                          created_at = ?, last_used = ?
+               WHERE key = ?""",
+            (*row, key)
+        )
+        if cursor.rowcount == 0:
+            self._disk.execute(
+                """INSERT INTO query_embeddings (dense, sparse_indices, sparse_values, created_at, last_used, key)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (*row, key)
+            )
+            self._disk_rows += 1
+
+        now = time.monotonic()
+        if self.ttl_seconds and now - self._last_sweep > DISK_SWEEP_SECONDS:
+            self._last_sweep = now
+            cursor = self._disk.execute(
+                "DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self._disk_rows -= cursor.rowcount
+        self._prune()
+        self._uncommitted += 1
+        if self._uncommitted >= DISK_COMMIT_EVERY or now - self._last_commit > DISK_COMMIT_SECONDS:
+            self._commit()
+
+    def _prune(self):
+        if self._disk_rows <= self.disk_max_rows:
+            return
+        excess = self._disk_rows - int(self.disk_max_rows * PRUNE_TO_FRACTION)
+        cursor = self._disk.execute(
+            """DELETE FROM query_embeddings WHERE key IN (
+                   SELECT key FROM query_embeddings ORDER BY last_used LIMIT ?
+               )""",
+            (excess,)
+        )
+        self._disk_rows -= cursor.rowcount
+        self.disk_evictions += cursor.rowcount
+
+    def _commit(self):
+        self._disk.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, QueryVectors]]:
+        if self._disk is None:
+            return None
+        row = self._disk.execute(
+            "SELECT dense, sparse_indices, sparse_values, created_at FROM query_embeddings WHERE key = ?",
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if self._expired(row[3]):
+            self._disk.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+            self._disk_rows -= 1
+            return None
+        self._disk.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[3], (
+            np.frombuffer(row[0], dtype=np.float32).tolist(),
+            (
+                np.frombuffer(row[1], dtype=np.int64).tolist(),
+                np.frombuffer(row[2], dtype=np.float32).tolist(),
+            ),
+        )
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds or None,
+            "disk_tier": self._disk is not None,
+            "disk_rows": self._disk_rows,
+            "disk_max_rows": self.disk_max_rows,
+            "disk_evictions": self.disk_evictions,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
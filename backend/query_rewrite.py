@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model_registry import get_dense_embeddings, get_llm
+from prompt_builder import HISTORY_LABELS
+from query_cache import normalize_query
+from retrieval import run_embedding
+
+# Milliseconds we wait for the LLM rewrite before searching with the raw query
+REWRITE_LATENCY_BUDGET_MS = float(os.getenv("REWRITE_LATENCY_BUDGET_MS", "2000"))
+# Ambiguous follow-ups are treated as standalone when adding the previous
+# question changes their embedding less than this (cosine similarity)
+REWRITE_SIMILARITY_THRESHOLD = float(os.getenv("REWRITE_SIMILARITY_THRESHOLD", "0.85"))
+# Rewrites remembered per (conversation, recent history, query)
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "1024"))
+
+# Messages of history shown to the rewrite prompt
+REWRITE_HISTORY_MESSAGES = 4
+# Queries shorter than this ("why?", "and pricing?") only make sense in context
+MIN_STANDALONE_WORDS = 4
+
+# Openers that continue the previous turn
+FOLLOW_UP_START = re.compile(
+    r"^(and|but|also|so|then|what about|how about|why not|what else|anything else|"
+    r"tell me more|more on|elaborate|go on|continue|same for|ok|okay)\b"
+)
+# Words that usually point back at something said earlier
+ANAPHORA = re.compile(
+    r"\b(it|its|it's|they|them|their|theirs|this|that|these|those|he|him|his|she|her|"
+    r"there|former|latter|above|aforementioned|previous|same|else)\b"
+)
+
+
+def classify_follow_up(query: str, chat_history: List[Dict]) -> str:
+    """
+    Cheap first pass: "no_history", "standalone", "follow_up" or "ambiguous".
+
+    Only "ambiguous" queries (anaphora in an otherwise complete question)
+    need the embedding check; "follow_up" ones always go to the LLM.
+    """
+    if not chat_history:
+        return "no_history"
+    text = normalize_query(query)
+    if len(re.findall(r"[\w']+", text)) < MIN_STANDALONE_WORDS or FOLLOW_UP_START.match(text):
+        return "follow_up"
+    if not ANAPHORA.search(text):
+        return "standalone"
+    return "ambiguous"
+
+
+class RewriteStats:
+    """How often the LLM rewrite was skipped, served from cache or ran out of budget."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {
+            "queries": 0,
+            "skipped_no_history": 0,
+            "skipped_standalone": 0,
+            "skipped_similar": 0,
+            "cache_hits": 0,
+            "rewritten": 0,
+            "timed_out": 0,
+            "failed": 0,
+        }
+        self.rewrite_seconds = 0.0
+
+    def count(self, name: str, seconds: float = 0.0):
+        with self._lock:
+            self.counts[name] += 1
+            self.rewrite_seconds += seconds
+
+    def stats(self) -> Dict:
+        counts = dict(self.counts)
+        skipped = counts["skipped_no_history"] + counts["skipped_standalone"] + counts["skipped_similar"]
+        llm_calls = counts["rewritten"] + counts["timed_out"] + counts["failed"]
+        return {
+            **counts,
+            "skipped": skipped,
+            "skip_rate": round(skipped / counts["queries"], 4) if counts["queries"] else 0.0,
+            "latency_budget_ms": REWRITE_LATENCY_BUDGET_MS or None,
+            "avg_rewrite_ms": round(self.rewrite_seconds / llm_calls * 1000, 1) if llm_calls else None,
+        }
+
+
+class QueryRewriter:
+    """
+    Turns follow-ups into standalone search queries, calling the LLM only when needed.
+
+    WHY: Every message after the first used to wait for a full Ollama
+    generation (often seconds on CPU) before retrieval started, even for
+    questions that were already self-contained. Now:
+
+    1. classify_follow_up() settles most queries with regexes.
+    2. Ambiguous ones compare the query's embedding with that of the previous
+       question + the query. If the history barely moves it, the query
+       already carries its own context.
+    3. Rewrites are cached per (conversation, recent history, query), so
+       regenerating or retrying an answer never rewrites twice.
+    4. The LLM call gets REWRITE_LATENCY_BUDGET_MS. After that we search
+       with the raw query; the rewrite still finishes in the background and
+       lands in the cache for the next attempt.
+    """
+
+    def __init__(self, cache_size: int = REWRITE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[Optional[str], str, str], str]" = OrderedDict()
+        self.stats = RewriteStats()
+
+    def _key(self, conversation_id: Optional[str], query: str, recent_history: List[Dict]):
+        history = hashlib.sha256(
+            "\x00".join(m["content"] for m in recent_history).encode("utf-8")
+        ).hexdigest()
+        return (conversation_id, history, normalize_query(query))
+
+    def _remember(self, key, rewritten: str):
+        self._cache[key] = rewritten
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _history_changes_meaning(self, query: str, chat_history: List[Dict]) -> bool:
+        last_question = next((m["content"] for m in reversed(chat_history) if m["role"] == "human"), None)
+        if last_question is None:
+            return False
+        embeddings = get_dense_embeddings()
+        standalone, contextual = await asyncio.gather(
+            run_embedding(embeddings.embed_query, query),
+            run_embedding(embeddings.embed_query, f"{last_question} {query}"),
+        )
+        standalone = np.asarray(standalone, dtype=np.float32)
+        contextual = np.asarray(contextual, dtype=np.float32)
+        similarity = float(
+            np.dot(standalone, contextual) / (np.linalg.norm(standalone) * np.linalg.norm(contextual))
+        )
+        return similarity < REWRITE_SIMILARITY_THRESHOLD
+
+    async def rewrite(
+        self,
+        query: str,
+        chat_history: List[Dict],
+        conversation_id: Optional[str] = None
+    ) -> str:
+        self.stats.count("queries")
+        kind = classify_follow_up(query, chat_history)
+        if kind == "no_history":
+            self.stats.count("skipped_no_history")
+            return query  # No history → query is already standalone
+        if kind == "standalone":
+            self.stats.count("skipped_standalone")
+            return query
+
+        recent_history = chat_history[-REWRITE_HISTORY_MESSAGES:]
+        key = self._key(conversation_id, query, recent_history)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats.count("cache_hits")
+            return cached
+
+        if kind == "ambiguous" and not await self._history_changes_meaning(query, chat_history):
+            self.stats.count("skipped_similar")
+            return query
+
+        started = time.perf_counter()
+        task = asyncio.ensure_future(self._rewrite_with_llm(query, recent_history))
+
+        def store(done: asyncio.Future):
+            if not done.cancelled() and done.exception() is None:
+                self._remember(key, done.result())
+
+        task.add_done_callback(store)
+        budget = REWRITE_LATENCY_BUDGET_MS / 1000 if REWRITE_LATENCY_BUDGET_MS else None
+        # asyncio.wait (unlike wait_for) leaves the task running on timeout
+        done, _ = await asyncio.wait({task}, timeout=budget)
+        elapsed = time.perf_counter() - started
+        if not done:
+            self.stats.count("timed_out", elapsed)
+            print(f"⏱️ Query rewrite exceeded {REWRITE_LATENCY_BUDGET_MS:.0f} ms, searching with the raw query")
+            return query
+        if task.exception() is not None:
+            self.stats.count("failed", elapsed)
+            print(f"⚠️ Query rewrite failed: {task.exception()}")
+            return query
+        self.stats.count("rewritten", elapsed)
+        return task.result()
+
+    async def _rewrite_with_llm(self, query: str, recent_history: List[Dict]) -> str:
+        # Build a concise history summary (only the last few messages to keep the rewrite prompt small)
+        history_str = "\n".join(
+            [f"{HISTORY_LABELS.get(m['role'], 'Assistant')}: {m['content'][:200]}"
+             for m in recent_history]
+        )
+
+        rewrite_prompt = f"""Given the following conversation history and a follow-up question, rewrite the follow-up question to be a standalone question that captures the full intent without needing the conversation context.
+
+    If the question is already standalone and clear, return it unchanged.
+
+    Conversation history:
+    {history_str}
+
+    Follow-up question: {query}
+
+    Standalone question:"""
+
+        rewritten = (await asyncio.to_thread(get_llm().invoke, rewrite_prompt)).strip()
+
+        # Fallback: if the LLM returns something weird (empty, too long, or looks like
+        # a full answer instead of a question), use the original query
+        if not rewritten or len(rewritten) > 300 or len(rewritten) < 5:
+            return query
+
+        return rewritten
+
+
+query_rewriter = QueryRewriter()
@@ -0,0 +1,100 @@
+"""
+Rebuild the file catalog (the `files` table) from the chunks stored in Qdrant.
+
+Run from backend/:
+    python -m reconcile_files                 # rebuild every file
+    python -m reconcile_files --file <uuid>   # rebuild one file
+    python -m reconcile_files --dry-run       # only report differences
+
+WHY: The catalog is written at ingest time. If it is lost, or Qdrant was
+changed behind the API's back, this walks the collection page by page,
+fetching only the payload fields it needs (never the chunk text or
+vectors), and upserts/deletes catalog rows to match.
+"""
+import argparse
+import asyncio
+from pathlib import Path
+from typing import Dict, Optional
+
+from qdrant_client import models
+
+from database import init_db, close_db, upsert_file, list_file_records, delete_file_record
+from retrieval import async_client, COLLECTION_NAME, file_filter
+
+# Same directory main.py stores uploads in
+PDF_STORAGE_DIR = Path("uploaded_pdfs")
+
+SCROLL_PAGE_SIZE = 1000
+
+
+async def collect_files(file_uuid: Optional[str] = None) -> Dict[str, Dict]:
+    files: Dict[str, Dict] = {}
+    offset = None
+    while True:
+        points, offset = await async_client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=file_filter(file_uuid),
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=models.PayloadSelectorInclude(
+                include=["file_uuid", "file_name", "metadata.page"]
+            ),
+            with_vectors=False,
+        )
+        for point in points:
+            file_id = point.payload.get("file_uuid")
+            if not file_id:
+                continue
+            entry = files.setdefault(file_id, {
+                "filename": point.payload.get("file_name") or "",
+                "chunks": 0,
+                "pages": set(),
+            })
+            entry["chunks"] += 1
+            page = (point.payload.get("metadata") or {}).get("page")
+            if page is not None:
+                entry["pages"].add(page)
+        if offset is None:
+            return files
+
+
+async def reconcile(file_uuid: Optional[str] = None, dry_run: bool = False):
+    await init_db()
+    try:
+        found = await collect_files(file_uuid)
+        catalog = {record["file_uuid"]: record for record in await list_file_records()}
+        if file_uuid:
+            catalog = {k: v for k, v in catalog.items() if k == file_uuid}
+
+        for file_id, entry in found.items():
+            record = catalog.get(file_id)
+            if record and record["chunk_count"] == entry["chunks"] and record["page_count"] == len(entry["pages"]):
+                continue
+            print(f"{'would update' if dry_run else 'updating'} {file_id} ({entry['filename']}): "
+                  f"{entry['chunks']} chunks, {len(entry['pages'])} pages")
+            if not dry_run:
+                pdf_path = PDF_STORAGE_DIR / f"{file_id}.pdf"
+                await upsert_file(
+                    file_uuid=file_id,
+                    filename=entry["filename"],
+                    chunk_count=entry["chunks"],
+                    page_count=len(entry["pages"]),
+                    byte_size=pdf_path.stat().st_size if pdf_path.exists() else None,
+                )
+
+        for file_id in catalog.keys() - found.keys():
+            print(f"{'would remove' if dry_run else 'removing'} {file_id}: no chunks in Qdrant")
+            if not dry_run:
+                await delete_file_record(file_id)
+
+        print(f"✅ Reconciled {len(found)} files")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the file catalog from Qdrant")
+    parser.add_argument("--file", dest="file_uuid", help="only reconcile this file_uuid")
+    parser.add_argument("--dry-run", action="store_true", help="report without writing")
+    args = parser.parse_args()
+    asyncio.run(reconcile(args.file_uuid, args.dry_run))
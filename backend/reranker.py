@@ -0,0 +1,179 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from metrics import span
+from model_registry import RERANK_MODEL_NAME, get_reranker, registry
+from query_cache import normalize_query
+
+# Hybrid results the cross-encoder chooses the top k from
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+# Milliseconds reranking may add to a query; beyond that the fused order is used
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+# Query/chunk pairs per ONNX forward pass
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+# (query, chunk) scores kept before the least recently used one is evicted
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "8192"))
+
+
+class Reranker:
+    """
+    Cross-encoder reranking of hybrid search results, within a latency budget.
+
+    WHY: RRF over two prefetches of 10 only orders chunks by rank, so users
+    asked for a larger k to get the right chunk in, and paid for it in
+    prompt tokens. A cross-encoder reads query and chunk together and ranks
+    far better, so a wider candidate set can be narrowed to fewer, better
+    chunks for the LLM.
+
+    WHY a budget: Cross-encoder cost grows with the number of pairs and
+    runs on the same CPU as everything else. From the measured seconds per
+    pair, only as many candidates are scored as fit RERANK_BUDGET_MS; a
+    scoring call that still overruns is abandoned (its scores still land in
+    the cache) and the fused order is returned. Scores are cached per
+    (query, point id): point ids change whenever a chunk is re-ingested, so
+    a cached score never outlives its text.
+    """
+
+    def __init__(
+        self,
+        candidates: int = RERANK_CANDIDATES,
+        budget_ms: float = RERANK_BUDGET_MS,
+        batch_size: int = RERANK_BATCH_SIZE,
+        max_entries: int = RERANK_CACHE_SIZE,
+    ):
+        self.candidates = candidates
+        self.budget = budget_ms / 1000
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = False
+        # Model seconds per scored pair (None until measured)
+        self.seconds_per_pair = None
+        self.counts = {
+            "reranked": 0, "cache_hits": 0, "pairs_scored": 0,
+            "skipped_not_loaded": 0, "skipped_budget": 0, "timed_out": 0, "trimmed": 0,
+        }
+
+    def _cached(self, query: str, point_id: str):
+        with self._lock:
+            score = self._scores.get((query, point_id))
+            if score is not None:
+                self._scores.move_to_end((query, point_id))
+            return score
+
+    def _score(self, query: str, docs: List[Dict]) -> Dict[str, float]:
+        """Blocking: score `docs` against `query` in batches; {point id: score}, also cached."""
+        started = time.perf_counter()
+        scores = list(get_reranker().rerank(
+            query, [doc["content"] for doc in docs], batch_size=self.batch_size
+        ))
+        per_pair = (time.perf_counter() - started) / len(docs)
+        with self._lock:
+            # Follow a slowdown (CPU contention) at once, a speedup gradually
+            if self.seconds_per_pair is None or per_pair > self.seconds_per_pair:
+                self.seconds_per_pair = per_pair
+            else:
+                self.seconds_per_pair = 0.8 * self.seconds_per_pair + 0.2 * per_pair
+            self.counts["pairs_scored"] += len(docs)
+            for doc, score in zip(docs, scores):
+                self._scores[(query, doc["point_id"])] = float(score)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+        return {doc["point_id"]: float(score) for doc, score in zip(docs, scores)}
+
+    def _affordable(self, docs: List[Dict], missing: List[Dict], k: int) -> List[Dict]:
+        """Longest prefix of `docs` whose uncached pairs fit the budget ([] if shorter than k)."""
+        if self.seconds_per_pair is None:
+            return docs
+        allowed = int(self.budget / self.seconds_per_pair)
+        if len(missing) <= allowed:
+            return docs
+        missing_ids = {doc["point_id"] for doc in missing}
+        prefix, uncached = [], 0
+        for doc in docs:
+            uncached += doc["point_id"] in missing_ids
+            if uncached > allowed:
+                break
+            prefix.append(doc)
+        return prefix if len(prefix) > k else []
+
+    async def rerank(
+        self,
+        query: str,
+        docs: List[Dict],
+        k: int,
+        run: Callable[..., Awaitable]
+    ) -> List[Dict]:
+        """
+        Top `k` of `docs` (fused order) by cross-encoder score.
+
+        `run` executes the blocking model call (retrieval.run_embedding).
+        Falls back to docs[:k] when the model isn't loaded or the budget is exceeded.
+        """
+        if len(docs) <= 1:
+            return docs[:k]
+        if not registry.is_loaded("reranker"):
+            # Don't make a query wait for the model: load it in the background
+            self.counts["skipped_not_loaded"] += 1
+            with self._lock:
+                if not self._loading:
+                    self._loading = True
+                    threading.Thread(target=registry.warm_up, args=(["reranker"],), daemon=True).start()
+            return docs[:k]
+
+        key = normalize_query(query)
+        scores = {}
+        for doc in docs:
+            score = self._cached(key, doc["point_id"])
+            if score is not None:
+                scores[doc["point_id"]] = score
+        missing = [doc for doc in docs if doc["point_id"] not in scores]
+        candidates = self._affordable(docs, missing, k)
+        if not candidates:
+            self.counts["skipped_budget"] += 1
+            return docs[:k]
+        if len(candidates) < len(docs):
+            self.counts["trimmed"] += 1
+            candidate_ids = {doc["point_id"] for doc in candidates}
+            missing = [doc for doc in missing if doc["point_id"] in candidate_ids]
+        self.counts["cache_hits"] += len(candidates) - len(missing)
+
+        if missing:
+            with span("rerank"):
+                scoring = asyncio.ensure_future(run(self._score, key, missing))
+                # An abandoned call still finishes (and fills the cache); don't
+                # let a late failure go unretrieved
+                scoring.add_done_callback(lambda f: f.cancelled() or f.exception())
+                try:
+                    scores.update(await asyncio.wait_for(asyncio.shield(scoring), timeout=self.budget))
+                except asyncio.TimeoutError:
+                    self.counts["timed_out"] += 1
+                    return docs[:k]
+                except Exception as e:
+                    print(f"⚠️ Reranking failed, using the fused order: {e}")
+                    return docs[:k]
+
+        ranked = sorted(candidates, key=lambda doc: scores[doc["point_id"]], reverse=True)[:k]
+        self.counts["reranked"] += 1
+        return [{**doc, "rerank_score": scores[doc["point_id"]]} for doc in ranked]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = len(self._scores)
+        return {
+            "enabled": bool(RERANK_MODEL_NAME),
+            "model": RERANK_MODEL_NAME,
+            "candidates": self.candidates,
+            "budget_ms": self.budget * 1000,
+            "entries": entries,
+            "ms_per_pair": round(self.seconds_per_pair * 1000, 3) if self.seconds_per_pair else None,
+            **self.counts,
+        }
+
+
+reranker = Reranker()
@@ -0,0 +1,378 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+from model_registry import (
+    get_dense_embeddings, get_sparse_model, DENSE_MODEL_NAME, SPARSE_MODEL_NAME, RERANK_MODEL_NAME
+)
+from collection import COLLECTION_NAME, RESULT_PAYLOAD, dense_search_params, provision_collection
+from metrics import span
+from query_cache import QueryEmbeddingCache
+from reranker import reranker
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+# Run Qdrant in-process instead of talking to QDRANT_URL: ":memory:" or a
+# directory. For benchmarks and development only (see LocalQdrant)
+QDRANT_PATH = os.getenv("QDRANT_PATH", "")
+# gRPC is cheaper per call than REST once many queries are in flight
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+# Connections shared by all requests of this worker
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "32"))
+# Seconds before a Qdrant call is abandoned (HTTP) / cancelled (server side)
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "10"))
+QDRANT_SEARCH_TIMEOUT = int(os.getenv("QDRANT_SEARCH_TIMEOUT", "5"))
+
+# Threads dedicated to query embedding, so CPU-bound model calls never run
+# on the event loop nor compete with the default executor
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+# Most chunks one file may contribute to a query over several files, so a
+# comparison isn't answered from a single document
+MAX_CHUNKS_PER_FILE = int(os.getenv("MAX_CHUNKS_PER_FILE", "2"))
+# Upper bound on each prefetch when widened for many files
+MAX_PREFETCH_LIMIT = int(os.getenv("MAX_PREFETCH_LIMIT", "100"))
+
+
+class LocalQdrant:
+    """
+    One local-mode QdrantClient shared by the sync and async code paths.
+
+    WHY: Two local clients cannot share a store. ":memory:" would give
+    ingestion and queries separate databases, and a directory can only be
+    opened once. Local mode is also not thread-safe, so every call is
+    serialized. Use it for benchmarks and development; it is no stand-in
+    for a server's performance.
+    """
+
+    def __init__(self, path: str):
+        self._client = QdrantClient(location=":memory:") if path == ":memory:" else QdrantClient(path=path)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+class AsyncLocalQdrant:
+    """AsyncQdrantClient interface over LocalQdrant; calls run in threads."""
+
+    def __init__(self, local: LocalQdrant):
+        self._local = local
+
+    def __getattr__(self, name):
+        call = getattr(self._local, name)
+
+        async def async_call(*args, **kwargs):
+            return await asyncio.to_thread(call, *args, **kwargs)
+        return async_call
+
+
+if QDRANT_PATH:
+    client = LocalQdrant(QDRANT_PATH)
+    async_client = AsyncLocalQdrant(client)
+else:
+    # Synchronous client: used from ingestion worker threads and scripts
+    client = QdrantClient(
+        url=QDRANT_URL,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+        timeout=QDRANT_TIMEOUT,
+    )
+
+    # Async client: used on the request path. One instance per process so every
+    # request shares its connection pool.
+    async_client = AsyncQdrantClient(
+        url=QDRANT_URL,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+        timeout=QDRANT_TIMEOUT,
+        pool_size=QDRANT_POOL_SIZE,
+    )
+
+embedding_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+
+# Cache of query vectors so repeated questions skip the transformer forward pass
+query_embedding_cache = QueryEmbeddingCache(model_id=f"{DENSE_MODEL_NAME}+{SPARSE_MODEL_NAME}")
+
+
+async def ensure_collection():
+    """Create the hybrid collection on first start, or migrate it (see collection.py)."""
+    await provision_collection(async_client, local=bool(QDRANT_PATH))
+
+
+async def close_clients():
+    await async_client.close()
+    embedding_executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_embedding(func, *args, **kwargs):
+    """Run a CPU-bound model call on the embedding executor."""
+    loop = asyncio.get_running_loop()
+    # run_in_executor (unlike to_thread) drops context variables; keep the
+    # request's span recording (see metrics.span)
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        embedding_executor, context.run, functools.partial(func, *args, **kwargs)
+    )
+
+
+def file_filter(file_uuid: Optional[str]) -> Optional[models.Filter]:
+    if not file_uuid:
+        return None
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="file_uuid",
+                match=models.MatchValue(value=file_uuid)
+            )
+        ]
+    )
+
+
+def scope_filter(file_uuids: Optional[List[str]]) -> Optional[models.Filter]:
+    """Filter for a query scope: None/[] = every file, else only these files."""
+    if not file_uuids:
+        return None
+    if len(file_uuids) == 1:
+        return file_filter(file_uuids[0])
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="file_uuid",
+                match=models.MatchAny(any=list(file_uuids))
+            )
+        ]
+    )
+
+
+def scope_key(file_uuids: Optional[List[str]]) -> Optional[str]:
+    """Stable string for a scope (answer cache bucket)."""
+    return ",".join(sorted(set(file_uuids))) if file_uuids else None
+
+
+def embed_query(search_query: str):
+    """
+    Dense + sparse vectors for a search query, served from the cache when possible.
+
+    Blocking: call through embed_query_async() from request handlers.
+    """
+    cached = query_embedding_cache.get(search_query)
+    if cached is None:
+        with span("dense_embed"):
+            query_dense = get_dense_embeddings().embed_query(search_query)
+        with span("sparse_embed"):
+            raw_sparse_output = next(get_sparse_model().query_embed(search_query))
+        cached = (
+            query_dense,
+            (raw_sparse_output.indices.tolist(), raw_sparse_output.values.tolist())
+        )
+        query_embedding_cache.put(search_query, cached[0], *cached[1])
+
+    query_dense, (sparse_indices, sparse_values) = cached
+    query_sparse_formatted = models.SparseVector(
+        indices=sparse_indices,
+        values=sparse_values
+    )
+    return query_dense, query_sparse_formatted
+
+
+async def embed_query_async(search_query: str):
+    return await run_embedding(embed_query, search_query)
+
+
+def embed_queries(search_queries: List[str]):
+    """
+    embed_query() for many queries, with one model call per model for all cache misses.
+
+    Blocking: call through embed_queries_async().
+    """
+    cached = {query: query_embedding_cache.get(query) for query in dict.fromkeys(search_queries)}
+    misses = [query for query, vectors in cached.items() if vectors is None]
+    if misses:
+        with span("dense_embed"):
+            dense_vectors = get_dense_embeddings().embed_documents(misses)
+        with span("sparse_embed"):
+            sparse_vectors = list(get_sparse_model().query_embed(misses))
+        for query, query_dense, raw_sparse_output in zip(misses, dense_vectors, sparse_vectors):
+            sparse = (raw_sparse_output.indices.tolist(), raw_sparse_output.values.tolist())
+            query_embedding_cache.put(query, query_dense, *sparse)
+            cached[query] = (query_dense, sparse)
+
+    return [
+        (cached[query][0], models.SparseVector(indices=cached[query][1][0], values=cached[query][1][1]))
+        for query in search_queries
+    ]
+
+
+async def embed_queries_async(search_queries: List[str]):
+    return await run_embedding(embed_queries, search_queries)
+
+
+def format_points(points) -> List[Dict]:
+    formatted_results = []
+    for point in points:
+        formatted_results.append({
+            "content": point.payload["text"],
+            "metadata": point.payload['metadata'],
+            "similarity_score": float(point.score),
+            "point_id": str(point.id),
+            "file_uuid": point.payload.get("file_uuid"),
+            "file_name": point.payload.get("file_name"),
+            "token_count": point.payload.get("token_count")
+        })
+    return formatted_results
+
+
+def fuse_results(result_lists: List[List[Dict]], k: int, rrf_k: int = 60) -> List[Dict]:
+    """
+    Reciprocal rank fusion of several formatted result lists, deduplicated by point id.
+
+    The fused RRF score replaces similarity_score, like Qdrant's own fusion does.
+    """
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Dict] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            point_id = doc["point_id"]
+            scores[point_id] = scores.get(point_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(point_id, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [{**docs[point_id], "similarity_score": scores[point_id]} for point_id in ranked]
+
+
+def _search_limits(file_uuids: Optional[List[str]], k: int) -> Tuple[int, int]:
+    """(fused results to fetch, limit of each prefetch) for a query over `file_uuids`."""
+    limit = max(k, reranker.candidates) if RERANK_MODEL_NAME else k
+    prefetch_limit = max(10, limit)
+    if file_uuids and len(file_uuids) > 1:
+        # Enough candidates for every file to be represented
+        prefetch_limit = min(max(prefetch_limit, MAX_CHUNKS_PER_FILE * len(file_uuids)), MAX_PREFETCH_LIMIT)
+    return limit, prefetch_limit
+
+
+def _prefetch(query_dense, query_sparse, query_filter, prefetch_limit: int) -> List[models.Prefetch]:
+    return [
+        models.Prefetch(
+            query=query_dense, using="dense", limit=prefetch_limit, filter=query_filter,
+            params=dense_search_params(),
+        ),
+        models.Prefetch(
+            query=query_sparse, using="sparse", limit=prefetch_limit, filter=query_filter
+        ),
+    ]
+
+
+def _cap_per_file(points, limit: int) -> List:
+    """Best `limit` points with at most MAX_CHUNKS_PER_FILE from any one file."""
+    kept, per_file = [], {}
+    for point in sorted(points, key=lambda point: point.score, reverse=True):
+        file_uuid = point.payload.get("file_uuid")
+        if per_file.get(file_uuid, 0) < MAX_CHUNKS_PER_FILE:
+            per_file[file_uuid] = per_file.get(file_uuid, 0) + 1
+            kept.append(point)
+            if len(kept) == limit:
+                break
+    return kept
+
+
+async def hybrid_search(search_query: str, file_uuids: Optional[List[str]], k: int) -> List[Dict]:
+    """
+    Dense + sparse prefetch fused with RRF, optionally restricted to some files.
+
+    Over several files, the fused results are grouped by file_uuid (one
+    query_points_groups call with a MatchAny filter) and each file keeps at
+    most MAX_CHUNKS_PER_FILE chunks before the best are taken.
+
+    With RERANK_MODEL set, the top RERANK_CANDIDATES fused results are
+    re-scored by a cross-encoder and the best k returned (see Reranker).
+
+    WHY async end to end: Embedding runs on the embedding executor and the
+    Qdrant call on the shared async client, so a slow model or a slow Qdrant
+    only delays this request, not every other request in the worker.
+    """
+    query_dense, query_sparse_formatted = await embed_query_async(search_query)
+    limit, prefetch_limit = _search_limits(file_uuids, k)
+    prefetch = _prefetch(query_dense, query_sparse_formatted, scope_filter(file_uuids), prefetch_limit)
+
+    with span("qdrant_query"):
+        if file_uuids and len(file_uuids) > 1:
+            search_result = await async_client.query_points_groups(
+                collection_name=COLLECTION_NAME,
+                prefetch=prefetch,
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                group_by="file_uuid",
+                group_size=MAX_CHUNKS_PER_FILE,
+                limit=min(len(file_uuids), limit),
+                with_payload=RESULT_PAYLOAD,
+                timeout=QDRANT_SEARCH_TIMEOUT,
+            )
+            points = [hit for group in search_result.groups for hit in group.hits]
+            points = sorted(points, key=lambda point: point.score, reverse=True)[:limit]
+        else:
+            search_result = await async_client.query_points(
+                collection_name=COLLECTION_NAME,
+                prefetch=prefetch,
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                limit=limit,
+                with_payload=RESULT_PAYLOAD,
+                timeout=QDRANT_SEARCH_TIMEOUT,
+            )
+            points = search_result.points
+    results = format_points(points)
+    if RERANK_MODEL_NAME:
+        results = await reranker.rerank(search_query, results, k, run=run_embedding)
+    return results
+
+
+async def hybrid_search_batch(
+    search_queries: List[str],
+    file_uuids: Optional[List[str]],
+    k: int
+) -> List[List[Dict]]:
+    """
+    hybrid_search() for many queries over the same files.
+
+    WHY: One embedding pass for every uncached query instead of one model
+    call each, and one query_batch_points round trip instead of one request
+    per query. Batch requests can't group, so over several files the
+    per-file limit is applied to a wider fused list here.
+    """
+    vectors = await embed_queries_async(search_queries)
+    limit, prefetch_limit = _search_limits(file_uuids, k)
+    grouped = bool(file_uuids) and len(file_uuids) > 1
+    query_filter = scope_filter(file_uuids)
+    requests = [
+        models.QueryRequest(
+            prefetch=_prefetch(query_dense, query_sparse, query_filter, prefetch_limit),
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=prefetch_limit if grouped else limit,
+            with_payload=RESULT_PAYLOAD,
+        )
+        for query_dense, query_sparse in vectors
+    ]
+
+    with span("qdrant_query"):
+        responses = await async_client.query_batch_points(
+            collection_name=COLLECTION_NAME,
+            requests=requests,
+            timeout=QDRANT_SEARCH_TIMEOUT,
+        )
+    results = [
+        format_points(_cap_per_file(response.points, limit) if grouped else response.points)
+        for response in responses
+    ]
+    if RERANK_MODEL_NAME:
+        results = await asyncio.gather(*(
+            reranker.rerank(query, docs, k, run=run_embedding)
+            for query, docs in zip(search_queries, results)
+        ))
+    return results
@@ -1,42 +1,152 @@
-from typing import List
+import hashlib
+import os
+import re
+import time
+from typing import Dict, List
+
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_community.embeddings import HuggingFaceEmbeddings
-
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-mpnet-base-v2",
-    model_kwargs={'device': 'cpu'},
-)
-
-def semantic_chunker(file_path: str) -> List[dict]:
-    # Load PDF
-    loader = PyPDFLoader(file_path, extract_images=True)
-    docs = loader.load()
-    
-    # Initialize SemanticChunker with your existing embeddings
-    text_splitter = SemanticChunker(
-        embeddings=embeddings,
-        breakpoint_threshold_type="percentile",  # Options: "percentile", "standard_deviation", "interquartile"
-        breakpoint_threshold_amount=90,  # 90th percentile - adjust 80-95 for chunk size
-        # Higher percentile = fewer breakpoints = larger chunks
-        # Lower percentile = more breakpoints = smaller chunks
-    )
-    
-    # Split documents semantically
-    chunks = text_splitter.split_documents(docs)
-    
+
+from embedding_cache import embed_documents_cached
+from metrics import span
+
+# How each chunk gets its dense vector:
+#   "pooled"   - mean of the sentence embeddings already computed to find
+#                breakpoints (no extra forward pass)
+#   "reembed"  - embed the final chunk text again (previous behaviour)
+#   "none"     - return chunks without vectors, caller embeds them
+CHUNK_VECTOR_MODES = ("pooled", "reembed", "none")
+CHUNK_VECTOR_MODE = os.getenv("CHUNK_VECTOR_MODE", "pooled")
+
+# Same defaults as langchain_experimental's SemanticChunker, which this replaces
+SENTENCE_SPLIT_REGEX = r"(?<=[.?!])\s+"
+SENTENCE_BUFFER_SIZE = 1
+BREAKPOINT_PERCENTILE = 90  # 90th percentile - adjust 80-95 for chunk size
+# Higher percentile = fewer breakpoints = larger chunks
+# Lower percentile = more breakpoints = smaller chunks
+
+
+def _split_sentences(text: str) -> List[str]:
+    return [s for s in re.split(SENTENCE_SPLIT_REGEX, text) if s.strip()]
+
+
+def _combine_sentences(sentences: List[str], buffer_size: int = SENTENCE_BUFFER_SIZE) -> List[str]:
+    """
+    Join each sentence with its neighbours before embedding.
+
+    WHY: A single sentence is a noisy signal. Embedding a small window
+    smooths the distance curve so breakpoints land on real topic shifts.
+    """
+    combined = []
+    for i in range(len(sentences)):
+        window = sentences[max(0, i - buffer_size):i + 1 + buffer_size]
+        combined.append(" ".join(window))
+    return combined
+
+
+def _find_groups(sentence_vectors: np.ndarray) -> List[range]:
+    """Split a page's sentences where the cosine distance jumps above the percentile."""
+    if len(sentence_vectors) == 0:
+        return []
+    if len(sentence_vectors) == 1:
+        return [range(1)]
+
+    normed = sentence_vectors / np.linalg.norm(sentence_vectors, axis=1, keepdims=True)
+    distances = 1 - np.sum(normed[:-1] * normed[1:], axis=1)
+    threshold = np.percentile(distances, BREAKPOINT_PERCENTILE)
+
+    groups = []
+    start = 0
+    for index in np.nonzero(distances > threshold)[0]:
+        groups.append(range(start, index + 1))
+        start = index + 1
+    if start < len(sentence_vectors):
+        groups.append(range(start, len(sentence_vectors)))
+    return groups
+
+
+def _pool(vectors: np.ndarray) -> List[float]:
+    pooled = vectors.mean(axis=0)
+    return (pooled / np.linalg.norm(pooled)).tolist()
+
+
+def chunk_documents(docs, vector_mode: str = CHUNK_VECTOR_MODE) -> List[dict]:
+    """
+    Semantically chunk loaded pages and (optionally) attach a dense vector per chunk.
+
+    Pages are chunked independently, so callers may pass a whole document or
+    stream it in page batches. chunk_idx counts from 0 within this call;
+    ingestion renumbers chunks in document order.
+
+    WHY one embed call for every sentence of every page: sentence-transformers
+    batches internally, so a single large call keeps the model busy instead
+    of paying per-page overhead. Those sentence embeddings are then reused
+    for the chunk vectors in "pooled" mode, so each document only goes through
+    all-mpnet-base-v2 once.
+    """
+    if vector_mode not in CHUNK_VECTOR_MODES:
+        raise ValueError(f"vector_mode must be one of {CHUNK_VECTOR_MODES}")
+
+    page_sentences = [_split_sentences(doc.page_content) for doc in docs]
+    combined = [c for sentences in page_sentences for c in _combine_sentences(sentences)]
+    if not combined:
+        return []
+    # Sentences seen in earlier uploads (boilerplate, re-uploads) come from the cache
+    with span("chunking.sentence_embedding"):
+        all_vectors = np.asarray(embed_documents_cached(combined), dtype=np.float32)
+
+    chunks = []  # (text, metadata, vector)
+    offset = 0
+    with span("chunking.breakpoints"):
+        for doc, sentences in zip(docs, page_sentences):
+            page_vectors = all_vectors[offset:offset + len(sentences)]
+            offset += len(sentences)
+            for group in _find_groups(page_vectors):
+                vector = _pool(page_vectors[group.start:group.stop]) if vector_mode == "pooled" else None
+                chunks.append((
+                    " ".join(sentences[group.start:group.stop]),
+                    doc.metadata,
+                    vector,
+                ))
+
+    if vector_mode == "reembed" and chunks:
+        with span("chunking.reembed"):
+            reembedded = embed_documents_cached([text for text, _, _ in chunks])
+        chunks = [(text, meta, vec) for (text, meta, _), vec in zip(chunks, reembedded)]
+
     # Format output
     result = []
-    for idx, chunk in enumerate(chunks):
-        result.append({
-            "content": chunk.page_content,
+    for idx, (text, metadata, vector) in enumerate(chunks):
+        chunk = {
+            "content": text,
             "metadata": {
-                **chunk.metadata,  # Preserves page numbers and source
+                **metadata,  # Preserves page numbers and source
                 "chunk_idx": idx,
-                "total_chunks": len(chunks),
                 "chunk_method": "semantic"
             }
-        })
-    
-    print(f"Created {len(chunks)} semantic chunks from {len(docs)} pages")
-    return result
\ No newline at end of file
+        }
+        if vector is not None:
+            chunk["vector"] = vector
+        result.append(chunk)
+    return result
+
+
+def load_pdf_pages(file_path: str) -> Dict:
+    """
+    Parse a PDF into plain (text, metadata) pages plus its sha256 and size.
+
+    Used by bulk ingestion as a process-pool task, so it only returns
+    picklable values and never touches the models.
+    """
+    start = time.perf_counter()
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    docs = PyPDFLoader(file_path, extract_images=True).load()
+    return {
+        "content_hash": digest.hexdigest(),
+        "file_size": os.path.getsize(file_path),
+        "pages": [(doc.page_content, doc.metadata) for doc in docs],
+        "parse_seconds": time.perf_counter() - start,
+    }
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+
+from llm_session import llm_sessions
+
+# Tokens that arrive within this window are sent to the client as one SSE frame
+TOKEN_COALESCE_MS = float(os.getenv("TOKEN_COALESCE_MS", "15"))
+
+# Max concurrent LLM streams; each one holds a thread reading from Ollama
+LLM_STREAM_WORKERS = int(os.getenv("LLM_STREAM_WORKERS", "16"))
+
+llm_stream_executor = ThreadPoolExecutor(max_workers=LLM_STREAM_WORKERS, thread_name_prefix="llm-stream")
+
+_DONE = object()
+
+
+class StreamStats:
+    """Time-to-first-token and inter-token latency of one LLM stream."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.gaps: List[float] = []
+        self.tokens = 0
+        self.frames = 0
+        self.cancelled = False
+        # Prefill stats reported by Ollama (see OllamaSessions.stream)
+        self.llm: Dict = {}
+
+    def on_token(self, now: float):
+        if self.first_token_at is None:
+            self.first_token_at = now
+        else:
+            self.gaps.append(now - self.last_token_at)
+        self.last_token_at = now
+        self.tokens += 1
+
+    def to_dict(self) -> Dict:
+        gaps_ms = sorted(gap * 1000 for gap in self.gaps)
+        return {
+            "ttft_ms": round((self.first_token_at - self.started) * 1000, 1) if self.first_token_at else None,
+            "inter_token_ms_mean": round(statistics.fmean(gaps_ms), 2) if gaps_ms else None,
+            "inter_token_ms_p95": round(gaps_ms[int(len(gaps_ms) * 0.95)], 2) if gaps_ms else None,
+            "tokens": self.tokens,
+            "frames": self.frames,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "cancelled": self.cancelled,
+            **self.llm,
+        }
+
+
+async def stream_llm(
+    prompt: str,
+    stats: Optional[StreamStats] = None,
+    stable_prefix_chars: int = 0,
+    conversation_id: Optional[str] = None,
+    chat_history: Optional[List[Dict]] = None
+) -> AsyncIterator[str]:
+    """
+    Stream an LLM answer as coalesced text frames. The prefix/conversation
+    arguments let Ollama reuse its KV cache (see OllamaSessions).
+
+    WHY a thread + asyncio.Queue: llm_sessions.stream() is a blocking generator. One
+    thread reads it and hands every token to the event loop with
+    call_soon_threadsafe, so the loop just awaits the queue instead of doing
+    an executor round trip per token.
+
+    WHY coalesce: Ollama can emit tokens faster than it is worth sending SSE
+    frames. Tokens arriving within TOKEN_COALESCE_MS are joined into one frame.
+
+    WHY the cancel flag: If the client disconnects, Starlette cancels this
+    generator. The reader thread then stops at the next token and closes the
+    Ollama stream, which aborts the generation instead of running it to the
+    end in a leaked thread.
+    """
+    stats = stats or StreamStats()
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (time.perf_counter(), item))
+        except RuntimeError:
+            cancelled.set()  # event loop is gone
+
+    def produce():
+        stream = None
+        try:
+            stream = llm_sessions.stream(
+                prompt, stable_prefix_chars, conversation_id, chat_history, info=stats.llm
+            )
+            for chunk in stream:
+                if cancelled.is_set():
+                    break
+                put(chunk)
+            put(_DONE)
+        except Exception as e:
+            put(e)
+        finally:
+            if stream is not None:
+                stream.close()
+
+    loop.run_in_executor(llm_stream_executor, produce)
+    window = TOKEN_COALESCE_MS / 1000
+
+    try:
+        finished = False
+        while not finished:
+            items = [await queue.get()]
+            # Let more tokens pile up for one coalescing window, then take
+            # them all. The very first frame goes out immediately to keep
+            # time-to-first-token low.
+            if stats.frames and window:
+                await asyncio.sleep(window)
+            while not queue.empty():
+                items.append(queue.get_nowait())
+
+            frame = []
+            for received_at, item in items:
+                if item is _DONE:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    if frame:
+                        yield "".join(frame)
+                    raise item
+                stats.on_token(received_at)
+                frame.append(item)
+
+            if frame:
+                stats.frames += 1
+                yield "".join(frame)
+    except (asyncio.CancelledError, GeneratorExit):
+        stats.cancelled = True
+        raise
+    finally:
+        cancelled.set()
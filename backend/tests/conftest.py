@@ -0,0 +1,103 @@
+"""
+Shared setup of the backend tests: Qdrant in local mode, a temporary SQLite
+database and deterministic fake models, so no server or model download is
+needed.
+
+Run from backend/:
+    python -m pytest tests
+"""
+import asyncio
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+# Before any backend module reads its config
+os.environ["QDRANT_PATH"] = ":memory:"
+os.environ["EMBEDDING_CACHE_PATH"] = ":memory:"
+os.environ["WARM_MODELS_ON_STARTUP"] = "0"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import pytest
+
+from collection import COLLECTION_NAME, DENSE_SIZE
+from database import close_db, init_db
+from ingestion import IngestJob, ingest_jobs
+from model_registry import registry
+from retrieval import client, ensure_collection, file_filter
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+
+class FakeDenseEmbeddings:
+    """A unit vector per text, the same on every call."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = np.random.default_rng(_seed(text)).standard_normal(DENSE_SIZE)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeSparseEmbedding:
+    def __init__(self, text: str):
+        words = sorted({_seed(word) % 30000 for word in text.lower().split()}) or [0]
+        self.indices = np.array(words)
+        self.values = np.ones(len(words))
+
+
+class FakeSparseModel:
+    def embed(self, texts):
+        for text in texts:
+            yield FakeSparseEmbedding(text)
+
+    def query_embed(self, query):
+        for text in [query] if isinstance(query, str) else query:
+            yield FakeSparseEmbedding(text)
+
+
+@pytest.fixture(autouse=True)
+def fake_models():
+    registry._models.update(dense=FakeDenseEmbeddings(), sparse=FakeSparseModel())
+    yield
+    registry._models.pop("dense", None)
+    registry._models.pop("sparse", None)
+
+
+@pytest.fixture
+def run_backend(tmp_path):
+    """Run a coroutine with the database, the collection and the ingestion workers up."""
+    def run(scenario):
+        async def main():
+            await init_db(str(tmp_path / "test.db"))
+            await ensure_collection()
+            await ingest_jobs.start()
+            try:
+                return await scenario()
+            finally:
+                await ingest_jobs.stop()
+                await close_db()
+        return asyncio.run(main())
+
+    yield run
+    # Every test starts from an empty collection
+    client.delete_collection(COLLECTION_NAME)
+
+
+async def run_job(job: IngestJob, handler) -> IngestJob:
+    """Submit a job and wait until it has finished."""
+    ingest_jobs.submit(job, handler)
+    while job.status in ("queued", "running"):
+        await asyncio.sleep(0.02)
+    return job
+
+
+def file_points(file_uuid: str):
+    points, _ = client.scroll(
+        COLLECTION_NAME, scroll_filter=file_filter(file_uuid), limit=10000, with_payload=True
+    )
+    return points
@@ -0,0 +1,32 @@
+from answer_cache import AnswerCache
+
+
+def test_expired_answers_are_dropped_in_creation_order():
+    cache = AnswerCache(ttl_seconds=60)
+    for question in ("first", "second", "third"):
+        cache.put("f1", question, ["point"], f"answer to {question}", [])
+    # Recently used, but created first: expires first
+    assert cache.get("f1", "first", ["point"]) is not None
+    cache._entries[("f1", frozenset(["point"])), "first"]["created_at"] -= 120
+
+    assert cache.get("f1", "second", ["point"]) is not None
+    assert cache.stats()["entries"] == 2
+    assert cache.get("f1", "first", ["point"]) is None
+
+
+def test_similar_question_only_matches_answers_built_from_the_same_chunks():
+    cache = AnswerCache(similarity_threshold=0.9, similarity_scan=2)
+    cache.put("f1", "what is the notice period", ["a"], "30 days", [], query_vector=[1.0, 0.0])
+    cache.put("f1", "unrelated", ["b"], "other", [], query_vector=[1.0, 0.0])
+
+    hit = cache.get("f1", "how long is the notice period", ["a"], query_vector=[0.99, 0.1])
+    assert hit["answer"] == "30 days"
+    assert cache.get("f1", "how long is the notice period", ["c"], query_vector=[0.99, 0.1]) is None
+
+    # Only the two most recently used answers of the bucket are compared
+    cache.put("f1", "second", ["a"], "second", [], query_vector=[0.0, 1.0])
+    cache.put("f1", "third", ["a"], "third", [], query_vector=[0.0, 1.0])
+    assert cache.get("f1", "notice period length", ["a"], query_vector=[0.99, 0.1]) is None
+
+    assert cache.invalidate_file("f1") == 4
+    assert cache.stats()["buckets"] == 0
@@ -0,0 +1,132 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+import bulk_ingest
+import ingestion
+from benchmarks.synthetic_pdfs import synthetic_pages, write_pdf
+from bulk_ingest import BulkIngestJob, run_bulk_ingest_job
+from database import get_file_record
+from ingestion import ingest_jobs
+
+from conftest import file_points, run_job
+
+
+def pdf_items(tmp_path, count, pages=2):
+    """Uploaded copies, which the job owns (move=True)."""
+    items = []
+    for i in range(count):
+        upload = tmp_path / f"upload_{i}.pdf"
+        write_pdf(upload, synthetic_pages(i, pages))
+        items.append((str(upload), f"doc_{i}.pdf", True))
+    return items
+
+
+def test_pages_are_chunked_in_slices_across_files(tmp_path, run_backend, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bulk_ingest, "BULK_PAGE_BATCH_SIZE", 3)
+    slices = []
+    chunk_pages = bulk_ingest._chunk_pages
+
+    def record(job, page_slice, out, stop):
+        slices.append(len(page_slice))
+        chunk_pages(job, page_slice, out, stop)
+
+    monkeypatch.setattr(bulk_ingest, "_chunk_pages", record)
+    items = []
+    for i, pages in enumerate([1, 7, 2]):
+        path = tmp_path / f"doc_{i}.pdf"
+        write_pdf(path, synthetic_pages(i, pages))
+        items.append((str(path), path.name, False))
+
+    async def scenario():
+        job = await run_job(BulkIngestJob(items), run_bulk_ingest_job)
+        assert job.status == "completed", job.error
+        assert {bulk_file.status for bulk_file in job.files} == {"completed"}
+        for bulk_file, pages in zip(job.files, [1, 7, 2]):
+            record = await get_file_record(bulk_file.file_uuid)
+            assert record["page_count"] == pages
+            assert record["chunk_count"] == len(file_points(bulk_file.file_uuid)) > 0
+
+    run_backend(scenario)
+    assert sum(slices) == 10 and max(slices) <= 3
+
+
+def test_abort_fails_queued_files_and_removes_their_uploads(tmp_path, run_backend, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # One parse in flight at a time: most files are still queued when embedding fails
+    monkeypatch.setattr(bulk_ingest, "BULK_PARSE_PROCESSES", 1)
+    monkeypatch.setattr(bulk_ingest, "BULK_PAGE_BATCH_SIZE", 1)
+
+    def crash(texts):
+        raise RuntimeError("sparse model crashed")
+
+    monkeypatch.setattr(ingestion, "embed_sparse_cached", crash)
+    items = pdf_items(tmp_path, 8)
+
+    async def scenario():
+        job = await run_job(BulkIngestJob(items), run_bulk_ingest_job)
+        assert job.status == "failed"
+        assert {bulk_file.status for bulk_file in job.files} == {"failed"}
+        assert job.progress["docs_failed"] == len(items)
+        assert all(bulk_file.error for bulk_file in job.files)
+        assert not any(Path(source).exists() for source, _, _ in items)
+        assert not list((tmp_path / "uploaded_pdfs").glob("*.pdf"))
+        for bulk_file in job.files:
+            if bulk_file.file_uuid:
+                assert not file_points(bulk_file.file_uuid)
+
+    run_backend(scenario)
+
+
+@pytest.fixture
+def stuck_catalog(tmp_path, monkeypatch):
+    """Bulk jobs never finish cataloguing a file: the upsert stage waits on the loop."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bulk_ingest, "BULK_PARSE_PROCESSES", 1)
+    monkeypatch.setattr(bulk_ingest, "BULK_PAGE_BATCH_SIZE", 1)
+    cataloging = []
+
+    async def upsert_file(**kwargs):
+        cataloging.append(kwargs["file_uuid"])
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(bulk_ingest, "upsert_file", upsert_file)
+    return cataloging
+
+
+def test_files_of_a_running_bulk_job_are_active(tmp_path, run_backend, stuck_catalog):
+    items = pdf_items(tmp_path, 2)
+
+    async def scenario():
+        job = ingest_jobs.submit(BulkIngestJob(items), run_bulk_ingest_job)
+        while not stuck_catalog:
+            await asyncio.sleep(0.02)
+        bulk_file = next(f for f in job.files if f.file_uuid == stuck_catalog[0])
+        # DELETE answers 409 and a single upload of the same bytes is not ingested again
+        assert ingest_jobs.find_active(file_uuid=bulk_file.file_uuid) is job
+        assert ingest_jobs.find_active(content_hash=bulk_file.content_hash) is job
+        assert ingest_jobs.find_active(file_uuid="another file") is None
+
+    run_backend(scenario)
+
+
+def test_shutdown_mid_ingest_stops_and_rolls_back(tmp_path, run_backend, stuck_catalog):
+    items = pdf_items(tmp_path, 3)
+
+    async def scenario():
+        job = ingest_jobs.submit(BulkIngestJob(items), run_bulk_ingest_job)
+        while not stuck_catalog:
+            await asyncio.sleep(0.02)
+        await asyncio.wait_for(ingest_jobs.stop(), timeout=30)
+
+        assert job.status == "failed" and "cancelled" in job.error
+        assert {bulk_file.status for bulk_file in job.files} == {"failed"}
+        assert not list((tmp_path / "uploaded_pdfs").glob("*.pdf"))
+        for bulk_file in job.files:
+            if bulk_file.file_uuid:
+                assert not file_points(bulk_file.file_uuid)
+                assert await get_file_record(bulk_file.file_uuid) is None
+
+    run_backend(scenario)
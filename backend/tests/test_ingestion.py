@@ -0,0 +1,91 @@
+import hashlib
+import uuid
+from pathlib import Path
+
+import ingestion
+from answer_cache import answer_cache
+from benchmarks.synthetic_pdfs import synthetic_pages, write_pdf
+from database import delete_file_pages, find_file_record, get_file_pages, get_file_record
+from ingestion import IngestJob, run_ingest_job
+
+from conftest import file_points, run_job
+
+
+def upload_job(tmp_path: Path, file_uuid: str, pages, previous=None) -> IngestJob:
+    """A job as /upload_pdf queues it: the upload under a temporary name."""
+    upload_path = tmp_path / f"{uuid.uuid4()}.upload"
+    write_pdf(upload_path, pages)
+    data = upload_path.read_bytes()
+    return IngestJob(
+        file_uuid=file_uuid,
+        filename="report.pdf",
+        file_path=str(tmp_path / f"{file_uuid}.pdf"),
+        file_size=len(data),
+        content_hash=hashlib.sha256(data).hexdigest(),
+        previous=previous,
+        upload_path=str(upload_path),
+    )
+
+
+def test_revision_without_page_hashes_replaces_every_point(tmp_path, run_backend):
+    pages = synthetic_pages(1, 3)
+
+    async def scenario():
+        first = await run_job(upload_job(tmp_path, "f1", pages), run_ingest_job)
+        assert first.status == "completed", first.error
+        # As catalogued before page hashes were kept, or by reconcile_files.py
+        await delete_file_pages("f1", [0, 1, 2])
+
+        revised = pages[:2] + synthetic_pages(2, 1)
+        job = await run_job(
+            upload_job(tmp_path, "f1", revised, previous=await get_file_record("f1")), run_ingest_job
+        )
+        assert job.status == "completed", job.error
+        assert job.result["pages_reingested"] == 3
+
+        points = file_points("f1")
+        record = await get_file_record("f1")
+        assert len(points) == record["chunk_count"] == job.result["chunks_total"]
+        # No chunk of the previous revision is left next to its replacement
+        assert len({point.payload["chunck_idx"] for point in points}) == len(points)
+        assert len(await get_file_pages("f1")) == 3
+
+    run_backend(scenario)
+
+
+def test_failed_revision_keeps_previous_pdf_and_forgets_its_hash(tmp_path, run_backend, monkeypatch):
+    pages = synthetic_pages(1, 4)
+
+    async def scenario():
+        first = await run_job(upload_job(tmp_path, "f1", pages), run_ingest_job)
+        assert first.status == "completed", first.error
+        stored = Path(first.file_path).read_bytes()
+        chunks_before = len(file_points("f1"))
+        answer_cache.put("f1", "question", ["point"], "answer", [], source_files=["f1"])
+
+        def crash(texts):
+            raise RuntimeError("sparse model crashed")
+
+        # Pages 2 and 3 change; their old points are deleted before embedding fails
+        monkeypatch.setattr(ingestion, "embed_sparse_cached", crash)
+        revised = pages[:2] + synthetic_pages(2, 2)
+        job = await run_job(
+            upload_job(tmp_path, "f1", revised, previous=await get_file_record("f1")), run_ingest_job
+        )
+        assert job.status == "failed"
+        assert Path(job.file_path).read_bytes() == stored
+        assert not Path(job.upload_path).exists()
+
+        record = await get_file_record("f1")
+        assert await find_file_record(first.content_hash) is None
+        assert record["chunk_count"] == len(file_points("f1")) < chunks_before
+        assert answer_cache.get("f1", "question", ["point"]) is None
+
+        # Uploading the original again brings the missing pages back
+        monkeypatch.undo()
+        again = await run_job(upload_job(tmp_path, "f1", pages, previous=record), run_ingest_job)
+        assert again.status == "completed", again.error
+        assert len(file_points("f1")) == chunks_before
+        assert (await get_file_record("f1"))["content_hash"] == first.content_hash
+
+    run_backend(scenario)
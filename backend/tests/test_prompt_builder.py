@@ -0,0 +1,23 @@
+import prompt_builder
+from prompt_builder import TRUNCATION_MARK, build_answer_prompt, count_tokens
+
+LONG = "word " * 2000
+
+
+def history(n, content=LONG):
+    return [{"role": "human" if i % 2 == 0 else "assistant", "content": content} for i in range(n)]
+
+
+def test_only_messages_that_are_used_count_as_truncated():
+    _, stats = build_answer_prompt("question", [{"content": "a short chunk"}], history(20), budget=2000)
+    assert 0 < stats["messages_used"] < 20
+    assert stats["truncated"] == stats["messages_used"]
+
+
+def test_history_leaves_room_for_the_top_chunk(monkeypatch):
+    # Without the reserve, history could take the whole budget: the chunk became just the mark
+    monkeypatch.setattr(prompt_builder, "HISTORY_BUDGET_FRACTION", 1.0)
+    _, stats = build_answer_prompt("question", [{"content": LONG}], history(100, "word " * 8), budget=900)
+    assert stats["chunks_used"] == 1
+    assert stats["context_tokens"] > count_tokens(TRUNCATION_MARK) + 200
+    assert stats["prompt_tokens"] <= stats["budget"]
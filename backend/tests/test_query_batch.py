@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+def post_batch(queries):
+    # No lifespan: retrieval and generation are replaced, nothing else is used
+    client = TestClient(main.app)
+    response = client.post("/query_batch", json={"queries": queries})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return lines[:-1], lines[-1]
+
+
+@pytest.fixture
+def fake_generation(monkeypatch):
+    def generate_answer(query, retrieved_docs, **kwargs):
+        return {"answer": f"answer to {query}", "sources": []}
+
+    monkeypatch.setattr(main, "generate_answer", generate_answer)
+
+
+def test_failed_slice_reports_its_questions_and_answers_the_rest(monkeypatch, fake_generation):
+    monkeypatch.setattr(main, "QUERY_BATCH_SEARCH_SIZE", 1)
+
+    async def hybrid_search_batch(questions, scope, k):
+        if "broken" in questions:
+            raise RuntimeError("Qdrant unavailable")
+        return [[] for _ in questions]
+
+    monkeypatch.setattr(main, "hybrid_search_batch", hybrid_search_batch)
+    results, done = post_batch(["fine", "broken", "fine"])
+
+    by_index = {result["index"]: result for result in results}
+    assert sorted(by_index) == [0, 1, 2]
+    assert by_index[0]["answer"] == by_index[2]["answer"] == "answer to fine"
+    assert "Qdrant unavailable" in by_index[1]["error"]
+    assert done["done"] and done["errors"] == 1
+
+
+def test_retrieval_crashing_outside_a_slice_ends_the_stream(monkeypatch, fake_generation):
+    # A slice size of 0 makes building the slices themselves raise
+    monkeypatch.setattr(main, "QUERY_BATCH_SEARCH_SIZE", 0)
+    results, done = post_batch(["one", "two"])
+
+    assert sorted(result["index"] for result in results) == [0, 1]
+    assert all("Retrieval failed" in result["error"] for result in results)
+    assert done["errors"] == 2
+
+
+def test_questions_missing_from_the_results_get_an_error(monkeypatch, fake_generation):
+    async def hybrid_search_batch(questions, scope, k):
+        return [[] for _ in questions[:-1]]
+
+    monkeypatch.setattr(main, "hybrid_search_batch", hybrid_search_batch)
+    results, done = post_batch(["one", "two", "three"])
+
+    assert len(results) == 3
+    assert done["errors"] == 3
@@ -0,0 +1,39 @@
+import query_cache
+from query_cache import QueryEmbeddingCache
+
+
+def disk_cache(tmp_path, **kwargs) -> QueryEmbeddingCache:
+    return QueryEmbeddingCache(model_id="test", disk_path=str(tmp_path / "queries.db"), **kwargs)
+
+
+def put(cache: QueryEmbeddingCache, query: str):
+    cache.put(query, [0.5, 0.5], [1, 2], [1.0, 1.0])
+
+
+def test_disk_tier_prunes_least_recently_used_rows(tmp_path):
+    cache = disk_cache(tmp_path, max_entries=1, disk_max_rows=10)
+    for i in range(10):
+        put(cache, f"question {i}")
+    # Read from disk (the memory tier holds one entry): now the most recent
+    assert cache.get("question 0") is not None
+
+    put(cache, "question 10")
+    assert cache.stats()["disk_rows"] == 9
+    assert cache.stats()["disk_evictions"] == 2
+    assert cache.get("question 0") is not None
+    assert cache.get("question 1") is None
+
+
+def test_disk_tier_sweeps_expired_rows_and_survives_a_restart(tmp_path, monkeypatch):
+    cache = disk_cache(tmp_path, ttl_seconds=60)
+    put(cache, "old question")
+    cache._disk.execute("UPDATE query_embeddings SET created_at = created_at - 120")
+
+    monkeypatch.setattr(query_cache, "DISK_SWEEP_SECONDS", 0)
+    put(cache, "new question")
+    assert cache.stats()["disk_rows"] == 1
+    cache._commit()
+
+    reopened = disk_cache(tmp_path, ttl_seconds=60)
+    assert reopened.stats()["disk_rows"] == 1
+    assert reopened.get("new question") is not None
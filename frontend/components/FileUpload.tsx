@@ -49,7 +49,7 @@ export default function FileUpload({ onUploadSuccess }: FileUploadProps) {
     } catch (error: any) {
       setUploadStatus({
         type: 'error',
-        message: error.response?.data?.detail || 'Failed to upload file',
+        message: error.response?.data?.detail || error.message || 'Failed to upload file',
       });
     } finally {
       setUploading(false);
@@ -13,6 +13,10 @@ export interface FileInfo {
   file_id: string;
   filename: string;
   chunks: number;
+  pages?: number;
+  file_size?: number | null;
+  ingest_seconds?: number | null;
+  created_at?: string;
 }
 
 export interface QuerySource {
@@ -71,10 +75,48 @@ export interface UploadResponse {
   file_path: string;
   file_size: number;
   chunks_created: number;
+  duplicate?: boolean;
+  saved?: { bytes?: number; seconds?: number | null; pages?: number; chunks?: number };
 }
 
-// Upload PDF file
-export const uploadPDF = async (file: File): Promise<UploadResponse> => {
+export interface IngestJob {
+  job_id: string;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  stage: string;
+  file_uuid: string;
+  original_filename: string;
+  file_path: string;
+  file_size: number;
+  progress: {
+    pages: number;
+    chunks_total: number;
+    chunks_embedded: number;
+    chunks_upserted: number;
+    pages_reused: number;
+    chunks_reused: number;
+  };
+  timings: Record<string, number>;
+  result: {
+    chunks_created: number;
+    chunks_total: number;
+    saved?: { pages: number; chunks: number; text_bytes: number; seconds_estimate: number | null };
+  } | null;
+  error: string | null;
+}
+
+const INGEST_POLL_INTERVAL_MS = 1000;
+
+// Get the status of a background ingestion job
+export const getIngestJob = async (jobId: string): Promise<IngestJob> => {
+  const response = await api.get(`/ingest_jobs/${jobId}`);
+  return response.data;
+};
+
+// Upload PDF file and wait until the backend has finished ingesting it
+export const uploadPDF = async (
+  file: File,
+  onProgress?: (job: IngestJob) => void
+): Promise<UploadResponse> => {
   const formData = new FormData();
   formData.append('file', file);
 
@@ -84,7 +126,33 @@ export const uploadPDF = async (file: File): Promise<UploadResponse> => {
     },
   });
 
-  return response.data;
+  // Identical PDF was already ingested, nothing to wait for
+  if (!response.data.job_id) {
+    return response.data;
+  }
+
+  // Ingestion runs in the background; poll the job until it finishes
+  const jobId: string = response.data.job_id;
+  while (true) {
+    const job = await getIngestJob(jobId);
+    onProgress?.(job);
+    if (job.status === 'completed') {
+      return {
+        message: 'PDF uploaded successfully',
+        uuid: job.file_uuid,
+        original_filename: job.original_filename,
+        file_path: job.file_path,
+        file_size: job.file_size,
+        chunks_created: job.result?.chunks_total ?? job.progress.chunks_upserted,
+        duplicate: response.data.duplicate,
+        saved: job.result?.saved,
+      };
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Ingestion failed');
+    }
+    await new Promise((resolve) => setTimeout(resolve, INGEST_POLL_INTERVAL_MS));
+  }
 };
 
 // List all files